@@ -0,0 +1,135 @@
+"""
+Benchmark de la actualización de datos contra el servidor local de Eurostat
+============================================================================
+
+Arranca eurostat_standin en un puerto libre, ejecuta la actualización completa
+(update_all_data.py --force, o los ETL indicados con --script) en un directorio de
+trabajo temporal apuntando EUROSTAT_BASE_URL al servidor, y reporta:
+- Tiempo total de la actualización
+- Filas generadas y filas/s
+- Peticiones atendidas por el servidor (429, 503, S:Fault servidos, bytes)
+- Unidades por estado según data/manifest/
+
+Los datos reales de data/ no se tocan.
+
+Uso:
+    python3 benchmark_etl.py                                   # Todo, sin fallos inyectados
+    python3 benchmark_etl.py --latency 0.3 --throttle-rate 0.1 # Servidor lento y con 429
+    python3 benchmark_etl.py --script etl_partners.py --from-year 2020
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from eurostat_standin import add_config_arguments, config_from_args, start_server
+from partner_rollups import ROLLUP_DIRNAME
+from run_manifest import load_manifest, summarize
+
+BASE_DIR = Path(__file__).resolve().parent
+MANIFEST_STAGES = ['aggregate', 'partners_goods', 'partners_services']
+
+
+def count_output_rows(workdir):
+    """Filas (sin cabecera) de los CSV generados, por subdirectorio de data/ (sin agregados derivados)"""
+    rows = {}
+    for csv_file in sorted((Path(workdir) / 'data').rglob('*.csv')):
+        if ROLLUP_DIRNAME in csv_file.parts:
+            continue
+        with open(csv_file, 'rb') as f:
+            n = sum(1 for _ in f) - 1
+        folder = csv_file.parent.name
+        rows[folder] = rows.get(folder, 0) + max(0, n)
+    return rows
+
+
+def run_benchmark(commands, workdir, base_url, verbose=False):
+    """Ejecuta los comandos en workdir contra base_url. Retorna (segundos, código de salida)"""
+    env = dict(os.environ, EUROSTAT_BASE_URL=base_url, PYTHONUNBUFFERED='1')
+    log_file = Path(workdir) / 'benchmark.log'
+    returncode = 0
+
+    start = time.time()
+    with open(log_file, 'w', encoding='utf-8') as log:
+        for command in commands:
+            print(f"▶️  {' '.join(command[1:])}")
+            result = subprocess.run(command, cwd=workdir, env=env, text=True,
+                                    stdout=None if verbose else log, stderr=subprocess.STDOUT)
+            returncode = returncode or result.returncode
+    return time.time() - start, returncode
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de los ETL contra el servidor local de Eurostat')
+    parser.add_argument('--script', action='append', default=[],
+                        help='ETL a ejecutar (repetible); por defecto update_all_data.py --force')
+    parser.add_argument('--etl-args', default='',
+                        help='Argumentos extra para los ETL (p.ej. "--sequential --max-requests 4")')
+    parser.add_argument('--workdir', default=None, help='Directorio de trabajo (por defecto, uno temporal)')
+    parser.add_argument('--keep', action='store_true', help='Conservar el directorio de trabajo')
+    parser.add_argument('--verbose', action='store_true', help='Mostrar la salida de los ETL')
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = start_server(config_from_args(args))
+    workdir = Path(args.workdir) if args.workdir else Path(tempfile.mkdtemp(prefix='bench_etl_'))
+    workdir.mkdir(parents=True, exist_ok=True)
+
+    extra_args = args.etl_args.split()
+    if args.script:
+        commands = [['python3', str(BASE_DIR / script), '--force', *extra_args] for script in args.script]
+    else:
+        commands = [['python3', str(BASE_DIR / 'update_all_data.py'), '--force', *extra_args]]
+
+    print("=" * 80)
+    print("BENCHMARK ETL - SERVIDOR LOCAL DE EUROSTAT")
+    print("=" * 80)
+    print(f"🧪 Servidor: {server.base_url} (latencia {args.latency}s, 429 {args.throttle_rate:.0%}, "
+          f"503 {args.error_rate:.0%}, S:Fault {args.fault_rate:.0%}, goteo {args.drip_rate or '-'} B/s)")
+    print(f"📁 Directorio de trabajo: {workdir}")
+
+    try:
+        elapsed, returncode = run_benchmark(commands, workdir, server.base_url, args.verbose)
+    finally:
+        server.shutdown()
+
+    rows = count_output_rows(workdir)
+    total_rows = sum(rows.values())
+    stats = server.stats
+
+    print(f"\n{'='*80}")
+    print("📊 RESULTADOS")
+    print(f"{'='*80}")
+    print(f"⏱️  Tiempo total: {elapsed:.1f}s ({'OK' if returncode == 0 else f'código de salida {returncode}'})")
+    print(f"📄 Filas generadas: {total_rows:,} ({total_rows / elapsed:,.0f} filas/s)")
+    for folder, n in rows.items():
+        print(f"   - {folder}: {n:,}")
+    print(f"🌐 Peticiones: {stats.get('requests', 0)} "
+          f"({', '.join(f'{code}={n}' for code, n in sorted(stats.get('by_status', {}).items()))}), "
+          f"{stats.get('bytes', 0) / 1024 / 1024:.1f} MB servidos, {stats.get('rows', 0):,} filas servidas")
+    print(f"   Fallos inyectados: 429={stats.get('throttled', 0)}, 503={stats.get('errors', 0)}, "
+          f"S:Fault={stats.get('faults', 0)}")
+
+    for stage in MANIFEST_STAGES:
+        data = load_manifest(stage, workdir)
+        if data is None:
+            continue
+        summary = summarize(data)
+        counts = ', '.join(f"{status}={n}" for status, n in sorted(summary['by_status'].items()))
+        print(f"📋 {stage}: {summary['units']} unidades ({counts})")
+
+    if args.keep or args.workdir:
+        print(f"\n📁 Resultados conservados en {workdir} (log: {workdir / 'benchmark.log'})")
+    else:
+        shutil.rmtree(workdir)
+
+    sys.exit(returncode)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+"""
+Benchmark de la interpolación trimestral -> mensual del ETL de servicios
+=========================================================================
+
+Reconstruye el CSV trimestral de BOP a partir de data/services/datos_servicios_cache.csv
+(primer mes de cada trimestre × 3) y mide el camino que usa el ETL (parse_eurostat_table +
+interpolate_quarterly_table + write_table_csv: un solo parseo a tabla tipada) frente a la
+implementación original con csv.DictReader, copiada aquí como referencia. Comprueba que el
+CSV que escribe es idéntico byte a byte y reporta tiempos y speedup.
+
+También mide la versión por columnas sobre texto que usó el ETL antes de la tabla tipada
+(interpolate_columnar, copiada aquí) y comprueba que su salida es idéntica.
+
+Uso:
+    python3 benchmark_interpolation.py               # Caché actual
+    python3 benchmark_interpolation.py --scale 20    # Dataset 20 veces mayor (más partners/items)
+"""
+
+import argparse
+import contextlib
+import csv
+import io
+import os
+import sys
+import tempfile
+import time
+from io import StringIO
+
+import pandas as pd
+
+import numpy as np
+
+from etl_loader_completo import (CSV_CACHE_FILE_SERVICES, _csv_cell, _csv_lines, interpolate_quarterly_table,
+                                 parse_eurostat_table, write_table_csv)
+
+# Filas límite para comprobar que las versiones sobre texto tratan igual los casos raros
+EDGE_CASE_ROWS = [
+    ('2024-Q1', ''),        # Sin valor: se expande conservando el vacío
+    ('2024-Q2', ':'),       # Valor confidencial
+    ('2024-Q3', 'abc'),     # No numérico: se mantiene sin expandir
+    ('2024-Q5', '10.00'),   # Trimestre inexistente
+    ('2024-05', '7.00'),    # Ya mensual
+    ('2024-Q4-X', '9.00'),  # Formato no reconocido
+    ('2024-Q4', '-1.005'),  # Redondeo de negativos
+]
+
+# Casos límite que acepta la validación del ETL (el resto de EDGE_CASE_ROWS se rechaza entero)
+TYPED_EDGE_CASE_ROWS = [
+    ('2024-Q1', ''),        # Sin valor: se expande conservando el vacío
+    ('2024-Q3', '12'),      # Entero
+    ('2024-Q4', '-1.005'),  # Redondeo de negativos
+]
+INVALID_EDGE_CASE_ROWS = [('2024-Q3', 'abc'), ('2024-Q5', '10.00'), ('2024-05', '7.00'), ('2024-Q4-X', '9.00')]
+
+
+def interpolate_rowwise(csv_content: str) -> str:
+    """Implementación anterior (csv.DictReader fila a fila), sin los mensajes de progreso"""
+    reader = csv.DictReader(StringIO(csv_content))
+    header = reader.fieldnames
+
+    if not header or 'TIME_PERIOD' not in header or 'OBS_VALUE' not in header:
+        return csv_content
+
+    rows_interpolated = []
+    quarter_to_months = {
+        'Q1': ['01', '02', '03'],
+        'Q2': ['04', '05', '06'],
+        'Q3': ['07', '08', '09'],
+        'Q4': ['10', '11', '12']
+    }
+
+    for row in reader:
+        time_period = row.get('TIME_PERIOD', '')
+        obs_value = row.get('OBS_VALUE', '')
+
+        if '-Q' in time_period:
+            try:
+                year, quarter = time_period.split('-')
+                if quarter in quarter_to_months:
+                    if obs_value and obs_value != ':' and obs_value != '':
+                        monthly_value = float(obs_value) / 3.0
+                        for month in quarter_to_months[quarter]:
+                            new_row = row.copy()
+                            new_row['TIME_PERIOD'] = f"{year}-{month}"
+                            new_row['OBS_VALUE'] = f"{monthly_value:.2f}"
+                            rows_interpolated.append(new_row)
+                    else:
+                        for month in quarter_to_months[quarter]:
+                            new_row = row.copy()
+                            new_row['TIME_PERIOD'] = f"{year}-{month}"
+                            rows_interpolated.append(new_row)
+                else:
+                    rows_interpolated.append(row)
+            except (ValueError, AttributeError):
+                rows_interpolated.append(row)
+        else:
+            rows_interpolated.append(row)
+
+    output = StringIO()
+    writer = csv.DictWriter(output, fieldnames=header)
+    writer.writeheader()
+    writer.writerows(rows_interpolated)
+    return output.getvalue()
+
+
+def interpolate_columnar(csv_content: str) -> str:
+    """
+    Versión por columnas sobre texto (la del ETL antes de la tabla tipada), sin los mensajes
+    de progreso: periodos y valores se interpretan una vez por valor distinto, los trimestres
+    se expanden con un único np.repeat y cada serie se serializa una sola vez. Acepta CSV
+    sin validar (trimestres inexistentes, valores no numéricos...) igual que la fila a fila.
+    """
+    df = pd.read_csv(io.StringIO(csv_content), dtype=str, keep_default_na=False)
+    header = list(df.columns)
+
+    if 'TIME_PERIOD' not in header or 'OBS_VALUE' not in header:
+        return csv_content
+
+    # 1. Periodos distintos -> (trimestre reconocido, los 3 meses 'YYYY-MM')
+    period_codes, periods = pd.factorize(df['TIME_PERIOD'], use_na_sentinel=False)
+    period_is_quarter = np.zeros(len(periods), dtype=bool)
+    period_months = np.empty((len(periods), 3), dtype=object)
+    for i, period in enumerate(periods):
+        parts = period.split('-')
+        if '-Q' in period and len(parts) == 2 and parts[1] in ('Q1', 'Q2', 'Q3', 'Q4'):
+            first_month = (int(parts[1][1]) - 1) * 3 + 1
+            period_is_quarter[i] = True
+            period_months[i] = [f"{parts[0]}-{first_month + k:02d}" for k in range(3)]
+        else:
+            period_months[i] = [period] * 3
+
+    # 2. Valores distintos -> (tiene valor, valor mensual formateado o None si no es numérico)
+    value_codes, values = pd.factorize(df['OBS_VALUE'], use_na_sentinel=False)
+    value_present = np.array([value not in ('', ':') for value in values], dtype=bool)
+    value_monthly = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        value_monthly[i] = value
+        if value_present[i]:
+            try:
+                value_monthly[i] = f"{float(value) / 3.0:.2f}"
+            except ValueError:
+                value_monthly[i] = None
+
+    is_quarter = period_is_quarter[period_codes]
+    has_value = value_present[value_codes]
+    parsed = np.array([v is not None for v in value_monthly], dtype=bool)[value_codes]
+
+    # Trimestres con valor no numérico se mantienen sin expandir
+    expand = is_quarter & (~has_value | parsed)
+
+    # 3. Expandir: 3 filas por trimestre, 1 por el resto
+    repeats = np.where(expand, 3, 1)
+    positions = np.repeat(np.arange(len(df)), repeats)
+    offsets = np.arange(len(positions)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+    expanded = expand[positions]
+
+    period_text = np.array([_csv_cell(p) for p in periods], dtype=object)[period_codes[positions]]
+    period_text[expanded] = period_months[period_codes[positions][expanded], offsets[expanded]]
+
+    value_text = np.array([_csv_cell(v) for v in values], dtype=object)[value_codes[positions]]
+    with_value = expanded & has_value[positions]
+    value_text[with_value] = value_monthly[value_codes[positions][with_value]]
+
+    # 4. Serializar: fragmentos de cada serie alrededor de TIME_PERIOD y OBS_VALUE
+    lines = _csv_lines(df, positions, period_text, value_text)
+    return '\r\n'.join([','.join(_csv_cell(c) for c in header), *lines]) + '\r\n'
+
+
+def quarterly_from_cache(cache_file, scale=1):
+    """CSV trimestral equivalente al que descarga etl_loader_completo (antes de interpolar)"""
+    df = pd.read_csv(cache_file, dtype=str, keep_default_na=False)
+    month = df['TIME_PERIOD'].str[5:7].astype(int)
+    df = df[(month - 1) % 3 == 0].copy()
+    df['TIME_PERIOD'] = df['TIME_PERIOD'].str[:4] + '-Q' + ((month[df.index] - 1) // 3 + 1).astype(str)
+    df['OBS_VALUE'] = pd.to_numeric(df['OBS_VALUE'], errors='coerce').mul(3).map(
+        lambda v: '' if pd.isna(v) else f"{v:.2f}")
+
+    if scale > 1:
+        copies = []
+        for i in range(scale):
+            copy = df.copy()
+            copy['partner'] = copy['partner'] + ('' if i == 0 else f' #{i}')
+            copies.append(copy)
+        df = pd.concat(copies, ignore_index=True)
+
+    return df.to_csv(index=False)
+
+
+def edge_case_csv(rows=EDGE_CASE_ROWS):
+    """CSV pequeño con casos límite (filas de periodo y valor)"""
+    lines = ['DATAFLOW,geo,"partner, label",TIME_PERIOD,OBS_VALUE']
+    lines += [f'BOP,Spain,"Rest, of the world",{period},{value}' for period, value in rows]
+    return '\n'.join(lines) + '\n'
+
+
+def interpolate_typed(csv_content: str) -> str:
+    """Camino del ETL: parseo y validación a tabla tipada, interpolación y escritura del CSV"""
+    table = interpolate_quarterly_table(parse_eurostat_table(csv_content, frequency='Q'))
+    fd, tmp_file = tempfile.mkstemp(suffix='.csv')
+    os.close(fd)
+    try:
+        write_table_csv(table, tmp_file)
+        with open(tmp_file, 'r', encoding='utf-8', newline='') as f:
+            return f.read()
+    finally:
+        os.remove(tmp_file)
+
+
+def timed(function, csv_content, repeat):
+    """Mejor tiempo de repeat ejecuciones (silenciando los print) y la salida"""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = function(csv_content)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de la interpolación trimestral -> mensual')
+    parser.add_argument('--cache', default=CSV_CACHE_FILE_SERVICES, help='CSV de servicios en caché')
+    parser.add_argument('--scale', type=int, default=1, help='Multiplicar el dataset (copias con otros partners)')
+    parser.add_argument('--repeat', type=int, default=5, help='Repeticiones (se toma el mejor tiempo)')
+    args = parser.parse_args()
+
+    # 1. Equivalencia en casos límite
+    for name, function, rows in (('por columnas', interpolate_columnar, EDGE_CASE_ROWS),
+                                 ('tabla tipada', interpolate_typed, TYPED_EDGE_CASE_ROWS)):
+        expected = interpolate_rowwise(edge_case_csv(rows))
+        with contextlib.redirect_stdout(io.StringIO()):
+            actual = function(edge_case_csv(rows))
+        if actual != expected:
+            print(f"✗ Los casos límite no coinciden ({name})")
+            print(expected)
+            print(actual)
+            sys.exit(1)
+        print(f"✓ Casos límite idénticos, {name} ({len(rows)} filas)")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        accepted = [row for row in INVALID_EDGE_CASE_ROWS
+                    if parse_eurostat_table(edge_case_csv([row]), frequency='Q') is not None]
+    if accepted:
+        print(f"✗ La validación del ETL acepta filas no válidas: {accepted}")
+        sys.exit(1)
+    print(f"✓ La validación del ETL rechaza los casos no válidos ({len(INVALID_EDGE_CASE_ROWS)} filas)")
+
+    # 2. Benchmark sobre la caché real
+    csv_content = quarterly_from_cache(args.cache, args.scale)
+    n_rows = csv_content.count('\n') - 1
+    print(f"📂 {args.cache} → {n_rows:,} filas trimestrales (scale={args.scale})")
+
+    rowwise_seconds, expected = timed(interpolate_rowwise, csv_content, args.repeat)
+    columnar_seconds, actual = timed(interpolate_columnar, csv_content, args.repeat)
+    typed_seconds, typed = timed(interpolate_typed, csv_content, args.repeat)
+
+    if actual != expected:
+        print("✗ La salida no coincide con la implementación fila a fila")
+        sys.exit(1)
+    if typed != expected:
+        print("✗ La tabla tipada no coincide con la implementación fila a fila")
+        sys.exit(1)
+
+    print(f"✓ Salida idéntica ({len(actual):,} bytes, {actual.count(chr(10)) - 1:,} filas mensuales)")
+    print(f"⏱️  Fila a fila (csv.DictReader): {rowwise_seconds * 1000:8.1f} ms")
+    print(f"⏱️  Por columnas (pandas/numpy):  {columnar_seconds * 1000:8.1f} ms  "
+          f"🚀 {rowwise_seconds / columnar_seconds:.1f}x")
+    print(f"⏱️  Tabla tipada (ETL):          {typed_seconds * 1000:8.1f} ms  "
+          f"🚀 {rowwise_seconds / typed_seconds:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Informe de memoria de las tablas de socios que cachea el widget
+================================================================
+
+Para cada uno de los países con caché de socios carga las tablas que guarda
+load_partners_data (imports, exports, totales mensuales y agregados) de
+bienes y servicios, con la representación anterior (copiada aquí como referencia:
+todas las columnas de la caché, claves y periodos como texto) y con la actual
+(data_store.compact_frame: solo las columnas que usa el widget, claves category,
+TIME_PERIOD como índice de mes, float32 cuando es exacto). Comprueba que los valores
+son los mismos y reporta los bytes de cada país y el total.
+
+Las tablas de la pestaña "Balance por País" (unas miles de filas por país) no se incluyen.
+
+Uso:
+    python3 benchmark_memory.py               # Todos los países
+    python3 benchmark_memory.py --countries ES FR DE
+"""
+
+import argparse
+import re
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from data_store import compact_frame, frame_memory, month_dates, read_partitions
+from partner_rollups import build_rollups, read_rollups
+
+# Mismas rutas y columnas que load_partners_data (widget_balanza_completa.py)
+SOURCES = {
+    'goods': (Path('data/partners'), 'partners', ['partner', 'product', 'TIME_PERIOD', 'OBS_VALUE']),
+    'services': (Path('data/partners_services'), 'services_partners', ['partner', 'TIME_PERIOD', 'OBS_VALUE']),
+}
+PARTNER_KEYS = ['partner', 'product', 'flow_type', 'tipo']
+ROLLUP_KEYS = ['level', 'period', 'partner']
+FLOW_TYPES = {'imports': 'Importaciones', 'exports': 'Exportaciones'}
+
+
+def compact_partners(df):
+    return compact_frame(df, keys=PARTNER_KEYS, period='TIME_PERIOD', values=['OBS_VALUE'])
+
+
+def monthly_totals(rollups, flow_type, compact):
+    monthly = rollups[rollups['level'] == 'M']
+    totals = pd.DataFrame({
+        'partner': monthly['partner'].astype(str).to_numpy(),
+        'fecha': month_dates(monthly['period']).to_numpy(),
+        'TIME_PERIOD': monthly['period'].astype(str).to_numpy(),
+        'flow_type': flow_type,
+        'OBS_VALUE': monthly['OBS_VALUE'].to_numpy(),
+    })
+    return compact_partners(totals) if compact else totals
+
+
+def partner_tables(country_code, data_type, compact):
+    """Tablas que cachea load_partners_data (lectura por particiones), en la representación pedida"""
+    cache_dir, prefix, columns = SOURCES[data_type]
+    tables, rollups = {}, {}
+    for flow_key, flow_type in FLOW_TYPES.items():
+        csv_file = cache_dir / f'{prefix}_{country_code}_{flow_key}.csv'
+        if compact:
+            df = read_partitions(csv_file, columns=columns)
+        else:
+            df = read_partitions(csv_file)  # Representación anterior: todas las columnas
+        df['flow_type'] = flow_type
+        if not compact:
+            df['TIME_PERIOD'] = df['TIME_PERIOD'].astype(str)
+        df['fecha'] = month_dates(df['TIME_PERIOD'])
+        if data_type == 'services':
+            df['product'] = 'TOTAL'
+        elif not compact:
+            df['product'] = df['product'].astype(str)
+        tables[flow_key] = compact_partners(df) if compact else df
+
+        flow_rollups = read_rollups(csv_file)
+        if flow_rollups is None:
+            flow_rollups = build_rollups(df)
+        rollups[flow_key] = compact_frame(flow_rollups, keys=ROLLUP_KEYS) if compact else flow_rollups
+        tables[f'{flow_key}_total'] = monthly_totals(rollups[flow_key], flow_type, compact)
+
+    for flow_key, flow_rollups in rollups.items():
+        tables[f'rollups_{flow_key}'] = flow_rollups
+    return tables
+
+
+def same_values(before, after):
+    """True si las columnas de after tienen los mismos valores que en before"""
+    if len(before) != len(after):
+        return False
+    for column in after.columns:
+        old, new = before[column], after[column]
+        if pd.api.types.is_float_dtype(new) or pd.api.types.is_float_dtype(old):
+            if not np.array_equal(old.to_numpy('float64'), new.to_numpy('float64'), equal_nan=True):
+                return False
+        elif not (old.astype(str).to_numpy() == new.astype(str).to_numpy()).all():
+            return False
+    return True
+
+
+def available_countries():
+    """Códigos de país con caché de socios de bienes o servicios"""
+    countries = set()
+    for cache_dir, prefix, _ in SOURCES.values():
+        for path in cache_dir.glob(f'{prefix}_*_imports.csv'):
+            match = re.fullmatch(rf'{prefix}_([A-Z]{{2}})_imports\.csv', path.name)
+            if match and path.with_name(path.name.replace('_imports', '_exports')).exists():
+                countries.add(match[1])
+    return sorted(countries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memoria de las tablas de socios del widget (antes/después)")
+    parser.add_argument('--countries', nargs='+', help="Códigos ISO (por defecto todos los de la caché)")
+    args = parser.parse_args()
+
+    countries = args.countries or available_countries()
+    if not countries:
+        print("⚠️  No hay cachés de socios. Ejecuta primero etl_partners.py / etl_partners_services.py")
+        return
+
+    print("=" * 80)
+    print("INFORME DE MEMORIA - TABLAS DE SOCIOS DEL WIDGET")
+    print("=" * 80)
+    print(f"{'País':<6}{'Filas':>12}{'Antes (MB)':>14}{'Después (MB)':>14}{'Reducción':>12}  Valores")
+
+    total_rows = total_before = total_after = 0
+    all_same = True
+    started = time.time()
+    for country_code in countries:
+        rows = before_bytes = after_bytes = 0
+        same = True
+        for data_type, (cache_dir, prefix, _) in SOURCES.items():
+            if not (cache_dir / f'{prefix}_{country_code}_imports.csv').exists():
+                continue
+            before = partner_tables(country_code, data_type, compact=False)
+            after = partner_tables(country_code, data_type, compact=True)
+            for name, table in after.items():
+                rows += len(table)
+                before_bytes += frame_memory(before[name])
+                after_bytes += frame_memory(table)
+                same &= same_values(before[name], table)
+        total_rows += rows
+        total_before += before_bytes
+        total_after += after_bytes
+        all_same &= same
+        print(f"{country_code:<6}{rows:>12,}{before_bytes / 1e6:>14.1f}{after_bytes / 1e6:>14.1f}"
+              f"{before_bytes / max(after_bytes, 1):>11.1f}x  {'✅' if same else '❌'}")
+
+    print("-" * 80)
+    print(f"{'TOTAL':<6}{total_rows:>12,}{total_before / 1e6:>14.1f}{total_after / 1e6:>14.1f}"
+          f"{total_before / max(total_after, 1):>11.1f}x  {'✅' if all_same else '❌'}")
+    print(f"\n⏱️  {len(countries)} países en {time.time() - started:.1f}s")
+    if not all_same:
+        print("❌ La representación compacta cambia algún valor")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+"""
+Listas de códigos de las cachés agregadas (código SDMX -> nombre a mostrar)
+==========================================================================
+
+Los ETL de mercancías y servicios agregados piden los datos con labels=id: cada fila
+lleva los códigos de Eurostat (reporter 'ES', product '0', flow '2', geo 'EL',
+stk_flow 'CRE'...) en lugar de las etiquetas en inglés ("Spain (incl. Canary Islands
+'XB' from 1997)"). Los nombres en español se guardan una vez en una tabla pequeña,
+data/goods/codelists.csv (dimension, code, name), que el ETL escribe junto a la caché
+agregada (así se sustituye con su etapa de staging).
+
+El widget traduce con translate(): cada valor distinto una vez, no cada fila.
+Las cachés descargadas antes con labels=label_only siguen funcionando: LEGACY_LABELS
+lleva cada etiqueta antigua a su código (to_codes) y display_names() las incluye.
+"""
+
+import os
+from pathlib import Path
+
+import pandas as pd
+
+CODELIST_FILE = Path('data/goods/codelists.csv')
+CODELIST_COLUMNS = ['dimension', 'code', 'name']
+
+# Nombres a mostrar por dimensión (código -> nombre)
+CODELISTS = {
+    # Comext DS-059331 (mercancías)
+    'reporter': {
+        'AT': 'Austria', 'BE': 'Bélgica', 'BG': 'Bulgaria', 'HR': 'Croacia', 'CY': 'Chipre',
+        'CZ': 'República Checa', 'DK': 'Dinamarca', 'EE': 'Estonia', 'FI': 'Finlandia',
+        'FR': 'Francia', 'DE': 'Alemania', 'GR': 'Grecia', 'HU': 'Hungría', 'IE': 'Irlanda',
+        'IT': 'Italia', 'LV': 'Letonia', 'LT': 'Lituania', 'LU': 'Luxemburgo', 'MT': 'Malta',
+        'NL': 'Países Bajos', 'PL': 'Polonia', 'PT': 'Portugal', 'RO': 'Rumanía',
+        'SK': 'Eslovaquia', 'SI': 'Eslovenia', 'ES': 'España', 'SE': 'Suecia',
+        'GB': 'Reino Unido', 'NO': 'Noruega', 'CH': 'Suiza',
+        'EU27_2020': 'Unión Europea (27)',
+    },
+    'product': {
+        'TOTAL': 'Total Comercio',
+        '0': 'Alimentos y animales vivos',
+        '1': 'Bebidas y tabaco',
+        '2': 'Materiales crudos',
+        '3': 'Combustibles minerales',
+        '4': 'Aceites y grasas',
+        '5': 'Productos químicos',
+        '6': 'Manufacturas por material',
+        '7': 'Maquinaria y transporte',
+        '8': 'Manufacturas diversas',
+        '9': 'Otros',
+    },
+    'flow': {'1': 'importaciones', '2': 'exportaciones'},
+    # BOP_C6_Q (servicios): Grecia es EL y Reino Unido UK
+    'geo': {
+        'AT': 'Austria', 'BE': 'Bélgica', 'BG': 'Bulgaria', 'HR': 'Croacia', 'CY': 'Chipre',
+        'CZ': 'República Checa', 'DK': 'Dinamarca', 'EE': 'Estonia', 'FI': 'Finlandia',
+        'FR': 'Francia', 'DE': 'Alemania', 'EL': 'Grecia', 'HU': 'Hungría', 'IE': 'Irlanda',
+        'IT': 'Italia', 'LV': 'Letonia', 'LT': 'Lituania', 'LU': 'Luxemburgo', 'MT': 'Malta',
+        'NL': 'Países Bajos', 'PL': 'Polonia', 'PT': 'Portugal', 'RO': 'Rumanía',
+        'SK': 'Eslovaquia', 'SI': 'Eslovenia', 'ES': 'España', 'SE': 'Suecia',
+        'UK': 'Reino Unido',
+    },
+    'bop_item': {
+        'S': 'Servicios',
+        'SC': 'Servicios de Transporte',
+        'CA': 'Cuenta Corriente',
+    },
+    'stk_flow': {'CRE': 'exportaciones', 'DEB': 'importaciones'},
+}
+
+# Etiquetas de labels=label_only (cachés anteriores) -> código
+LEGACY_LABELS = {
+    'reporter': {
+        'Austria': 'AT',
+        "Belgium (incl. Luxembourg 'LU' -> 1998)": 'BE',
+        'Bulgaria': 'BG',
+        'Croatia': 'HR',
+        'Cyprus': 'CY',
+        'Czechia': 'CZ',
+        'Denmark': 'DK',
+        'Estonia': 'EE',
+        'Finland': 'FI',
+        ("France (incl. Saint Barthélemy 'BL' -> 2012; incl. French Guiana 'GF', Guadeloupe 'GP', "
+         "Martinique 'MQ', Réunion 'RE' from 1997; incl. Mayotte 'YT' from 2014)"): 'FR',
+        "Germany (incl. German Democratic Republic 'DD' from 1991)": 'DE',
+        'Greece': 'GR',
+        'Hungary': 'HU',
+        'Ireland (Eire)': 'IE',
+        "Italy (incl. San Marino 'SM' -> 1993)": 'IT',
+        'Latvia': 'LV',
+        'Lithuania': 'LT',
+        'Luxembourg': 'LU',
+        'Malta': 'MT',
+        'Netherlands': 'NL',
+        'Poland': 'PL',
+        'Portugal': 'PT',
+        'Romania': 'RO',
+        'Slovakia': 'SK',
+        'Slovenia': 'SI',
+        "Spain (incl. Canary Islands 'XB' from 1997)": 'ES',
+        'Sweden': 'SE',
+        'United Kingdom': 'GB',
+        "Norway (incl. Svalbard and Jan Mayen 'SJ' -> 1994 and again from 1997)": 'NO',
+        "Switzerland (incl. Liechtenstein 'LI' -> 1994)": 'CH',
+        ('European Union - 27 countries (AT, BE, BG, CY, CZ, DE, DK, EE, EL, ES, FI, FR, HR, HU, IE, '
+         'IT, LT, LU, LV, MT, NL, PL, PT, RO, SE, SI, SK)'): 'EU27_2020',
+    },
+    'partner': {'All countries of the world': 'WORLD', 'Rest of the world': 'WRL_REST'},
+    'product': {
+        'Total all products': 'TOTAL',
+        'Food and live animals': '0',
+        'Beverages and tobacco': '1',
+        'Crude materials, inedible, except fuels': '2',
+        'Mineral fuels, lubricants and related materials': '3',
+        'Animal and vegetable oils, fats and waxes': '4',
+        'Chemicals and related products, n.e.s.': '5',
+        'Manufactured goods classified chiefly by material': '6',
+        'Machinery and transport equipment': '7',
+        'Miscellaneous manufactured articles': '8',
+        'Commodities and transactions not classified elsewhere': '9',
+    },
+    'flow': {'IMPORT': '1', 'EXPORT': '2'},
+    'geo': {
+        'Austria': 'AT', 'Belgium': 'BE', 'Bulgaria': 'BG', 'Croatia': 'HR', 'Cyprus': 'CY',
+        'Czechia': 'CZ', 'Denmark': 'DK', 'Estonia': 'EE', 'Finland': 'FI', 'France': 'FR',
+        'Germany': 'DE', 'Greece': 'EL', 'Hungary': 'HU', 'Ireland': 'IE', 'Italy': 'IT',
+        'Latvia': 'LV', 'Lithuania': 'LT', 'Luxembourg': 'LU', 'Malta': 'MT', 'Netherlands': 'NL',
+        'Poland': 'PL', 'Portugal': 'PT', 'Romania': 'RO', 'Slovakia': 'SK', 'Slovenia': 'SI',
+        'Spain': 'ES', 'Sweden': 'SE', 'United Kingdom': 'UK',
+    },
+    'bop_item': {'Services': 'S', 'Services: transport': 'SC'},
+    'stk_flow': {'Credit': 'CRE', 'Debit': 'DEB'},
+    'freq': {'Monthly': 'M', 'Quarterly': 'Q'},
+    'indicators': {'VALUE_IN_EUROS': 'VALUE_EUR'},
+    'currency': {'Million euro': 'MIO_EUR'},
+    'sector10': {'Total economy': 'S1'},
+    'sectpart': {'Total economy': 'S1'},
+}
+
+
+def codelist_table(codelists=CODELISTS):
+    """Tabla (dimension, code, name) de las listas de códigos"""
+    rows = [(dimension, code, name) for dimension, names in codelists.items() for code, name in names.items()]
+    return pd.DataFrame(rows, columns=CODELIST_COLUMNS)
+
+
+def write_codelists(path=CODELIST_FILE):
+    """Guarda la tabla de códigos (escritura atómica). Retorna la ruta."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = path.with_suffix('.csv.tmp')
+    codelist_table().to_csv(tmp_file, index=False)
+    os.replace(tmp_file, path)
+    return path
+
+
+def load_codelists(path=CODELIST_FILE):
+    """{dimensión: {código: nombre}} desde la tabla guardada, o las listas incluidas si no existe"""
+    path = Path(path)
+    if not path.exists():
+        return {dimension: dict(names) for dimension, names in CODELISTS.items()}
+    table = pd.read_csv(path, dtype=str, keep_default_na=False)
+    codelists = {}
+    for dimension, code, name in table[CODELIST_COLUMNS].itertuples(index=False, name=None):
+        codelists.setdefault(dimension, {})[code] = name
+    return codelists
+
+
+def display_names(codelists, dimension):
+    """{valor: nombre} de una dimensión: sus códigos y las etiquetas antiguas de esos códigos"""
+    names = dict(codelists.get(dimension, {}))
+    for label, code in LEGACY_LABELS.get(dimension, {}).items():
+        if code in names:
+            names[label] = names[code]
+    return names
+
+
+def translate(values, names):
+    """
+    Valores de una columna (códigos o etiquetas antiguas) -> nombres, traduciendo cada
+    valor distinto una sola vez. Los valores sin nombre quedan como NaN.
+    """
+    codes, uniques = pd.factorize(values)
+    translated = pd.Index(uniques).map(names.get).append(pd.Index([None]))
+    # Código -1 (NaN) -> última posición = None
+    return pd.Series(translated.to_numpy()[codes], index=values.index, name=values.name)
+
+
+def values_for(names, name):
+    """Valores de una dimensión (código y etiquetas antiguas) que se muestran como name"""
+    return [value for value, value_name in names.items() if value_name == name]
+
+
+def to_codes(df):
+    """Sustituye en las columnas de una tabla las etiquetas antiguas por sus códigos"""
+    for column, codes in LEGACY_LABELS.items():
+        if column in df.columns and df[column].isin(codes.keys()).any():
+            df[column] = df[column].replace(codes)
+    return df
@@ -0,0 +1,395 @@
+"""
+Almacenamiento columnar de las cachés (Parquet junto a cada CSV)
+================================================================
+
+Los ETL siguen escribiendo CSV: es el formato de exportación y el que usan las
+actualizaciones incrementales para fusionar. Si pyarrow está instalado, cada CSV de
+caché se acompaña de un Parquet con el mismo nombre (extensión .parquet):
+- Columnas de texto como category: en Parquet van con dictionary encoding, así que
+  cadenas repetidas como 'ESTAT:DS-059331(1.0)' se guardan una vez por bloque
+- OBS_VALUE como float64 (vacío o ':' -> NaN)
+- Compresión zstd
+
+El widget lee con read_table(): el Parquet si está al día respecto al CSV (y solo las
+columnas pedidas), si no el CSV. Con BALANZA_PARQUET=0 no se escribe el Parquet.
+
+Las cachés grandes (mercancías agregadas y socios) se guardan además particionadas en
+<directorio de la caché>/store/reporter=<país>/flow=<flujo>/year=<año>/part.parquet:
+- Cachés por archivo (partners_ES_imports.csv): el archivo es un grupo (reporter, flow)
+- Cachés agregadas: se reparten por sus columnas reporter y flow
+read_partitions() abre solo los archivos de los países y años pedidos.
+
+compact_frame() da a las tablas que guarda el widget una representación compacta en
+memoria: claves como category, periodos como índice de mes y float32 cuando es exacto.
+"""
+
+import os
+import re
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401  (motor de pd.read_parquet / to_parquet)
+except ImportError:  # Sin pyarrow: solo CSV
+    pyarrow = None
+
+PARQUET_ENABLED = pyarrow is not None and os.environ.get('BALANZA_PARQUET', '1') != '0'
+PARQUET_COMPRESSION = 'zstd'
+
+# Columnas numéricas de las cachés (el resto se guarda como category)
+NUMERIC_COLUMNS = ['OBS_VALUE']
+MISSING_VALUES = ['', ':']
+
+# Almacén particionado
+STORE_DIRNAME = 'store'
+PARTITION_FILE = 'part.parquet'
+COMPLETE_MARKER = '_SUCCESS'  # Se escribe al final: grupo completo
+GROUP_FILE_PATTERN = re.compile(r'_(?P<reporter>[A-Z]{2})_(?P<flow>imports|exports)\.csv$')
+PARTITION_KEY_LENGTH = 60
+
+# Representación compacta del widget: enteros hasta 2**24 son exactos en float32
+FLOAT32_EXACT_LIMIT = 2 ** 24
+
+
+def parquet_path(csv_file):
+    """Ruta del Parquet que acompaña a un CSV de caché"""
+    return Path(csv_file).with_suffix('.parquet')
+
+
+def parquet_is_current(csv_file):
+    """True si hay Parquet legible y no es más antiguo que el CSV (o el CSV no existe)"""
+    if pyarrow is None:
+        return False
+    parquet_file = parquet_path(csv_file)
+    if not parquet_file.exists():
+        return False
+    csv_path = Path(csv_file)
+    return not csv_path.exists() or parquet_file.stat().st_mtime >= csv_path.stat().st_mtime
+
+
+def table_exists(csv_file):
+    """True si la caché existe en algún formato"""
+    return Path(csv_file).exists() or parquet_is_current(csv_file)
+
+
+def table_mtime(csv_file):
+    """Fecha de modificación de la caché (la del CSV, o la del Parquet si no hay CSV)"""
+    csv_path = Path(csv_file)
+    return (csv_path if csv_path.exists() else parquet_path(csv_file)).stat().st_mtime
+
+
+def to_storage_types(df):
+    """Tipos de almacenamiento: OBS_VALUE float64 y el resto de columnas category"""
+    typed = {}
+    for column in df.columns:
+        values = df[column]
+        if column in NUMERIC_COLUMNS:
+            if not pd.api.types.is_numeric_dtype(values):
+                values = pd.to_numeric(values.where(~values.isin(MISSING_VALUES)), errors='coerce')
+            typed[column] = values.astype('float64')
+        elif isinstance(values.dtype, pd.CategoricalDtype):
+            typed[column] = values
+        else:
+            typed[column] = values.astype(str).astype('category')
+    return pd.DataFrame(typed).reset_index(drop=True)
+
+
+def write_parquet(df, csv_file, partitioned=False):
+    """
+    Escribe el Parquet de una caché a partir de la tabla ya cargada (sin releer el CSV).
+    Si falla, se borra el Parquet anterior para que nadie lea datos desfasados.
+    partitioned: escribir también el almacén particionado (write_partitions)
+    Retorna la ruta escrita o None.
+    """
+    if not PARQUET_ENABLED:
+        return None
+    if partitioned:
+        write_partitions(df, csv_file)
+
+    parquet_file = parquet_path(csv_file)
+    tmp_file = parquet_file.with_suffix('.parquet.tmp')
+    try:
+        to_storage_types(df).to_parquet(tmp_file, index=False, compression=PARQUET_COMPRESSION)
+        os.replace(tmp_file, parquet_file)
+        return parquet_file
+    except Exception as e:
+        print(f"   ⚠️  No se pudo escribir {parquet_file.name}: {e}")
+        remove_parquet(csv_file)
+        tmp_file.unlink(missing_ok=True)
+        return None
+
+
+def sync_parquet(csv_file, partitioned=False):
+    """
+    Genera el Parquet (y con partitioned, el almacén particionado) de un CSV existente
+    si falta o está desfasado (p.ej. caché que no se descargó). El CSV se lee una vez.
+    """
+    if not PARQUET_ENABLED or not Path(csv_file).exists():
+        return None
+    write_mirror = not parquet_is_current(csv_file)
+    write_store = partitioned and not store_is_current(csv_file)
+    if not write_mirror and not write_store:
+        return None
+    try:
+        df = pd.read_csv(csv_file, dtype=str, keep_default_na=False)
+    except (ValueError, pd.errors.EmptyDataError):
+        remove_parquet(csv_file)
+        return None
+    if write_store:
+        write_partitions(df, csv_file)
+    return write_parquet(df, csv_file) if write_mirror else None
+
+
+def remove_parquet(csv_file):
+    """Borra el Parquet de una caché (p.ej. cuando el CSV se vacía) y sus particiones"""
+    parquet_path(csv_file).unlink(missing_ok=True)
+    target = group_dir(csv_file)
+    if target.exists():
+        shutil.rmtree(target)
+
+
+def partition_key(value):
+    """Nombre de directorio de un valor de partición (etiquetas largas -> texto corto y seguro)"""
+    return re.sub(r'[^A-Za-z0-9]+', '_', str(value)).strip('_')[:PARTITION_KEY_LENGTH] or '_'
+
+
+def store_dir(csv_file):
+    """Directorio del almacén particionado de una caché (junto al CSV, dentro de su etapa)"""
+    return Path(csv_file).parent / STORE_DIRNAME
+
+
+def group_dir(csv_file):
+    """
+    Directorio que se reescribe entero al actualizar la caché: reporter=XX/flow=YY para las
+    cachés por archivo, el almacén completo para las agregadas.
+    """
+    match = GROUP_FILE_PATTERN.search(Path(csv_file).name)
+    if match is None:
+        return store_dir(csv_file)
+    return (store_dir(csv_file) / f"reporter={partition_key(match['reporter'])}"
+            / f"flow={partition_key(match['flow'])}")
+
+
+def store_is_current(csv_file):
+    """True si las particiones de la caché están completas y no son más antiguas que el CSV"""
+    if pyarrow is None:
+        return False
+    marker = group_dir(csv_file) / COMPLETE_MARKER
+    if not marker.exists():
+        return False
+    csv_path = Path(csv_file)
+    return not csv_path.exists() or marker.stat().st_mtime >= csv_path.stat().st_mtime
+
+
+def _write_years(df, target):
+    """Un Parquet por año (year=YYYY/part.parquet) dentro de target"""
+    years = df['TIME_PERIOD'].astype(str).str[:4]
+    valid = years.str.fullmatch(r'\d{4}')  # Sin periodo válido no hay partición a la que ir
+    for year, part in df[valid].groupby(years[valid], sort=True):
+        year_dir = target / f"year={partition_key(year)}"
+        year_dir.mkdir(parents=True, exist_ok=True)
+        to_storage_types(part).to_parquet(year_dir / PARTITION_FILE, index=False,
+                                          compression=PARQUET_COMPRESSION)
+
+
+def write_partitions(df, csv_file):
+    """
+    Escribe el almacén particionado de una caché a partir de la tabla ya cargada.
+    Se escribe en un directorio temporal que sustituye al grupo anterior al terminar;
+    si falla, se borra el grupo para que los lectores vuelvan al CSV.
+    """
+    if not PARQUET_ENABLED or 'TIME_PERIOD' not in df.columns:
+        return None
+
+    target = group_dir(csv_file)
+    tmp_dir = target.with_name(target.name + '.tmp')
+    old_dir = target.with_name(target.name + '.old')
+    match = GROUP_FILE_PATTERN.search(Path(csv_file).name)
+    try:
+        for leftover in (tmp_dir, old_dir):
+            if leftover.exists():
+                shutil.rmtree(leftover)
+        if match is not None:
+            _write_years(df, tmp_dir)
+        else:
+            for (reporter, flow), group in df.groupby(['reporter', 'flow'], sort=True, observed=True):
+                _write_years(group, tmp_dir / f"reporter={partition_key(reporter)}" / f"flow={partition_key(flow)}")
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        (tmp_dir / COMPLETE_MARKER).touch()
+
+        if target.exists():
+            target.rename(old_dir)
+        tmp_dir.rename(target)
+        shutil.rmtree(old_dir, ignore_errors=True)
+        return target
+    except Exception as e:
+        print(f"   ⚠️  No se pudieron escribir las particiones de {Path(csv_file).name}: {e}")
+        for path in (tmp_dir, target):
+            shutil.rmtree(path, ignore_errors=True)
+        return None
+
+
+def _partition_files(csv_file, reporters=None, years=None):
+    """Archivos de las particiones que cumplen los filtros (solo se listan esos directorios)"""
+    if GROUP_FILE_PATTERN.search(Path(csv_file).name):
+        flow_dirs = [group_dir(csv_file)]
+    else:
+        root = store_dir(csv_file)
+        if reporters is None:
+            reporter_dirs = sorted(root.glob('reporter=*'))
+        else:
+            reporter_dirs = [root / f"reporter={partition_key(r)}" for r in reporters]
+        flow_dirs = [d for reporter_dir in reporter_dirs for d in sorted(reporter_dir.glob('flow=*'))]
+
+    files = []
+    for flow_dir in flow_dirs:
+        for year_dir in sorted(flow_dir.glob('year=*')):
+            year = int(year_dir.name.split('=', 1)[1])
+            if years is None or years[0] <= year <= years[1]:
+                files.append(year_dir / PARTITION_FILE)
+    return files
+
+
+def read_partitions(csv_file, reporters=None, years=None, columns=None):
+    """
+    Lee de una caché solo las filas de los reporters y años pedidos.
+    reporters: valores de la columna reporter (None = todos; ignorado en cachés por archivo)
+    years: (primer año, último año) inclusive, None = todos
+    Si el almacén no está al día se lee la caché completa (read_table) y se filtra en memoria.
+    """
+    if store_is_current(csv_file):
+        files = _partition_files(csv_file, reporters, years)
+        if not files:
+            # Ningún año pedido: tabla vacía con el esquema de cualquier partición
+            sample = _partition_files(csv_file, reporters)[:1]
+            return pd.read_parquet(sample[0], columns=columns).iloc[0:0] if sample else pd.DataFrame(columns=columns)
+        parts = [pd.read_parquet(f, columns=columns) for f in files]
+        return pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0]
+
+    extra = [] if columns is None else [c for c in ('reporter', 'TIME_PERIOD') if c not in columns]
+    df = read_table(csv_file, None if columns is None else columns + extra)
+    mask = pd.Series(True, index=df.index)
+    if reporters is not None and not GROUP_FILE_PATTERN.search(Path(csv_file).name):
+        mask &= df['reporter'].isin(reporters)
+    if years is not None:
+        year = pd.to_numeric(df['TIME_PERIOD'].astype(str).str[:4], errors='coerce')
+        mask &= year.between(years[0], years[1])
+    return df.loc[mask, columns or df.columns].reset_index(drop=True)
+
+
+def table_reporters(csv_file):
+    """Valores distintos de la columna reporter de una caché agregada"""
+    if store_is_current(csv_file):
+        reporters = []
+        for reporter_dir in sorted(store_dir(csv_file).glob('reporter=*')):
+            sample = next(reporter_dir.glob(f'flow=*/year=*/{PARTITION_FILE}'), None)
+            if sample is not None:
+                reporters.append(str(pd.read_parquet(sample, columns=['reporter'])['reporter'].iloc[0]))
+        return reporters
+    return list(read_table(csv_file, columns=['reporter'])['reporter'].dropna().unique())
+
+
+def period_bounds(csv_file, reporters=None):
+    """
+    Primer y último TIME_PERIOD de una caché (de los reporters pedidos) o None si está vacía.
+    Con el almacén solo se leen las particiones del primer y último año.
+    """
+    if store_is_current(csv_file):
+        files = _partition_files(csv_file, reporters)
+        if not files:
+            return None
+        file_years = [int(f.parent.name.split('=', 1)[1]) for f in files]
+        edges = [f for f, year in zip(files, file_years) if year in (min(file_years), max(file_years))]
+        periods = pd.concat([pd.read_parquet(f, columns=['TIME_PERIOD'])['TIME_PERIOD'].astype(str)
+                             for f in edges])
+    else:
+        periods = read_partitions(csv_file, reporters, columns=['TIME_PERIOD'])['TIME_PERIOD'].astype(str)
+    periods = periods[periods != '']
+    if periods.empty:
+        return None
+    return periods.min(), periods.max()
+
+
+def read_table(csv_file, columns=None, dtype=None):
+    """
+    Lee una caché: el Parquet si está al día (columnas tipadas, category), si no el CSV.
+    columns: columnas a leer (en Parquet solo se leen esas del disco)
+    dtype: tipos para el CSV (el Parquet ya viene tipado)
+    """
+    if parquet_is_current(csv_file):
+        return pd.read_parquet(parquet_path(csv_file), columns=columns)
+    return pd.read_csv(csv_file, usecols=columns, dtype=dtype)
+
+
+def month_dates(periods):
+    """
+    Periodos 'YYYY-MM' (texto o category) -> datetime64, convirtiendo cada periodo
+    distinto una sola vez en lugar de cada fila (como pd.to_datetime fila a fila).
+    """
+    codes, uniques = pd.factorize(periods)
+    dates = pd.to_datetime(pd.Index(uniques).astype(str), format='%Y-%m', errors='coerce')
+    # Código -1 (vacío) -> última posición = NaT
+    dates = np.append(dates.to_numpy(), np.datetime64('NaT', 'ns'))
+    return pd.Series(dates[codes], index=periods.index, name=periods.name)
+
+
+def month_index(periods):
+    """
+    Periodos 'YYYY-MM' -> category ordenada con todos los meses entre el primero y el
+    último: el código de cada fila es su índice de mes (0 = primer mes, int16).
+    Si hay periodos con otro formato se usan como categorías tal cual (ordenadas).
+    """
+    values = periods.astype(str)
+    uniques = pd.Index(values.unique())
+    months = pd.to_datetime(uniques, format='%Y-%m', errors='coerce')
+    if len(uniques) and not months.isna().any():
+        categories = pd.period_range(months.min(), months.max(), freq='M').strftime('%Y-%m')
+    else:
+        categories = uniques.sort_values()
+    return pd.Series(pd.Categorical(values, categories=categories, ordered=True),
+                     index=periods.index, name=periods.name)
+
+
+def compact_values(values):
+    """
+    float32 si la precisión lo permite: todos los valores son enteros exactos en float32
+    y la suma de sus módulos también (así cualquier suma que haga el widget es exacta).
+    Si no, float64.
+    """
+    values = values.astype('float64')
+    finite = values.dropna()
+    if (finite == np.round(finite)).all() and finite.abs().sum() < FLOAT32_EXACT_LIMIT:
+        return values.astype('float32')
+    return values
+
+
+def compact_frame(df, keys=(), period=None, values=()):
+    """
+    Representación compacta en memoria de una tabla del widget (mismos valores):
+    keys: columnas de clave -> category (diccionario + códigos int8/int16)
+    period: columna 'YYYY-MM' -> índice de mes (month_index)
+    values: columnas numéricas -> float32 donde la precisión lo permite (compact_values)
+    El resto de columnas se conserva tal cual.
+    """
+    compact = {}
+    for column in df.columns:
+        series = df[column]
+        if column in keys:
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                series = series.cat.remove_unused_categories()
+            else:
+                series = series.astype('category')
+        elif column == period:
+            series = month_index(series)
+        elif column in values:
+            series = compact_values(series)
+        compact[column] = series
+    return pd.DataFrame(compact, index=df.index)
+
+
+def frame_memory(df):
+    """Bytes que ocupa una tabla en memoria (incluye el contenido de las cadenas)"""
+    return int(df.memory_usage(deep=True, index=True).sum())
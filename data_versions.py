@@ -0,0 +1,171 @@
+"""
+Versiones de los datos de las cachés (claves de las cachés del widget)
+======================================================================
+
+Los ETL registran, tras escribir cada CSV de caché, la versión de su contenido en
+<directorio de la caché>/data_versions.json (record_version / sync_version):
+- hash: huella del archivo
+- reporters: en las cachés agregadas (columna reporter), una huella por país, para que
+  al actualizar solo cambie la versión de los países cuyos datos cambiaron
+- mtime_ns y size: fecha de modificación y tamaño del CSV registrado
+
+El widget usa data_version() como parte de la clave de sus cachés: una entrada vale
+mientras los datos no cambian. Una recarga completa (staging) que vuelve a escribir los
+mismos datos no cambia la versión. Si el CSV ya no coincide con lo registrado (se
+modificó fuera del ETL, o no hay registro), la versión es su fecha y tamaño.
+
+El archivo va dentro del directorio de la caché, así que se sustituye con su etapa de
+staging y cada etapa escribe el suyo. Se escribe con bloqueo entre procesos (como
+etl_cache.VERSIONS_FILE), porque los ETL registran versiones desde varios procesos.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: solo bloqueo entre hilos
+    fcntl = None
+
+import pandas as pd
+
+from data_store import GROUP_FILE_PATTERN, parquet_path
+
+VERSIONS_FILENAME = 'data_versions.json'
+HASH_CHUNK_BYTES = 1 << 20
+
+_versions_lock = threading.Lock()
+_loaded_versions = {}  # Ruta -> (mtime_ns del archivo, versiones leídas)
+
+
+def versions_path(csv_file):
+    """Archivo de versiones del directorio de una caché"""
+    return Path(csv_file).parent / VERSIONS_FILENAME
+
+
+def file_signature(csv_file):
+    """[mtime en ns, tamaño] del CSV de caché (o del Parquet si no hay CSV); None si no existe"""
+    for path in (Path(csv_file), parquet_path(csv_file)):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        return [stat.st_mtime_ns, stat.st_size]
+    return None
+
+
+def file_hash(path):
+    """Huella (sha1 abreviado) del contenido de un archivo"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def reporter_hashes(csv_file):
+    """{reporter: huella de sus filas} de una caché agregada, o None si no tiene columna reporter"""
+    try:
+        columns = pd.read_csv(csv_file, nrows=0).columns
+    except pd.errors.EmptyDataError:
+        return None
+    if 'reporter' not in columns:
+        return None
+    df = pd.read_csv(csv_file, dtype=str, keep_default_na=False)
+    hashes = {}
+    for reporter, group in df.groupby('reporter', sort=True):
+        row_hashes = pd.util.hash_pandas_object(group, index=False).to_numpy()
+        hashes[str(reporter)] = hashlib.sha1(row_hashes.tobytes()).hexdigest()[:16]
+    return hashes
+
+
+def _read_versions(path):
+    """Lee un archivo de versiones ({} si no existe o está dañado)"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+@contextmanager
+def _versions_file_lock(path):
+    """Bloqueo exclusivo de un archivo de versiones entre hilos y entre procesos"""
+    with _versions_lock:
+        if fcntl is None:
+            yield
+            return
+        with open(path.with_suffix('.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def load_versions(directory):
+    """{archivo: versión registrada} de un directorio de caché ({} si no hay registro)"""
+    path = Path(directory) / VERSIONS_FILENAME
+    try:
+        mtime_ns = path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return {}
+    loaded = _loaded_versions.get(path)
+    if loaded is not None and loaded[0] == mtime_ns:
+        return loaded[1]
+    versions = _read_versions(path)
+    _loaded_versions[path] = (mtime_ns, versions)
+    return versions
+
+
+def record_version(csv_file):
+    """Registra la versión de un CSV de caché recién escrito. Retorna la entrada (None si no existe)."""
+    csv_path = Path(csv_file)
+    if not csv_path.exists():
+        return None
+    mtime_ns, size = file_signature(csv_path)
+    entry = {'mtime_ns': mtime_ns, 'size': size, 'hash': file_hash(csv_path)}
+    if GROUP_FILE_PATTERN.search(csv_path.name) is None:
+        hashes = reporter_hashes(csv_path)
+        if hashes is not None:
+            entry['reporters'] = hashes
+
+    path = versions_path(csv_path)
+    with _versions_file_lock(path):
+        # Lectura sin memoria: otro proceso puede haberlo escrito en el mismo instante (mtime)
+        versions = _read_versions(path)
+        versions[csv_path.name] = entry
+        tmp_file = path.with_suffix(f'.{os.getpid()}.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(versions, f, indent=2, sort_keys=True)
+        os.replace(tmp_file, path)
+    return entry
+
+
+def sync_version(csv_file):
+    """Registra la versión de un CSV existente si falta o no corresponde al archivo actual"""
+    entry = load_versions(Path(csv_file).parent).get(Path(csv_file).name)
+    if entry is not None and [entry['mtime_ns'], entry['size']] == file_signature(csv_file):
+        return None
+    return record_version(csv_file)
+
+
+def data_version(csv_file, reporters=None):
+    """
+    Versión de los datos de una caché: la huella registrada por el ETL (con reporters, las
+    de esos países) o, si no hay registro al día, (mtime, tamaño) del archivo.
+    None si la caché no existe.
+    """
+    signature = file_signature(csv_file)
+    if signature is None:
+        return None
+    entry = load_versions(Path(csv_file).parent).get(Path(csv_file).name)
+    if entry is None or [entry['mtime_ns'], entry['size']] != signature:
+        return tuple(signature)
+    if reporters is not None and 'reporters' in entry:
+        return tuple(entry['reporters'].get(str(r)) for r in reporters)
+    return entry['hash']
@@ -0,0 +1,263 @@
+"""
+Utilidades de caché compartidas por los ETL
+============================================
+
+Actualización incremental (delta):
+- Se lee el último TIME_PERIOD ya presente en la caché
+- Se vuelve a pedir solo una ventana corta de revisión (REVISION_MONTHS) desde ese punto
+- El resultado se fusiona con la caché existente (upsert sobre las columnas clave)
+
+Versiones publicadas (evitar descargas sin cambios):
+- Cada etapa guarda en VERSIONS_FILE la versión de Eurostat que descargó
+  (anotación UPDATE_DATA, ETag, Last-Modified)
+- Antes de descargar se consulta la versión actual (metadatos, pocos KB) y, si
+  no ha cambiado, la etapa se salta por completo
+- VERSIONS_FILE se escribe con bloqueo entre procesos, porque update_all_data
+  ejecuta varias etapas a la vez
+"""
+
+import json
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+try:
+    import fcntl
+except ImportError:  # Windows: solo bloqueo entre hilos
+    fcntl = None
+
+import pandas as pd
+
+from eurostat_client import EurostatError, probe_dataset_version
+
+# Meses que se vuelven a descargar hacia atrás desde el último periodo en caché
+# (Eurostat revisa los datos recientes durante varios meses tras su publicación)
+REVISION_MONTHS = 12
+
+# Periodo inicial de la descarga completa
+FULL_START_PERIOD = '2002-01'
+
+# Zona horaria de las marcas de actualización de Eurostat que no indican desfase
+# (Luxemburgo; sin base de zonas horarias, CET fijo)
+try:
+    EUROSTAT_TIMEZONE = ZoneInfo('Europe/Luxembourg')
+except ZoneInfoNotFoundError:
+    EUROSTAT_TIMEZONE = timezone(timedelta(hours=1))
+
+# Versión de Eurostat descargada por cada etapa del pipeline
+VERSIONS_FILE = Path('data/dataset_versions.json')
+_versions_lock = threading.Lock()
+
+
+def period_to_month_index(period):
+    """
+    Convierte un periodo Eurostat a índice de mes absoluto (año * 12 + mes - 1).
+    Acepta 'YYYY-MM' y 'YYYY-Qn' (un trimestre cuenta como su último mes).
+    """
+    year, rest = str(period).strip().split('-')
+    if rest.upper().startswith('Q'):
+        month = int(rest[1:]) * 3
+    else:
+        month = int(rest)
+    return int(year) * 12 + month - 1
+
+
+def month_index_to_period(index):
+    """Índice de mes absoluto -> 'YYYY-MM'"""
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def month_to_quarter(period):
+    """'YYYY-MM' -> 'YYYY-Qn' (trimestre que contiene el mes)"""
+    year, month = period.split('-')
+    return f"{year}-Q{(int(month) - 1) // 3 + 1}"
+
+
+def latest_period(cache_file, period_column='TIME_PERIOD'):
+    """
+    Retorna el último periodo presente en un CSV de caché, o None si no hay caché utilizable.
+    """
+    path = Path(cache_file)
+    if not path.exists() or path.stat().st_size == 0:
+        return None
+
+    try:
+        periods = pd.read_csv(path, usecols=[period_column], dtype=str)[period_column].dropna()
+    except (ValueError, pd.errors.EmptyDataError):
+        return None
+
+    latest = None
+    for period in periods.unique():
+        try:
+            index = period_to_month_index(period)
+        except ValueError:
+            continue
+        if latest is None or index > latest:
+            latest = index
+
+    return month_index_to_period(latest) if latest is not None else None
+
+
+def revision_start(cache_files, months=REVISION_MONTHS, period_column='TIME_PERIOD'):
+    """
+    Primer mes ('YYYY-MM') de la ventana de revisión para una o varias cachés.
+
+    Con varias cachés (p.ej. imports + exports) se usa la más atrasada.
+    Retorna None si alguna caché no existe: en ese caso hay que hacer descarga completa.
+    """
+    if isinstance(cache_files, (str, Path)):
+        cache_files = [cache_files]
+
+    latest = []
+    for cache_file in cache_files:
+        period = latest_period(cache_file, period_column)
+        if period is None:
+            return None
+        latest.append(period_to_month_index(period))
+
+    start = min(latest) - months + 1
+    return max(FULL_START_PERIOD, month_index_to_period(start))
+
+
+def read_cache_csv(source):
+    """Lee un CSV de caché como texto (sin convertir tipos ni vacíos) para fusionarlo sin pérdidas"""
+    return pd.read_csv(source, dtype=str, keep_default_na=False)
+
+
+def upsert(existing, new, key_columns):
+    """
+    Fusiona filas nuevas en la caché existente: las filas con la misma clave se reemplazan.
+
+    Raises:
+        ValueError: si falta alguna columna clave en cualquiera de los dos DataFrames
+    """
+    missing = [c for c in key_columns if c not in existing.columns or c not in new.columns]
+    if missing:
+        raise ValueError(f"Columnas clave ausentes para fusionar: {missing}")
+
+    merged = pd.concat([existing, new], ignore_index=True)
+    merged = merged.drop_duplicates(subset=key_columns, keep='last')
+    return merged.sort_values(key_columns, kind='stable').reset_index(drop=True)
+
+
+def parse_update_timestamp(value):
+    """
+    Convierte una marca de actualización de Eurostat a datetime en UTC (con zona horaria).
+    Acepta ISO 8601 ('2026-01-12T23:00:00+0100') y el formato de la columna
+    'LAST UPDATE' de los CSV ('12/01/26 23:00:00'); las marcas sin desfase están en la
+    hora de Eurostat (EUROSTAT_TIMEZONE). Retorna None si no se reconoce.
+    """
+    if not value:
+        return None
+    value = str(value).strip()
+    stamp = None
+    for fmt in ('%Y-%m-%dT%H:%M:%S%z', '%Y-%m-%dT%H:%M:%S', '%d/%m/%y %H:%M:%S'):
+        try:
+            stamp = datetime.strptime(value, fmt)
+            break
+        except ValueError:
+            continue
+    if stamp is None:
+        try:
+            stamp = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if stamp.tzinfo is None:
+        stamp = stamp.replace(tzinfo=EUROSTAT_TIMEZONE)
+    return stamp.astimezone(timezone.utc)
+
+
+def cached_last_update(cache_file, column='LAST UPDATE'):
+    """Marca de actualización más reciente guardada en un CSV de caché (columna LAST UPDATE)"""
+    path = Path(cache_file)
+    if not path.exists() or path.stat().st_size == 0:
+        return None
+    try:
+        values = pd.read_csv(path, usecols=[column], dtype=str)[column].dropna().unique()
+    except (ValueError, pd.errors.EmptyDataError):
+        return None
+
+    stamps = [stamp for stamp in map(parse_update_timestamp, values) if stamp is not None]
+    return max(stamps).isoformat() if stamps else None
+
+
+def load_versions():
+    """Lee las versiones guardadas por etapa ({} si no hay archivo)"""
+    try:
+        with open(VERSIONS_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+@contextmanager
+def _versions_file_lock():
+    """Bloqueo exclusivo de VERSIONS_FILE entre hilos y entre procesos"""
+    with _versions_lock:
+        VERSIONS_FILE.parent.mkdir(parents=True, exist_ok=True)
+        if fcntl is None:
+            yield
+            return
+        with open(VERSIONS_FILE.with_suffix('.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def save_dataset_version(stage, version):
+    """Guarda la versión descargada por una etapa (solo tras una descarga correcta)"""
+    record = {k: v for k, v in version.items() if k != 'not_modified'}
+    record['saved_at'] = datetime.now().isoformat(timespec='seconds')
+
+    with _versions_file_lock():
+        versions = load_versions()
+        versions[stage] = record
+        tmp_file = VERSIONS_FILE.with_suffix(f'.{os.getpid()}.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(versions, f, indent=2, ensure_ascii=False)
+        tmp_file.replace(VERSIONS_FILE)
+
+
+def check_dataset_version(stage, dataflow, fallback_last_update=None):
+    """
+    Comprueba si Eurostat ha publicado datos nuevos desde la última descarga de la etapa.
+
+    Args:
+        stage (str): Nombre de la etapa (clave en VERSIONS_FILE)
+        dataflow (str): Dataflow de Eurostat ('DS-059331', 'BOP_C6_Q')
+        fallback_last_update (str): Marca conocida si la etapa aún no tiene versión guardada
+                                    (p.ej. la columna LAST UPDATE de la caché)
+
+    Returns:
+        tuple: (changed, version). changed=True si hay datos nuevos o no se pudo comprobar;
+               version es None si la consulta falló (usar entonces el TTL por antigüedad)
+    """
+    previous = load_versions().get(stage)
+
+    try:
+        version = probe_dataset_version(dataflow, previous)
+    except EurostatError as e:
+        print(f"⚠️  No se pudo consultar la versión de {dataflow}: {e}")
+        return True, None
+
+    if version['not_modified']:
+        return False, version
+
+    previous_update = parse_update_timestamp((previous or {}).get('last_update') or fallback_last_update)
+    current_update = parse_update_timestamp(version.get('last_update'))
+
+    if previous_update is not None and current_update is not None and current_update <= previous_update:
+        return False, version
+
+    return True, version
+
+
+def last_update_epoch(version):
+    """Marca de actualización de una versión como timestamp (para comparar con mtime), o None"""
+    stamp = parse_update_timestamp((version or {}).get('last_update'))
+    return stamp.timestamp() if stamp is not None else None
@@ -18,10 +18,30 @@ Autor: ETL Balanza Completa
 Fuente: Eurostat Comext + Eurostat BOP Database - API SDMX
 """
 
-import requests
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime, timedelta
 from typing import List
+import argparse
+import csv
 import io
+import itertools
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from codelists import to_codes, write_codelists
+from data_store import remove_parquet, sync_parquet, write_parquet
+from data_versions import record_version, sync_version
+from etl_cache import (cached_last_update, check_dataset_version, month_index_to_period, month_to_quarter,
+                       period_to_month_index, read_cache_csv, revision_start, save_dataset_version, upsert)
+from eurostat_client import (BOP_DATA_URL, CHUNK_SIZE, COMEXT_DATA_URL, EurostatError, download_to_file, fetch,
+                             print_request_stats)
+from run_manifest import RunManifest
+from sql_store import load_table, sync_table
 
 # Configuración
 from pathlib import Path
@@ -31,6 +51,34 @@ Path('data/services').mkdir(parents=True, exist_ok=True)
 CSV_CACHE_FILE_GOODS = 'data/goods/datos_mercancias_cache.csv'
 CSV_CACHE_FILE_SERVICES = 'data/services/datos_servicios_cache.csv'
 CSV_CACHE_FILE_COMBINED = 'data/datos_balanza_completa_cache.csv'
+# Descarga en curso de mercancías (se renombra a la caché solo si es válida)
+CSV_PARTIAL_FILE_GOODS = CSV_CACHE_FILE_GOODS + '.part'
+
+# Troceado de la consulta de mercancías (shards = grupo de reporters × bloque de años)
+GOODS_SHARD_REPORTERS = 8     # Reporters por shard
+GOODS_SHARD_YEARS = 6         # Años por shard
+GOODS_SHARD_WORKERS = 4       # Shards descargándose a la vez (update_all_data reserva a esta
+                              # etapa las mismas peticiones: ETL_STAGES[...]['requests'])
+GOODS_SHARD_TIMEOUT = 120     # Segundos sin datos antes de partir el shard
+GOODS_SHARD_MAX_SPLITS = 5    # Veces que se puede partir un shard antes de darlo por fallido
+
+# Columnas clave para fusionar descargas incrementales con la caché
+GOODS_KEY_COLUMNS = ['reporter', 'partner', 'product', 'flow', 'TIME_PERIOD']
+SERVICES_KEY_COLUMNS = ['geo', 'partner', 'bop_item', 'stk_flow', 'TIME_PERIOD']
+
+# Validación de las tablas parseadas (parse_eurostat_table)
+REQUIRED_COLUMNS = ['TIME_PERIOD', 'OBS_VALUE']
+PERIOD_PATTERNS = {
+    'M': r'\d{4}-(0[1-9]|1[0-2])',   # 2024-05
+    'Q': r'\d{4}-Q[1-4]',            # 2024-Q2
+}
+MISSING_VALUES = ('', ':')           # OBS_VALUE sin dato (se guarda como NaN)
+
+# Etapas en data/dataset_versions.json (versión de Eurostat descargada)
+GOODS_VERSION_STAGE = 'goods_aggregate'
+SERVICES_VERSION_STAGE = 'services_aggregate'
+# Etapa en data/manifest/ (unidades 'goods' y 'services')
+MANIFEST_STAGE = 'aggregate'
 
 # Países a descargar (códigos Eurostat) - EXACTAMENTE COMO EN LA URL DE REFERENCIA
 # Basado en: c[reporter]=AL,AT,BA,BE,BG,CH,CY,CZ,DE,DK,EE,ES,EU27_2020,FI,FR,GB,GE,GR,HR,HU,IE,IS,IT,LI,LT,LU,LV,MD,ME,MK,MT,NL,NO,PL,PT,RO,SE,SI,SK,TR,UA,XI,XK,XM,XS
@@ -73,50 +121,6 @@ PAISES_CODES = {
     'EU27_2020': 'Unión Europea (27)',
 }
 
-# Mapeo de nombres completos de Eurostat a nuestros nombres
-PAISES_NOMBRES = {
-    # UE-27
-    'Austria': 'Austria',
-    'Belgium': 'Bélgica',
-    'Bulgaria': 'Bulgaria',
-    'Croatia': 'Croacia',
-    'Cyprus': 'Chipre',
-    'Czech Republic': 'República Checa',
-    'Czechia': 'República Checa',
-    'Denmark': 'Dinamarca',
-    'Estonia': 'Estonia',
-    'Finland': 'Finlandia',
-    'France': 'Francia',
-    'Germany': 'Alemania',
-    "Germany (incl. German Democratic Republic 'DD' from 1991)": 'Alemania',
-    'Greece': 'Grecia',
-    'Hungary': 'Hungría',
-    'Ireland': 'Irlanda',
-    'Italy': 'Italia',
-    'Latvia': 'Letonia',
-    'Lithuania': 'Lituania',
-    'Luxembourg': 'Luxemburgo',
-    'Malta': 'Malta',
-    'Netherlands': 'Países Bajos',
-    'Poland': 'Polonia',
-    'Portugal': 'Portugal',
-    'Romania': 'Rumanía',
-    'Slovakia': 'Eslovaquia',
-    'Slovenia': 'Eslovenia',
-    'Spain': 'España',
-    'Sweden': 'Suecia',
-
-    # Países importantes fuera de la UE
-    'United Kingdom': 'Reino Unido',
-    'Norway': 'Noruega',
-    'Switzerland': 'Suiza',
-
-    # Agregados
-    'Euro area': 'Eurozona',
-    'European Union - 27 countries (from 2020)': 'Unión Europea (27)',
-    'EU27_2020': 'Unión Europea (27)',
-}
-
 # Mapeo de códigos SITC a nombres
 SECTORES_SITC = {
     'TOTAL': 'Total Comercio',
@@ -132,25 +136,13 @@ SECTORES_SITC = {
     '9': 'Otros'
 }
 
-# Mapeo de nombres de productos de Eurostat a nuestros sectores
-SECTORES_NOMBRES = {
-    'Food and live animals': 'Alimentos y animales vivos',
-    'Beverages and tobacco': 'Bebidas y tabaco',
-    'Crude materials, inedible, except fuels': 'Materiales crudos',
-    'Mineral fuels, lubricants and related materials': 'Combustibles minerales',
-    'Animal and vegetable oils, fats and waxes': 'Aceites y grasas',
-    'Chemicals and related products, n.e.s.': 'Productos químicos',
-    'Manufactured goods classified chiefly by material': 'Manufacturas por material',
-    'Machinery and transport equipment': 'Maquinaria y transporte',
-    'Miscellaneous manufactured articles': 'Manufacturas diversas',
-    'Commodities and transactions not classified elsewhere': 'Otros',
-    'Total all products': 'Total Comercio'
-}
-
 
-def build_eurostat_api_url(reporters: List[str], start_year: int = 2002, end_year: int = None) -> str:
+def build_eurostat_api_url(reporters: List[str], start_year: int = 2002, end_year: int = None,
+                           start_month: int = 1, compress: bool = True, end_month: int = 12) -> str:
     """
     Construye la URL de la API de Eurostat Comext con los parámetros correctos.
+    Con compress=True Eurostat devuelve el CSV en gzip (se descomprime en streaming).
+    El rango pedido va de start_year-start_month a end_year-end_month (ambos incluidos).
 
     Formato correcto descubierto:
     /sdmx/3.0/data/dataflow/ESTAT/ds-059331/1.0/*.*.*.*.*.*?c[param]=value&format=csvdata
@@ -165,7 +157,7 @@ def build_eurostat_api_url(reporters: List[str], start_year: int = 2002, end_yea
     products = ','.join(SECTORES_SITC.keys())
 
     # Base URL (SDMX 3.0)
-    base_url = "https://ec.europa.eu/eurostat/api/comext/dissemination/sdmx/3.0/data/dataflow/ESTAT/ds-059331/1.0/*.*.*.*.*.*"
+    base_url = COMEXT_DATA_URL
 
     # Parámetros de consulta (usar urllib.parse para codificar correctamente)
     from urllib.parse import urlencode, quote
@@ -177,12 +169,12 @@ def build_eurostat_api_url(reporters: List[str], start_year: int = 2002, end_yea
         'c[product]': products,
         'c[flow]': '1,2',
         'c[indicators]': 'VALUE_EUR',
-        'c[TIME_PERIOD]': f'ge:{start_year}-01+le:{end_year}-12',
-        'compress': 'false',
+        'c[TIME_PERIOD]': f'ge:{start_year}-{start_month:02d}+le:{end_year}-{end_month:02d}',
+        'compress': 'true' if compress else 'false',
         'format': 'csvdata',
         'formatVersion': '1.0',
         'lang': 'en',
-        'labels': 'label_only',
+        'labels': 'id',  # Códigos (ES, 0, 2...); los nombres van en codelists.py
         'returnData': 'ALL'
     }
 
@@ -193,57 +185,211 @@ def build_eurostat_api_url(reporters: List[str], start_year: int = 2002, end_yea
     return url
 
 
-def download_from_eurostat_api(reporters: List[str], start_year: int = 2002) -> str:
+def plan_goods_shards(reporters: List[str], start_period: str, end_period: str,
+                      reporters_per_shard: int = GOODS_SHARD_REPORTERS,
+                      years_per_shard: int = GOODS_SHARD_YEARS) -> list:
     """
-    Descarga datos desde la API de Eurostat Comext.
-    Retorna el contenido CSV como string.
+    Divide la consulta de mercancías en shards independientes (grupo de reporters × bloque de meses).
+
+    Returns:
+        list: shards (reporters, mes_inicio, mes_fin, divisiones) con meses como índice absoluto
     """
-    url = build_eurostat_api_url(reporters, start_year)
+    start = period_to_month_index(start_period)
+    end = period_to_month_index(end_period)
 
-    print(f"\n📥 Descargando desde Eurostat API...")
-    print(f"   Países: {len(reporters)} países europeos + Eurozona + UE-27")
-    print(f"   Período: {start_year}-01 a {datetime.now().year}-12")
-    print(f"   Productos: {len(SECTORES_SITC)} sectores SITC")
-    print(f"   ⚠️  Descarga completa puede tardar 2-3 minutos...")
+    groups = [tuple(reporters[i:i + reporters_per_shard]) for i in range(0, len(reporters), reporters_per_shard)]
+    blocks = []
+    block_start = start
+    while block_start <= end:
+        block_end = min(end, block_start + years_per_shard * 12 - 1)
+        blocks.append((block_start, block_end))
+        block_start = block_end + 1
 
-    try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'Accept': 'text/csv, text/plain, application/csv, */*',
-            'Accept-Language': 'en-US,en;q=0.9',
-            'Accept-Encoding': 'gzip, deflate',
-            'Connection': 'keep-alive'
-        }
+    return [(group, block_start, block_end, 0) for block_start, block_end in blocks for group in groups]
 
-        print(f"\n🔄 Realizando solicitud HTTP...")
-        print(f"   URL: {url[:100]}...")
 
-        response = requests.get(url, headers=headers, timeout=300)  # 5 minutos para descarga completa
+def split_shard(shard: tuple) -> list:
+    """
+    Parte un shard en dos, alternando entre reporters (divisiones pares) y meses (impares)
+    mientras se pueda. Retorna [] si ya es un único reporter y un único mes.
+    """
+    reporters, start, end, splits = shard
+    can_split_reporters = len(reporters) > 1
+    can_split_time = end > start
 
-        print(f"   Status Code: {response.status_code}")
-        print(f"   Content-Type: {response.headers.get('Content-Type', 'N/A')}")
-        print(f"   Content-Length: {len(response.content):,} bytes")
+    if can_split_reporters and (splits % 2 == 0 or not can_split_time):
+        half = len(reporters) // 2
+        return [(reporters[:half], start, end, splits + 1), (reporters[half:], start, end, splits + 1)]
+    if can_split_time:
+        middle = (start + end) // 2
+        return [(reporters, start, middle, splits + 1), (reporters, middle + 1, end, splits + 1)]
+    return []
 
-        if response.status_code == 200:
-            print(f"   ✓ Descarga exitosa")
-            return response.text
-        else:
-            print(f"   ✗ Error HTTP {response.status_code}")
-            print(f"   Response: {response.text[:500]}")
-            return None
 
-    except requests.exceptions.Timeout:
-        print(f"   ✗ Timeout: La solicitud tardó más de 120 segundos")
-        return None
-    except requests.exceptions.RequestException as e:
-        print(f"   ✗ Error de conexión: {e}")
+def shard_label(shard: tuple) -> str:
+    """Etiqueta legible de un shard para logs y estadísticas"""
+    reporters, start, end, _ = shard
+    who = reporters[0] if len(reporters) == 1 else f"{reporters[0]}..{reporters[-1]} ({len(reporters)})"
+    return f"mercancías {who} {month_index_to_period(start)}/{month_index_to_period(end)}"
+
+
+def is_splittable(error: EurostatError) -> bool:
+    """
+    True si el fallo puede deberse al tamaño de la consulta: timeout, corte de red o descarga
+    interrumpida, 413, 5xx o un S:Fault de Eurostat por volumen de datos.
+    """
+    if error.status_code == 413 or (error.status_code or 0) >= 500:
+        return True
+    message = str(error)
+    if message.startswith('Eurostat S:Fault'):
+        return any(word in message.lower() for word in ('too large', 'too big', 'too many', 'size'))
+    return error.status_code is None
+
+
+def fetch_goods_shard(shard: tuple, dest_file: str) -> dict:
+    """
+    Descarga un shard de mercancías en streaming a dest_file (ver download_to_file).
+    Sin AdaptiveLimiter: un timeout aquí se resuelve partiendo el shard, no frenando al resto.
+    """
+    reporters, start, end, _ = shard
+    url = build_eurostat_api_url(list(reporters), start // 12, end // 12,
+                                 start_month=start % 12 + 1, end_month=end % 12 + 1)
+    # Un solo reintento: si vuelve a fallar es más rápido partir el shard que insistir
+    return download_to_file(url, dest_file, timeout=GOODS_SHARD_TIMEOUT, max_retries=1,
+                            label=shard_label(shard))
+
+
+def merge_shard_files(parts: list, dest_file: str) -> dict:
+    """
+    Concatena los CSV de los shards en dest_file (una sola cabecera) y borra los temporales.
+    Los shards no se solapan, así que no hace falta deduplicar.
+    parts: lista de (shard, archivo, estadísticas)
+    """
+    header = None
+    rows = 0
+    bytes_transferred = 0
+
+    with open(dest_file, 'wb') as out:
+        for _, part_file, stats in parts:
+            bytes_transferred += stats['bytes_transferred']
+            if stats['rows'] == 0:
+                os.remove(part_file)
+                continue
+            with open(part_file, 'rb') as f:
+                first_line = f.readline()
+                if header is None:
+                    header = stats['header']
+                    out.write(first_line)
+                elif stats['header'] != header:
+                    raise ValueError(f"Cabecera distinta en {part_file}: {stats['header']}")
+                shutil.copyfileobj(f, out, CHUNK_SIZE)
+                f.seek(0, os.SEEK_END)
+                if f.tell() > len(first_line):
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b'\n':
+                        out.write(b'\n')
+            rows += stats['rows']
+            os.remove(part_file)
+
+    return {
+        'header': header or [],
+        'rows': rows,
+        'bytes_transferred': bytes_transferred,
+        'bytes_written': os.path.getsize(dest_file),
+    }
+
+
+def download_from_eurostat_api(reporters: List[str], start_year: int = 2002, start_month: int = 1,
+                               dest_file: str = CSV_PARTIAL_FILE_GOODS) -> dict:
+    """
+    Descarga datos desde la API de Eurostat Comext directamente a dest_file.
+
+    La consulta se divide en shards (grupos de reporters × bloques de años) que se descargan
+    en paralelo, cada uno en streaming (gzip) a su propio archivo temporal. Si un shard
+    agota el tiempo o es demasiado grande, se parte en dos y se vuelve a pedir.
+    Al final los shards se concatenan en dest_file.
+
+    Retorna las estadísticas de la descarga (cabecera, filas, bytes, shards) o None si falla.
+    """
+    end_year = datetime.now().year
+    shards = plan_goods_shards(reporters, f"{start_year}-{start_month:02d}", f"{end_year}-12")
+
+    print(f"\n📥 Descargando desde Eurostat API...")
+    print(f"   Países: {len(reporters)} países europeos + Eurozona + UE-27")
+    print(f"   Período: {start_year}-{start_month:02d} a {end_year}-12")
+    print(f"   Productos: {len(SECTORES_SITC)} sectores SITC")
+    print(f"   Shards: {len(shards)} ({GOODS_SHARD_REPORTERS} países × {GOODS_SHARD_YEARS} años, "
+          f"{GOODS_SHARD_WORKERS} en paralelo)")
+
+    start = time.time()
+    part_counter = itertools.count()
+    completed, failed = [], []
+
+    def part_file():
+        return str(Path(dest_file).with_suffix(f'.{next(part_counter)}.part'))
+
+    with ThreadPoolExecutor(max_workers=GOODS_SHARD_WORKERS) as executor:
+        running = {}
+        for shard in shards:
+            shard_file = part_file()
+            running[executor.submit(fetch_goods_shard, shard, shard_file)] = (shard, shard_file)
+
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                shard, shard_file = running.pop(future)
+                try:
+                    stats = future.result()
+                except (EurostatError, OSError) as e:
+                    if os.path.exists(shard_file):
+                        os.remove(shard_file)
+
+                    if isinstance(e, EurostatError) and e.status_code == 404:
+                        print(f"   ⚠️  {shard_label(shard)}: sin datos")
+                        continue
+
+                    children = split_shard(shard) if (isinstance(e, EurostatError) and is_splittable(e)
+                                                      and shard[3] < GOODS_SHARD_MAX_SPLITS and not failed) else []
+                    if not children:
+                        print(f"   ✗ {shard_label(shard)}: {str(e)[:150]}")
+                        failed.append(shard)
+                        continue
+
+                    print(f"   ✂️  {shard_label(shard)}: {str(e)[:80]} → se parte en {len(children)}")
+                    for child in children:
+                        child_file = part_file()
+                        running[executor.submit(fetch_goods_shard, child, child_file)] = (child, child_file)
+                    continue
+
+                completed.append((shard, shard_file, stats))
+                print(f"   ✓ {shard_label(shard)}: {stats['rows']:,} filas, "
+                      f"{stats['bytes_transferred'] / 1024:.0f} KB ({stats['seconds']:.1f}s)")
+
+    if failed:
+        print(f"   ✗ Error en la descarga: {len(failed)} shards fallidos")
+        for _, shard_file, _ in completed:
+            os.remove(shard_file)
         return None
-    except Exception as e:
-        print(f"   ✗ Error inesperado: {e}")
+
+    # Orden estable: por periodo y después por grupo de reporters
+    completed.sort(key=lambda part: (part[0][1], part[0][0]))
+
+    try:
+        stats = merge_shard_files(completed, dest_file)
+    except (OSError, ValueError) as e:
+        print(f"   ✗ Error uniendo shards en {dest_file}: {e}")
         return None
 
+    stats['shards'] = len(completed)
+    stats['seconds'] = time.time() - start
+    print(f"   Transferido: {stats['bytes_transferred']:,} bytes (comprimido) en {stats['shards']} shards")
+    print(f"   Escrito: {stats['bytes_written']:,} bytes en {dest_file}")
+    print(f"   ✓ Descarga exitosa ({stats['seconds']:.1f}s)")
+    return stats
 
-def build_bop_services_api_url(reporters: List[str], start_year: int = 2002, end_year: int = None) -> str:
+
+def build_bop_services_api_url(reporters: List[str], start_year: int = 2002, end_year: int = None,
+                               start_quarter: int = 1) -> str:
     """
     Construye la URL de la API de Eurostat BOP para datos de servicios (incluye turismo).
 
@@ -283,7 +429,7 @@ def build_bop_services_api_url(reporters: List[str], start_year: int = 2002, end
 
     # Base URL - TRIMESTRAL (bop_c6_q) - mayor cobertura de países
     # Nota: BOP_C6_M (mensual) existe pero NO incluye España ni otros países clave
-    base_url = "https://ec.europa.eu/eurostat/api/dissemination/sdmx/3.0/data/dataflow/ESTAT/bop_c6_q/1.0/*.*.*.*.*.*.*.*"
+    base_url = BOP_DATA_URL
 
     from urllib.parse import urlencode
 
@@ -302,12 +448,12 @@ def build_bop_services_api_url(reporters: List[str], start_year: int = 2002, end
         'c[stk_flow]': 'CRE,DEB',  # CRE=Créditos/Exportaciones, DEB=Débitos/Importaciones
         'c[partner]': 'WRL_REST',  # Resto del mundo
         'c[geo]': reporters_str,  # Países válidos
-        'c[TIME_PERIOD]': f'ge:{start_year}-Q1+le:{end_year}-Q4',  # Formato trimestral
+        'c[TIME_PERIOD]': f'ge:{start_year}-Q{start_quarter}+le:{end_year}-Q4',  # Formato trimestral
         'compress': 'false',
         'format': 'csvdata',
         'formatVersion': '1.0',
         'lang': 'en',
-        'labels': 'label_only',
+        'labels': 'id',  # Códigos (ES, EL, CRE...); los nombres van en codelists.py
         'returnData': 'ALL'
     }
 
@@ -317,202 +463,301 @@ def build_bop_services_api_url(reporters: List[str], start_year: int = 2002, end
     return url
 
 
-def download_bop_services(reporters: List[str], start_year: int = 2002) -> str:
+def download_bop_services(reporters: List[str], start_year: int = 2002, start_quarter: int = 1) -> str:
     """
     Descarga datos trimestrales de servicios desde Eurostat BOP_C6_Q.
     Se interpolan a mensuales en post-procesamiento.
 
     Nota: BOP_C6_M (mensual) no incluye España y tiene cobertura limitada.
     """
-    url = build_bop_services_api_url(reporters, start_year)
+    url = build_bop_services_api_url(reporters, start_year, start_quarter=start_quarter)
 
     print(f"\n📥 Descargando SERVICIOS desde Eurostat BOP API (TRIMESTRAL)...")
     print(f"   Países: {len(reporters)} países")
-    print(f"   Período: {start_year}-Q1 a {datetime.now().year}-Q4")
+    print(f"   Período: {start_year}-Q{start_quarter} a {datetime.now().year}-Q4")
     print(f"   Categorías: S (Servicios totales, incluye turismo)")
     print(f"   ⚠️  Datos trimestrales se interpolarán a mensuales")
 
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-            'Accept': 'text/csv, */*',
-            'Accept-Language': 'en-US,en;q=0.9',
-        }
-
         print(f"\n🔄 Realizando solicitud HTTP...")
         print(f"   URL: {url[:120]}...")
 
-        response = requests.get(url, headers=headers, timeout=180)
+        response = fetch(url, timeout=180, label='servicios BOP')
 
         print(f"   Status Code: {response.status_code}")
         print(f"   Content-Length: {len(response.content):,} bytes")
+        print(f"   ✓ Descarga exitosa ({response.fetch_seconds:.1f}s, {response.attempts} intento(s))")
+        return response.text
 
-        if response.status_code == 200:
-            print(f"   ✓ Descarga exitosa")
-            return response.text
-        else:
-            print(f"   ✗ Error HTTP {response.status_code}")
-            print(f"   Response: {response.text[:500]}")
-            return None
-
-    except Exception as e:
+    except EurostatError as e:
         print(f"   ✗ Error: {e}")
         return None
 
 
-def interpolate_quarterly_to_monthly(csv_content: str) -> str:
+def _csv_cell(value: str) -> str:
+    """Celda CSV con el mismo entrecomillado que csv.writer (QUOTE_MINIMAL)"""
+    if value == '':
+        return ''
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='').writerow([value])
+    return buffer.getvalue()
+
+
+def _csv_lines(df: pd.DataFrame, positions: np.ndarray, period_text: np.ndarray, value_text: np.ndarray) -> np.ndarray:
     """
-    Convierte datos trimestrales (Q1, Q2, Q3, Q4) a mensuales.
+    Líneas CSV (sin fin de línea) de las filas df.iloc[positions] con TIME_PERIOD y OBS_VALUE
+    sustituidos por period_text y value_text (celdas ya formateadas, una por línea).
 
-    Estrategia de interpolación:
-    - Q1 (Ene-Mar): Divide valor/3 para cada mes (Ene, Feb, Mar)
-    - Q2 (Abr-Jun): Divide valor/3 para cada mes (Abr, May, Jun)
-    - Q3 (Jul-Sep): Divide valor/3 para cada mes (Jul, Ago, Sep)
-    - Q4 (Oct-Dic): Divide valor/3 para cada mes (Oct, Nov, Dic)
+    Cada serie (combinación del resto de columnas) se serializa una sola vez; cada línea solo
+    concatena los fragmentos de su serie con sus dos celdas. Mismo entrecomillado que csv.writer.
+    """
+    header = list(df.columns)
+    first, second = sorted([header.index('TIME_PERIOD'), header.index('OBS_VALUE')])
+    other_columns = [c for i, c in enumerate(header) if i not in (first, second)]
+    if other_columns:
+        series_ids = df.groupby(other_columns, sort=False, dropna=False).ngroup().to_numpy()
+        _, representatives = np.unique(series_ids, return_index=True)
+    else:
+        series_ids = np.zeros(len(df), dtype=int)
+        representatives = np.array([0] if len(df) else [], dtype=int)
+
+    before, middle, after = [], [], []
+    for row in df.iloc[representatives].itertuples(index=False):
+        cells = [_csv_cell(v) for v in row]
+        before.append(''.join(cell + ',' for cell in cells[:first]))
+        middle.append(',' + ''.join(cell + ',' for cell in cells[first + 1:second]))
+        after.append(''.join(',' + cell for cell in cells[second + 1:]))
+
+    series = series_ids[positions]
+    first_text, second_text = (period_text, value_text) if header[first] == 'TIME_PERIOD' else (value_text, period_text)
+    return (np.array(before, dtype=object)[series] + first_text
+            + np.array(middle, dtype=object)[series] + second_text
+            + np.array(after, dtype=object)[series])
+
+
+def write_table_csv(table: pd.DataFrame, dest_file: str):
+    """
+    Escribe una tabla tipada (parse_eurostat_table) como CSV en el formato de la caché:
+    OBS_VALUE con 2 decimales (vacío si NaN), QUOTE_MINIMAL y fin de línea \\r\\n.
 
-    Retorna CSV con TIME_PERIOD en formato mensual (YYYY-MM).
+    Mucho más rápido que DataFrame.to_csv: periodos y valores se formatean una vez por
+    valor distinto y el resto de columnas una vez por serie (ver _csv_lines).
     """
-    print(f"\n🔄 Interpolando datos trimestrales a mensuales...")
+    period_codes, periods = pd.factorize(table['TIME_PERIOD'])
+    period_text = np.array([_csv_cell(p) for p in periods], dtype=object)[period_codes]
 
-    import csv
-    from io import StringIO
+    # Código -1 (NaN) -> última posición = celda vacía
+    value_codes, values = pd.factorize(table['OBS_VALUE'])
+    value_text = np.array([f"{v:.2f}" for v in values] + [''], dtype=object)[value_codes]
 
-    # Leer CSV
-    reader = csv.DictReader(StringIO(csv_content))
-    header = reader.fieldnames
+    lines = _csv_lines(table, np.arange(len(table)), period_text, value_text)
+    with open(dest_file, 'w', encoding='utf-8', newline='') as f:
+        f.write('\r\n'.join([','.join(_csv_cell(c) for c in table.columns), *lines]) + '\r\n')
 
-    if not header or 'TIME_PERIOD' not in header or 'OBS_VALUE' not in header:
-        print(f"   ⚠️  CSV no tiene columnas esperadas")
-        return csv_content
 
-    rows_interpolated = []
-    count_quarters = 0
-    count_months = 0
+def interpolate_quarterly_table(table: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convierte datos trimestrales a mensuales: cada trimestre (Q1..Q4) se reparte en sus 3
+    meses con valor/3.
 
-    # Mapeo Q1->meses, Q2->meses, etc.
-    quarter_to_months = {
-        'Q1': ['01', '02', '03'],
-        'Q2': ['04', '05', '06'],
-        'Q3': ['07', '08', '09'],
-        'Q4': ['10', '11', '12']
-    }
+    Recibe la salida de parse_eurostat_table con frecuencia 'Q' (todos los periodos ya
+    validados como YYYY-Qn y OBS_VALUE float) y retorna una tabla nueva con 3 filas por
+    trimestre, TIME_PERIOD mensual y OBS_VALUE/3. Los valores NaN se mantienen NaN.
+    """
+    print(f"\n🔄 Interpolando datos trimestrales a mensuales...")
 
-    for row in reader:
-        time_period = row.get('TIME_PERIOD', '')
-        obs_value = row.get('OBS_VALUE', '')
-
-        # Si es trimestral (formato: 2024-Q1)
-        if '-Q' in time_period:
-            try:
-                year, quarter = time_period.split('-')
-                quarter_num = quarter  # Q1, Q2, Q3, Q4
-
-                if quarter_num in quarter_to_months:
-                    # Si tiene valor, dividirlo entre 3
-                    if obs_value and obs_value != ':' and obs_value != '':
-                        count_quarters += 1
-                        value_float = float(obs_value)
-                        monthly_value = value_float / 3.0
-
-                        # Crear 3 filas mensuales con valor interpolado
-                        for month in quarter_to_months[quarter_num]:
-                            new_row = row.copy()
-                            new_row['TIME_PERIOD'] = f"{year}-{month}"
-                            new_row['OBS_VALUE'] = f"{monthly_value:.2f}"
-                            rows_interpolated.append(new_row)
-                            count_months += 1
-                    else:
-                        # Sin valor, solo convertir formato de fecha (no contar)
-                        for month in quarter_to_months[quarter_num]:
-                            new_row = row.copy()
-                            new_row['TIME_PERIOD'] = f"{year}-{month}"
-                            # OBS_VALUE se mantiene vacío
-                            rows_interpolated.append(new_row)
-                else:
-                    # Quarter no reconocido, mantener original
-                    rows_interpolated.append(row)
-            except (ValueError, AttributeError):
-                # Si hay error, mantener fila original
-                rows_interpolated.append(row)
-        else:
-            # Si ya es mensual, mantener original
-            rows_interpolated.append(row)
+    period_codes, periods = pd.factorize(table['TIME_PERIOD'])
+    first_months = (periods.str[-1].astype(int) - 1) * 3 + 1
+    period_months = np.array([[f"{period[:4]}-{month + k:02d}" for k in range(3)]
+                              for period, month in zip(periods, first_months)], dtype=object).reshape(-1, 3)
 
-    # Escribir CSV interpolado
-    output = StringIO()
-    writer = csv.DictWriter(output, fieldnames=header)
-    writer.writeheader()
-    writer.writerows(rows_interpolated)
+    positions = np.repeat(np.arange(len(table)), 3)
+    offsets = np.tile(np.arange(3), len(table))
 
-    interpolated_csv = output.getvalue()
+    monthly = table.iloc[positions].reset_index(drop=True)
+    monthly['TIME_PERIOD'] = period_months[period_codes[positions], offsets]
+    monthly['OBS_VALUE'] = np.repeat(table['OBS_VALUE'].to_numpy() / 3.0, 3)
 
+    count_quarters = int(table['OBS_VALUE'].notna().sum())
     print(f"   ✓ Trimestres procesados: {count_quarters}")
-    print(f"   ✓ Meses generados: {count_months}")
-    print(f"   ✓ Total filas: {len(rows_interpolated)}")
+    print(f"   ✓ Meses generados: {count_quarters * 3}")
+    print(f"   ✓ Total filas: {len(monthly)}")
 
-    return interpolated_csv
+    return monthly
 
 
-def parse_eurostat_csv(csv_content: str) -> str:
+def parse_eurostat_table(source, csv_type: str = "servicios", frequency: str = 'Q') -> pd.DataFrame:
     """
-    Valida el CSV de Eurostat y lo retorna sin transformaciones.
+    Parsea un CSV de Eurostat una sola vez a una tabla tipada y lo valida en la misma pasada.
+
+    source es el CSV como string o la ruta (Path) de un archivo.
+    Tipos: OBS_VALUE float (NaN si vacío o ':'), el resto de columnas texto sin convertir.
+    Validación:
+    - Columnas requeridas (REQUIRED_COLUMNS) y al menos una fila
+    - OBS_VALUE numérico en todas las filas con dato
+    - TIME_PERIOD con el formato de la frecuencia ('M' = YYYY-MM, 'Q' = YYYY-Qn)
+
+    Retorna la tabla (lista para interpolar, fusionar y escribir) o None si no es válida.
     """
-    print(f"\n⚙️  Validando CSV...")
+    print(f"\n🔍 Parseando y validando CSV de {csv_type}...")
+
+    try:
+        table = pd.read_csv(io.StringIO(source) if isinstance(source, str) else source,
+                            dtype=str, keep_default_na=False)
+    except (pd.errors.EmptyDataError, pd.errors.ParserError) as e:
+        print(f"   ✗ Error: CSV vacío o mal formado ({e})")
+        return None
 
-    import csv as csv_module
+    missing_columns = [c for c in REQUIRED_COLUMNS if c not in table.columns]
+    if missing_columns:
+        print(f"   ✗ Error: Faltan columnas esenciales: {', '.join(missing_columns)}")
+        return None
 
-    # Contar filas para diagnóstico
-    reader = csv_module.DictReader(io.StringIO(csv_content))
-    rows_count = sum(1 for _ in reader)
+    if table.empty:
+        print(f"   ✗ Error: CSV sin filas")
+        return None
 
-    print(f"   ✓ Total de filas: {rows_count:,}")
+    raw_values = table['OBS_VALUE']
+    has_value = ~raw_values.isin(MISSING_VALUES)
+    values = pd.to_numeric(raw_values.where(has_value), errors='coerce')
+    invalid_values = has_value & values.isna()
+    if invalid_values.any():
+        print(f"   ✗ Error: {int(invalid_values.sum())} valores no numéricos en OBS_VALUE "
+              f"(p.ej. '{raw_values[invalid_values].iloc[0]}')")
+        return None
 
-    return csv_content
+    # Formato de periodo: una comprobación por periodo distinto, no por fila
+    periods = pd.Series(table['TIME_PERIOD'].unique())
+    invalid_periods = periods[~periods.str.fullmatch(PERIOD_PATTERNS[frequency])]
+    if not invalid_periods.empty:
+        print(f"   ✗ Error: {len(invalid_periods)} periodos con formato no válido "
+              f"(p.ej. '{invalid_periods.iloc[0]}')")
+        return None
 
+    table['OBS_VALUE'] = values.astype(float)
 
-def validate_csv(csv_content: str, csv_type: str = "mercancías") -> bool:
+    print(f"   ✓ CSV de {csv_type} válido")
+    print(f"   ✓ Total de filas: {len(table):,} ({len(periods)} periodos, {int((~has_value).sum()):,} sin valor)")
+    return table
+
+
+def validate_download(stats: dict, csv_type: str = "mercancías") -> bool:
     """
-    Valida que el CSV descargado tenga contenido.
+    Valida una descarga en streaming a partir de sus estadísticas (sin releer el archivo).
     """
     print(f"\n🔍 Validando CSV de {csv_type}...")
 
-    if not csv_content or len(csv_content) < 100:
+    if stats['bytes_written'] < 100 or stats['rows'] == 0:
         print(f"   ✗ Error: CSV vacío o demasiado pequeño")
         return False
 
-    # Verificar que tenga columnas básicas
-    first_line = csv_content.split('\n')[0]
-
-    if 'TIME_PERIOD' not in first_line or 'OBS_VALUE' not in first_line:
+    if 'TIME_PERIOD' not in stats['header'] or 'OBS_VALUE' not in stats['header']:
         print(f"   ✗ Error: Faltan columnas esenciales")
         return False
 
     print(f"   ✓ CSV de {csv_type} válido")
-    print(f"   Tamaño: {len(csv_content) / 1024:.1f} KB")
+    print(f"   ✓ Total de filas: {stats['rows']:,}")
+    print(f"   Tamaño: {stats['bytes_written'] / 1024:.1f} KB")
     return True
 
 
-def save_csv_cache(csv_goods: str, csv_services: str):
+def merge_with_cache(cache_file: str, new, key_columns: List[str], dest_file: str = None):
+    """
+    Fusiona una descarga incremental con el CSV en caché (upsert sobre key_columns).
+    new puede ser la tabla tipada de parse_eurostat_table o la ruta de un archivo descargado (dest_file).
+    Con una tabla retorna la tabla completa resultante (None si la caché no es válida);
+    con dest_file escribe ahí el CSV completo y retorna la ruta.
+    """
+    print(f"\n🔀 Fusionando descarga incremental con {cache_file}...")
+
+    if dest_file:
+        df_new = read_cache_csv(new)
+        df_existing = read_cache_csv(cache_file)
+    else:
+        df_new = new
+        df_existing = parse_eurostat_table(Path(cache_file), "caché", frequency='M')
+        if df_existing is None:
+            return None
+    # Caché descargada con etiquetas (labels=label_only): pasar a códigos antes de fusionar
+    df_existing = to_codes(df_existing)
+    df_merged = upsert(df_existing, df_new, key_columns)
+
+    print(f"   ✓ Filas actualizadas/nuevas: {len(df_new):,}")
+    print(f"   ✓ Total filas en caché: {len(df_merged):,}")
+
+    if dest_file:
+        df_merged.to_csv(dest_file, index=False)
+        return dest_file
+    return df_merged
+
+
+def _print_parquet(parquet_file):
+    """Informa del Parquet escrito junto al CSV (ver data_store)"""
+    if parquet_file is not None:
+        print(f"   Parquet: {parquet_file} ({os.path.getsize(parquet_file) / 1024:.1f} KB)")
+
+
+def save_csv_cache(goods_file: str, services: pd.DataFrame):
     """
     Guarda los CSVs de mercancías y servicios en caché.
+    goods_file es la descarga de mercancías ya validada en disco (se renombra de forma atómica).
+    services es la tabla tipada de servicios: se escribe directamente, sin volver a serializar
+    ni parsear el CSV (vacía = caché vacía).
+    None = conservar la caché existente de ese dataset.
     """
     # Guardar mercancías
-    with open(CSV_CACHE_FILE_GOODS, 'w', encoding='utf-8') as f:
-        f.write(csv_goods)
-    print(f"\n💾 CSV guardado: {CSV_CACHE_FILE_GOODS}")
-    print(f"   Tamaño: {len(csv_goods) / 1024:.1f} KB")
+    if goods_file is not None:
+        os.replace(goods_file, CSV_CACHE_FILE_GOODS)
+        print(f"\n💾 CSV guardado: {CSV_CACHE_FILE_GOODS}")
+        print(f"   Tamaño: {os.path.getsize(CSV_CACHE_FILE_GOODS) / 1024:.1f} KB")
+        _print_parquet(sync_parquet(CSV_CACHE_FILE_GOODS, partitioned=True))
+        sync_table(CSV_CACHE_FILE_GOODS)
+        record_version(CSV_CACHE_FILE_GOODS)
 
     # Guardar servicios
-    with open(CSV_CACHE_FILE_SERVICES, 'w', encoding='utf-8') as f:
-        f.write(csv_services)
-    print(f"   CSV guardado: {CSV_CACHE_FILE_SERVICES}")
-    print(f"   Tamaño: {len(csv_services) / 1024:.1f} KB")
+    if services is not None:
+        if services.empty:
+            open(CSV_CACHE_FILE_SERVICES, 'w', encoding='utf-8').close()
+            remove_parquet(CSV_CACHE_FILE_SERVICES)
+        else:
+            write_table_csv(services, CSV_CACHE_FILE_SERVICES)
+        print(f"   CSV guardado: {CSV_CACHE_FILE_SERVICES}")
+        print(f"   Tamaño: {os.path.getsize(CSV_CACHE_FILE_SERVICES) / 1024:.1f} KB")
+        if not services.empty:
+            _print_parquet(write_parquet(services, CSV_CACHE_FILE_SERVICES))
+            load_table(services, CSV_CACHE_FILE_SERVICES)
+        record_version(CSV_CACHE_FILE_SERVICES)
+
+    # Nombres a mostrar de los códigos de ambas cachés (codelists.py)
+    write_codelists()
 
     # Nota: El CSV combinado se genera en el widget al cargar los datos
     print(f"\n   ℹ️  Los datos se combinarán al cargar el widget")
 
 
-def main():
+def cache_is_current(cache_file: str, stage: str, dataflow: str, fallback_last_update: str = None):
+    """
+    Comprueba (con una consulta de metadatos) si la caché ya tiene la última publicación de Eurostat.
+
+    Returns:
+        tuple: (current, version) - version se guarda tras descargar correctamente
+    """
+    if not os.path.exists(cache_file) or os.path.getsize(cache_file) < 1024:
+        return False, None
+
+    changed, version = check_dataset_version(stage, dataflow, fallback_last_update)
+    if version is not None and not changed:
+        print(f"\n✓ {dataflow} sin cambios en Eurostat (última actualización: {version.get('last_update') or 'N/A'})")
+        print(f"   Se conserva la caché: {cache_file}")
+        _print_parquet(sync_parquet(cache_file, partitioned=cache_file == CSV_CACHE_FILE_GOODS))
+        sync_table(cache_file)
+        sync_version(cache_file)
+        return True, version
+
+    return False, version
+
+
+def main(incremental: bool = False, force: bool = False, resume: bool = False) -> bool:
     """
     Función principal - descarga datos de mercancías y servicios de Eurostat.
 
@@ -520,7 +765,19 @@ def main():
     - DS-059331: Mercancías (mensual)
     - BOP_C6_Q: Servicios (trimestral - se interpola a mensual)
 
+    Con incremental=True y caché existente, solo se descarga la ventana de revisión
+    (últimos meses) y se fusiona con la caché.
+
+    Antes de cada descarga se consulta la versión publicada del dataset; si no ha
+    cambiado desde la última descarga, ese paso se salta (force=True lo evita).
+
+    Cada dataset se guarda en cuanto termina y queda registrado en el manifiesto
+    (data/manifest/aggregate.json); con resume=True se repiten solo los que fallaron.
+
     Nota: BOP_C6_M existe pero no incluye España ni otros países clave.
+
+    Returns:
+        bool: True si ningún dataset falló
     """
     print("="*70)
     print("ETL LOADER - BALANZA COMPLETA (MERCANCÍAS + SERVICIOS)")
@@ -528,70 +785,175 @@ def main():
     print("="*70)
 
     reporters = list(PAISES_CODES.keys())
+    manifest = RunManifest(MANIFEST_STAGE, resume=resume)
+    if manifest.resumed:
+        print(f"🔁 Reanudando: pendientes {', '.join(manifest.pending(['goods', 'services'])) or 'ninguno'}")
 
     # ===== DESCARGAR MERCANCÍAS =====
     print("\n" + "="*70)
     print("PASO 1: DESCARGAR DATOS DE MERCANCÍAS")
     print("="*70)
 
-    csv_goods = download_from_eurostat_api(reporters, start_year=2002)
+    goods_file = None
+    if manifest.is_done('goods'):
+        print("\n✓ Mercancías ya completadas en la ejecución que se reanuda")
+    else:
+        t0 = time.time()
+        goods_current, goods_version = (False, None) if force else \
+            cache_is_current(CSV_CACHE_FILE_GOODS, GOODS_VERSION_STAGE, 'DS-059331')
 
-    if not csv_goods:
-        print("\n✗ ERROR: No se pudieron descargar datos de mercancías")
-        return
-
-    csv_goods = parse_eurostat_csv(csv_goods)
-
-    if not validate_csv(csv_goods, "mercancías"):
-        print("\n✗ Error: CSV de mercancías no válido")
-        return
+        if goods_current:
+            manifest.record('goods', 'skipped', seconds=time.time() - t0)
+        else:
+            goods_file = download_goods(reporters, incremental)
+            if goods_file is None:
+                manifest.record('goods', 'failed', seconds=time.time() - t0,
+                                error='Descarga o validación de mercancías fallida')
+            else:
+                # Guardar ya: un fallo posterior en servicios no obliga a repetir mercancías
+                save_csv_cache(goods_file, None)
+                if goods_version is not None:
+                    save_dataset_version(GOODS_VERSION_STAGE, goods_version)
+                manifest.record('goods', 'ok', n_bytes=os.path.getsize(CSV_CACHE_FILE_GOODS),
+                                seconds=time.time() - t0)
 
     # ===== DESCARGAR SERVICIOS =====
     print("\n" + "="*70)
     print("PASO 2: DESCARGAR DATOS DE SERVICIOS")
     print("="*70)
 
-    csv_services = download_bop_services(reporters, start_year=2002)
-
-    if not csv_services:
-        print("\n✗ ERROR: No se pudieron descargar datos de servicios")
-        print("   Continuando solo con mercancías...")
-        csv_services = ""  # CSV vacío si falla
-
-    if csv_services:
-        csv_services = parse_eurostat_csv(csv_services)
-        if not validate_csv(csv_services, "servicios"):
-            print("\n⚠️  Advertencia: CSV de servicios no válido, continuando sin servicios")
+    services = None
+    if manifest.is_done('services'):
+        print("\n✓ Servicios ya completados en la ejecución que se reanuda")
+    else:
+        t0 = time.time()
+        services_current, services_version = (False, None) if force else \
+            cache_is_current(CSV_CACHE_FILE_SERVICES, SERVICES_VERSION_STAGE, 'BOP_C6_Q',
+                             cached_last_update(CSV_CACHE_FILE_SERVICES))
+
+        if services_current:
+            manifest.record('services', 'skipped', seconds=time.time() - t0)
         else:
-            # Interpolar datos trimestrales a mensuales
-            csv_services = interpolate_quarterly_to_monthly(csv_services)
+            services = download_services(reporters, incremental)
+            # None conserva la caché existente y una tabla vacía la deja vacía: en ambos casos ha fallado
+            if services is not None:
+                save_csv_cache(None, services)
+            if services is not None and not services.empty:
+                if services_version is not None:
+                    save_dataset_version(SERVICES_VERSION_STAGE, services_version)
+                manifest.record('services', 'ok', n_bytes=os.path.getsize(CSV_CACHE_FILE_SERVICES),
+                                seconds=time.time() - t0)
+            else:
+                manifest.record('services', 'failed', seconds=time.time() - t0,
+                                error='Descarga o validación de servicios fallida')
+
+    manifest.finish()
+    summary = manifest.summary()
+
+    services_saved = services is not None and not services.empty
+    if goods_file is None and not services_saved and not summary['failed']:
+        print("\n" + "="*70)
+        print("✓ SIN CAMBIOS: Eurostat no ha publicado datos nuevos")
+        print("="*70)
+        return True
 
-    # ===== GUARDAR ARCHIVOS =====
-    save_csv_cache(csv_goods, csv_services)
+    print()
+    print_request_stats()
 
     print("\n" + "="*70)
-    print("✓ PROCESO COMPLETADO EXITOSAMENTE")
+    if summary['failed']:
+        print(f"⚠️  PROCESO COMPLETADO CON ERRORES: {', '.join(summary['failed'])}")
+        print("   Repetir solo lo fallido con: python3 etl_loader_completo.py --resume")
+    else:
+        print("✓ PROCESO COMPLETADO EXITOSAMENTE")
     print("="*70)
     print(f"\nArchivos generados:")
-    print(f"  - {CSV_CACHE_FILE_GOODS}")
-    if csv_services:
+    if goods_file is not None:
+        print(f"  - {CSV_CACHE_FILE_GOODS}")
+    if services_saved:
         print(f"  - {CSV_CACHE_FILE_SERVICES}")
     print("\nPuedes ejecutar el widget con:")
     print("  streamlit run widget_balanza_completa.py")
     print("="*70)
+    return not summary['failed']
+
+
+def download_goods(reporters: List[str], incremental: bool = False) -> str:
+    """
+    Paso 1: descarga en streaming, valida y (en modo incremental) fusiona los datos de mercancías.
+    Retorna la ruta del CSV completo ya validado (pendiente de guardar) o None si falla.
+    """
+    goods_start = revision_start(CSV_CACHE_FILE_GOODS) if incremental else None
+    start_year, start_month = map(int, goods_start.split('-')) if goods_start else (2002, 1)
+
+    stats = download_from_eurostat_api(reporters, start_year=start_year, start_month=start_month,
+                                       dest_file=CSV_PARTIAL_FILE_GOODS)
+
+    if not stats:
+        print("\n✗ ERROR: No se pudieron descargar datos de mercancías")
+        return None
+
+    if not validate_download(stats, "mercancías"):
+        print("\n✗ Error: CSV de mercancías no válido")
+        os.remove(CSV_PARTIAL_FILE_GOODS)
+        return None
+
+    if goods_start:
+        merge_with_cache(CSV_CACHE_FILE_GOODS, CSV_PARTIAL_FILE_GOODS, GOODS_KEY_COLUMNS,
+                         dest_file=CSV_PARTIAL_FILE_GOODS)
+
+    return CSV_PARTIAL_FILE_GOODS
+
+
+def download_services(reporters: List[str], incremental: bool = False) -> pd.DataFrame:
+    """
+    Paso 2: descarga, valida, interpola y (en modo incremental) fusiona los datos de servicios.
+    El CSV descargado se parsea una sola vez (parse_eurostat_table); interpolación, fusión y
+    escritura trabajan sobre esa tabla tipada.
+    Retorna la tabla completa, una tabla vacía si no hay servicios, o None para conservar la caché existente.
+    """
+    services_start = revision_start(CSV_CACHE_FILE_SERVICES) if incremental else None
+    if services_start:
+        start_year, start_quarter = month_to_quarter(services_start).split('-Q')
+        start_year, start_quarter = int(start_year), int(start_quarter)
+    else:
+        start_year, start_quarter = 2002, 1
+
+    csv_services = download_bop_services(reporters, start_year=start_year, start_quarter=start_quarter)
+
+    if not csv_services and services_start:
+        print("\n✗ ERROR: No se pudieron descargar datos de servicios")
+        print("   Conservando caché de servicios existente...")
+        return None  # No sobrescribir la caché
+    elif not csv_services:
+        print("\n✗ ERROR: No se pudieron descargar datos de servicios")
+        print("   Continuando solo con mercancías...")
+        return pd.DataFrame()  # Caché vacía si falla
+
+    services = parse_eurostat_table(csv_services, "servicios", frequency='Q')
+    if services is None:
+        print("\n⚠️  Advertencia: CSV de servicios no válido, conservando caché de servicios existente")
+        return None
+
+    # Interpolar datos trimestrales a mensuales
+    services = interpolate_quarterly_table(services)
+
+    if services_start:
+        services = merge_with_cache(CSV_CACHE_FILE_SERVICES, services, SERVICES_KEY_COLUMNS)
+
+    return services
 
 
 def update_data_if_needed() -> bool:
     """
-    Actualiza los datos si el caché no existe, está corrupto, o es antiguo (>7 días).
+    Actualiza los datos si el caché no existe, está corrupto, o Eurostat ha publicado datos nuevos.
 
     Verifica:
     1. Existencia del archivo
     2. Tamaño mínimo (>1KB para detectar archivos vacíos/corruptos)
-    3. Antigüedad (<7 días)
+    3. Versión publicada en Eurostat (consulta de metadatos, sin descargar datos)
+    4. Antigüedad (<7 días), solo si no se pudo consultar la versión
     """
-    import os
-
     # 1. Verificar existencia
     if not os.path.exists(CSV_CACHE_FILE_GOODS):
         print("📥 Caché no existe, descargando datos...")
@@ -605,7 +967,17 @@ def update_data_if_needed() -> bool:
         main()
         return True
 
-    # 3. Verificar antigüedad
+    # 3. Verificar versión publicada
+    changed, version = check_dataset_version(GOODS_VERSION_STAGE, 'DS-059331')
+    if version is not None:
+        if changed:
+            print(f"🔄 Eurostat ha publicado datos nuevos ({version.get('last_update') or 'N/A'}), actualizando...")
+            main()
+            return True
+        print(f"✓ Usando caché existente (Eurostat sin cambios, {file_size / 1024 / 1024:.1f} MB)")
+        return False
+
+    # 4. Verificar antigüedad
     cache_age = datetime.now() - datetime.fromtimestamp(os.path.getmtime(CSV_CACHE_FILE_GOODS))
     if cache_age > timedelta(days=7):
         print(f"🔄 Caché antiguo ({cache_age.days} días), actualizando...")
@@ -617,4 +989,14 @@ def update_data_if_needed() -> bool:
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description='Descarga mercancías + servicios agregados de Eurostat')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Descargar solo los periodos recientes y fusionarlos con la caché')
+    parser.add_argument('--force', action='store_true',
+                        help='Descargar aunque Eurostat no haya publicado datos nuevos')
+    parser.add_argument('--resume', action='store_true',
+                        help='Repetir solo los datasets fallidos o pendientes de la última ejecución')
+    args = parser.parse_args()
+
+    ok = main(incremental=args.incremental, force=args.force, resume=args.resume)
+    sys.exit(0 if ok else 1)
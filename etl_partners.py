@@ -11,19 +11,41 @@ Descarga datos bilaterales de comercio (importaciones y exportaciones) para:
 Fuente: Eurostat API DS-059331
 """
 
-import requests
 import pandas as pd
 from pathlib import Path
+import argparse
+import sys
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
 from io import StringIO
 
-# URL base de la API de Eurostat
-BASE_URL = "https://ec.europa.eu/eurostat/api/comext/dissemination/sdmx/3.0/data/dataflow/ESTAT/ds-059331/1.0/*.*.*.*.*.*"
+from data_store import sync_parquet
+from data_versions import record_version, sync_version
+from etl_cache import (FULL_START_PERIOD, check_dataset_version, last_update_epoch, read_cache_csv,
+                       revision_start, save_dataset_version, upsert)
+from eurostat_client import COMEXT_DATA_URL, AdaptiveLimiter, EurostatError, fetch, print_request_stats
+from partner_rollups import sync_rollups, write_rollups
+from run_manifest import RunManifest
+from sql_store import load_table, sync_table
+from trade_cube import VALUES_FILE, build_cube, cube_is_current
+
+# URL base de la API de Eurostat (EUROSTAT_BASE_URL la redirige, ver eurostat_client)
+BASE_URL = COMEXT_DATA_URL
 
 # Directorio de cache
 CACHE_DIR = Path('data/partners')
 CACHE_DIR.mkdir(parents=True, exist_ok=True)
 
+# Concurrencia: número máximo de peticiones simultáneas a Eurostat
+MAX_WORKERS = 8
+
+# Columnas clave para fusionar descargas incrementales con la caché
+KEY_COLUMNS = ['reporter', 'partner', 'product', 'flow', 'TIME_PERIOD']
+
+# Etapa en data/dataset_versions.json (versión de Eurostat descargada)
+VERSION_STAGE = 'partners_goods'
+
 # 31 países europeos (reporters)
 REPORTERS = [
     'AT',  # Austria
@@ -106,7 +128,8 @@ SECTORES_NOMBRES = {
 }
 
 
-def download_partner_data(reporter, flow, start_period='2002-01', end_period='2025-12'):
+def download_partner_data(reporter, flow, start_period=FULL_START_PERIOD, end_period=None,
+                          limiter=None, incremental=False, refresh_before=None):
     """
     Descarga datos de socios comerciales para un país y flujo específico.
 
@@ -114,22 +137,45 @@ def download_partner_data(reporter, flow, start_period='2002-01', end_period='20
         reporter (str): Código ISO del país reporter (e.g., 'ES')
         flow (str): '1' para importaciones, '2' para exportaciones
         start_period (str): Periodo inicio en formato YYYY-MM
-        end_period (str): Periodo fin en formato YYYY-MM
+        end_period (str): Periodo fin en formato YYYY-MM (default: diciembre del año actual)
+        limiter (AdaptiveLimiter): Control de concurrencia compartido (opcional)
+        incremental (bool): Si hay caché, descargar solo la ventana de revisión
+                            desde su último periodo y fusionarla (upsert)
+        refresh_before (float): Timestamp; la caché anterior a este instante se considera
+                                obsoleta (p.ej. última publicación de Eurostat).
+                                None = criterio por antigüedad (7 días)
 
     Returns:
-        pd.DataFrame: DataFrame con los datos descargados, o DataFrame vacío si error
+        pd.DataFrame: DataFrame con los datos descargados, o DataFrame vacío si error.
+        True si la caché es válida (no se descarga ni se lee)
     """
     flow_name = 'imports' if flow == '1' else 'exports'
     cache_file = CACHE_DIR / f"partners_{reporter}_{flow_name}.csv"
 
-    # Verificar si existe cache válido (menos de 7 días)
+    # Verificar si existe cache válido (posterior a la última publicación, o menos de 7 días)
     if cache_file.exists():
-        age_days = (time.time() - cache_file.stat().st_mtime) / 86400
-        if age_days < 7:
+        mtime = cache_file.stat().st_mtime
+        if refresh_before is not None:
+            is_valid = mtime >= refresh_before
+        else:
+            is_valid = (time.time() - mtime) / 86400 < 7
+        if is_valid:
             print(f"✓ Cache válido para {reporter} {flow_name}: {cache_file.name}")
-            return pd.read_csv(cache_file)
-
-    print(f"📥 Descargando {reporter} {flow_name}...")
+            sync_parquet(cache_file, partitioned=True)
+            sync_rollups(cache_file)
+            sync_table(cache_file)
+            sync_version(cache_file)
+            return True
+
+    if end_period is None:
+        end_period = f"{datetime.now().year}-12"
+
+    delta_start = revision_start(cache_file) if incremental else None
+    if delta_start is not None:
+        start_period = delta_start
+        print(f"📥 Descargando {reporter} {flow_name} (incremental desde {start_period})...")
+    else:
+        print(f"📥 Descargando {reporter} {flow_name}...")
 
     # Parámetros de la petición
     # 10 sectores SITC (0-9) en una sola petición
@@ -148,24 +194,37 @@ def download_partner_data(reporter, flow, start_period='2002-01', end_period='20
     }
 
     try:
-        response = requests.get(BASE_URL, params=params, timeout=120)
-        response.raise_for_status()
+        response = fetch(BASE_URL, params=params, timeout=120, limiter=limiter,
+                         label=f"{reporter} {flow_name}")
+
+        if delta_start is not None:
+            # Fusionar la ventana descargada con la caché existente
+            df_new = read_cache_csv(StringIO(response.text))
+            df = upsert(read_cache_csv(cache_file), df_new, KEY_COLUMNS)
+            df.to_csv(cache_file, index=False)
+            sync_parquet(cache_file, partitioned=True)
+            write_rollups(df, cache_file)
+            load_table(df, cache_file)
+            record_version(cache_file)
+            print(f"   ✓ {len(df_new):,} registros actualizados en {cache_file.name} ({len(df):,} en total)")
+            return df
 
         # Parsear CSV
         df = pd.read_csv(StringIO(response.text))
 
-        # Guardar en cache
+        # Guardar en cache (CSV + Parquet, ver data_store), sus agregados (partner_rollups)
+        # y, si está activado, en SQLite (sql_store)
         df.to_csv(cache_file, index=False)
+        sync_parquet(cache_file, partitioned=True)
+        write_rollups(df, cache_file)
+        load_table(df, cache_file)
+        record_version(cache_file)
         print(f"   ✓ {len(df):,} registros guardados en {cache_file.name}")
 
         return df
 
-    except requests.exceptions.Timeout:
-        print(f"   ✗ Error: Timeout después de 120 segundos")
-        return pd.DataFrame()
-
-    except requests.exceptions.RequestException as e:
-        print(f"   ✗ Error en la petición: {e}")
+    except EurostatError as e:
+        print(f"   ✗ Error en la petición {reporter} {flow_name}: {e}")
         return pd.DataFrame()
 
     except Exception as e:
@@ -173,12 +232,59 @@ def download_partner_data(reporter, flow, start_period='2002-01', end_period='20
         return pd.DataFrame()
 
 
-def update_all_partners_data():
+def download_unit(reporter, flow, manifest, **kwargs):
+    """
+    Descarga un archivo reporter/flujo y registra su resultado en el manifiesto.
+    Retorna True si terminó bien (descargado o caché válida)
+    """
+    flow_name = 'imports' if flow == '1' else 'exports'
+    unit = f"{reporter}_{flow_name}"
+    cache_file = CACHE_DIR / f"partners_{reporter}_{flow_name}.csv"
+
+    start = time.time()
+    result = download_partner_data(reporter, flow, **kwargs)
+    seconds = time.time() - start
+
+    if result is True:
+        manifest.record(unit, 'skipped', seconds=seconds)
+        return True
+    if result.empty:
+        manifest.record(unit, 'failed', seconds=seconds, error='Sin datos descargados')
+        return False
+    manifest.record(unit, 'ok', n_bytes=cache_file.stat().st_size, seconds=seconds, rows=len(result))
+    return True
+
+
+def update_trade_cube():
+    """Reconstruye el cubo denso de socios (trade_cube) si algún CSV es más reciente"""
+    if cube_is_current(CACHE_DIR):
+        return
+    start = time.time()
+    cube_dir = build_cube(CACHE_DIR)
+    if cube_dir is not None:
+        size_mb = (cube_dir / VALUES_FILE).stat().st_size / (1024 * 1024)
+        print(f"🧊 Cubo de comercio: {cube_dir / VALUES_FILE} ({size_mb:.1f} MB, {time.time() - start:.1f}s)")
+
+
+def update_all_partners_data(max_workers=MAX_WORKERS, incremental=False, force=False, resume=False):
     """
     Descarga datos de socios comerciales para todos los países y flujos.
 
+    Las descargas se lanzan en paralelo (max_workers peticiones simultáneas);
+    la concurrencia baja automáticamente si Eurostat responde 429 o 5xx.
+    Con incremental=True solo se piden los últimos meses de cada archivo en caché.
+
+    Antes de nada se consulta la versión publicada de DS-059331: si no ha cambiado
+    desde la última descarga completa, no se descarga nada (force=True lo evita).
+
+    El estado de cada archivo se registra en data/manifest/partners_goods.json;
+    con resume=True solo se repiten los archivos fallidos o pendientes.
+
     Total: 31 países × 2 flujos = 62 archivos CSV
-    Tiempo estimado: 10-15 minutos
+    Tiempo estimado: 1-2 minutos (10-15 minutos con max_workers=1)
+
+    Returns:
+        int: número de archivos con error
     """
     print("=" * 80)
     print("DESCARGA DE DATOS DE SOCIOS COMERCIALES")
@@ -187,32 +293,75 @@ def update_all_partners_data():
     print(f"   - Países: {len(REPORTERS)} reporters")
     print(f"   - Socios: {len(PARTNERS)} partners")
     print(f"   - Sectores: {len(SECTORES_SITC)} (SITC 0-9)")
-    print(f"   - Periodo: 2002-01 a 2025-12")
+    print(f"   - Periodo: {FULL_START_PERIOD} a {datetime.now().year}-12")
+    print(f"   - Modo: {'incremental' if incremental else 'completo'}{' (reanudando)' if resume else ''}")
     print(f"   - Directorio: {CACHE_DIR.absolute()}")
+    print(f"   - Peticiones simultáneas: {max_workers}")
     print("=" * 80)
     print()
 
-    total_files = len(REPORTERS) * 2
+    manifest = RunManifest(VERSION_STAGE, resume=resume)
+    units = [(reporter, flow) for reporter in REPORTERS for flow in ['1', '2']]  # 1=imports, 2=exports
     completed = 0
     errors = 0
 
+    if manifest.resumed:
+        # Reanudar con los mismos parámetros de la ejecución interrumpida
+        version = manifest.get('version')
+        refresh_before = manifest.get('refresh_before')
+        units = [(reporter, flow) for reporter, flow in units
+                 if not manifest.is_done(f"{reporter}_{'imports' if flow == '1' else 'exports'}")]
+        print(f"↩️  Reanudando: {len(units)} archivos pendientes o fallidos")
+    elif force:
+        version = None
+        refresh_before = time.time()
+    else:
+        # Versión publicada en Eurostat (consulta de metadatos, sin descargar datos)
+        changed, version = check_dataset_version(VERSION_STAGE, 'DS-059331')
+        all_cached = all(
+            (CACHE_DIR / f"partners_{reporter}_{flow_name}.csv").exists()
+            for reporter in REPORTERS
+            for flow_name in ['imports', 'exports']
+        )
+        if version is not None and not changed and all_cached:
+            print(f"✓ DS-059331 sin cambios en Eurostat (última actualización: {version.get('last_update') or 'N/A'})")
+            print(f"   Se conservan los {len(units)} archivos en caché")
+            for cache_file in CACHE_DIR.glob('partners_*.csv'):
+                sync_parquet(cache_file, partitioned=True)
+                sync_rollups(cache_file)
+                sync_table(cache_file)
+                sync_version(cache_file)
+            for reporter, flow in units:
+                manifest.record(f"{reporter}_{'imports' if flow == '1' else 'exports'}", 'skipped')
+            manifest.finish()
+            update_trade_cube()
+            return 0
+        refresh_before = last_update_epoch(version)
+
+    manifest.set('version', version)
+    manifest.set('refresh_before', refresh_before)
+
+    total_files = len(units)
     start_time = time.time()
+    limiter = AdaptiveLimiter(max_workers)
 
-    for reporter in REPORTERS:
-        for flow in ['1', '2']:  # 1=imports, 2=exports
-            result = download_partner_data(reporter, flow)
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = [
+            executor.submit(download_unit, reporter, flow, manifest, limiter=limiter,
+                            incremental=incremental, refresh_before=refresh_before)
+            for reporter, flow in units
+        ]
 
+        for future in as_completed(futures):
             completed += 1
-            if result.empty:
+            if not future.result():
                 errors += 1
 
             progress_pct = (completed / total_files) * 100
             print(f"Progreso: {completed}/{total_files} ({progress_pct:.1f}%)")
             print()
 
-            # Rate limiting para no saturar la API
-            time.sleep(1)
-
+    manifest.finish()
     elapsed_time = time.time() - start_time
     elapsed_minutes = elapsed_time / 60
 
@@ -231,12 +380,35 @@ def update_all_partners_data():
     total_size = sum(f.stat().st_size for f in CACHE_DIR.glob('*.csv'))
     total_size_mb = total_size / (1024 * 1024)
     print(f"💾 Tamaño total: {total_size_mb:.1f} MB")
+    parquet_size = sum(f.stat().st_size for f in CACHE_DIR.glob('*.parquet'))
+    if parquet_size:
+        print(f"💾 Tamaño Parquet: {parquet_size / (1024 * 1024):.1f} MB")
+    update_trade_cube()
+    print_request_stats()
     print()
 
     if errors > 0:
         print(f"⚠️  Advertencia: {errors} archivos no se pudieron descargar")
-        print("   Vuelve a ejecutar el script para reintentar")
+        print("   Vuelve a ejecutar el script con --resume para reintentar solo esos archivos")
+    elif version is not None:
+        # Registrar la versión solo si todos los archivos están al día
+        save_dataset_version(VERSION_STAGE, version)
+
+    return errors
 
 
 if __name__ == "__main__":
-    update_all_partners_data()
+    parser = argparse.ArgumentParser(description='Descarga datos de socios comerciales (bienes)')
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS,
+                        help=f'Peticiones simultáneas a Eurostat (default: {MAX_WORKERS}, 1 = secuencial)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Descargar solo los periodos recientes y fusionarlos con la caché')
+    parser.add_argument('--force', action='store_true',
+                        help='Descargar todo aunque Eurostat no haya publicado datos nuevos')
+    parser.add_argument('--resume', action='store_true',
+                        help='Repetir solo los archivos fallidos o pendientes de la ejecución anterior')
+    args = parser.parse_args()
+
+    errors = update_all_partners_data(max_workers=args.workers, incremental=args.incremental,
+                                      force=args.force, resume=args.resume)
+    sys.exit(1 if errors else 0)
@@ -1,7 +1,7 @@
 """
 ETL Completo para Socios Comerciales de SERVICIOS
 Descarga iterativa + Procesamiento en un solo script
-Descarga ROBUSTA: Usa curl iterativo por país y une todo en un solo CSV.
+Descarga ROBUSTA: Petición por país (cliente HTTP compartido con reintentos) y une todo en un solo CSV.
 CORRECCIÓN FINAL: Usa labels=id para obtener códigos ISO (BE, FR...) validos para el proceso.
 
 Fuente: Eurostat BOP_C6_Q (Balance of Payments - Quarterly)
@@ -9,17 +9,38 @@ Rango: 2002-Presente
 Ejecutar: python3 etl_partners_services.py
 """
 
-import subprocess
 import sys
 import os
+import argparse
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 import time
 
+from data_store import sync_parquet, write_parquet
+from data_versions import record_version, sync_version
+from etl_cache import (check_dataset_version, month_to_quarter, read_cache_csv, revision_start,
+                       save_dataset_version, upsert)
+from eurostat_client import BOP_DATA_URL, AdaptiveLimiter, EurostatError, download_to_file, print_request_stats
+from partner_rollups import sync_rollups, write_rollups
+from run_manifest import RunManifest
+from sql_store import SQL_ENABLED, load_table, sync_table
+
 CACHE_DIR = Path('data/partners_services')
 CACHE_DIR.mkdir(parents=True, exist_ok=True)
 FINAL_OUTPUT = CACHE_DIR / 'all_bop_services.csv'
 OUTPUT_DIR = CACHE_DIR  # Directorio para archivos procesados
+FULL_START_QUARTER = '2002-Q1'
+
+# Columnas clave de los archivos procesados (el flujo va en el nombre del archivo)
+KEY_COLUMNS = ['reporter', 'partner', 'TIME_PERIOD']
+FLOW_FILES = {'DEB': 'imports', 'CRE': 'exports'}
+
+# Etapa en data/dataset_versions.json (versión de Eurostat descargada)
+VERSION_STAGE = 'partners_services'
+
+# Procesos para la fase 2 (un reporter por tarea)
+PROCESS_WORKERS = os.cpu_count() or 1
 
 # --- MAPEO DE CÓDIGOS EUROSTAT -> ISO ---
 EUROSTAT_TO_ISO = {
@@ -37,7 +58,7 @@ TARGET_REPORTERS = [
 ]
 
 # --- CONFIGURACIÓN DE URL ---
-BASE_URL = "https://ec.europa.eu/eurostat/api/dissemination/sdmx/3.0/data/dataflow/ESTAT/bop_c6_q/1.0/*.*.*.*.*.*.*.*"
+BASE_URL = BOP_DATA_URL  # EUROSTAT_BASE_URL la redirige (ver eurostat_client)
 
 # Países reporteros
 REPORTERS = [
@@ -52,10 +73,11 @@ PARTNERS = (
     "CH,UK,RU,CA,US,BR,CN_X_HK,HK,JP,IN"
 )
 
-def get_curl_url(geo_code):
+def get_curl_url(geo_code, start_period=FULL_START_QUARTER):
     """
     Genera la URL corregida.
     CAMBIO CRÍTICO: labels=id (Eurostat no acepta 'code').
+    start_period: primer trimestre a descargar (YYYY-Qn)
     """
     params = [
         "c%5Bfreq%5D=Q",
@@ -66,7 +88,7 @@ def get_curl_url(geo_code):
         "c%5Bstk_flow%5D=CRE,DEB",
         f"c%5Bpartner%5D={PARTNERS}",
         f"c%5Bgeo%5D={geo_code}",
-        "startPeriod=2002-Q1",    
+        f"startPeriod={start_period}",
         "compress=false",
         "format=csvdata",
         "formatVersion=1.0",      # Mantiene cabecera 'geo'
@@ -76,9 +98,35 @@ def get_curl_url(geo_code):
     ]
     return f"{BASE_URL}?{'&'.join(params)}"
 
-def download_services_data():
+def output_files(reporter_code):
+    """Archivos procesados (imports, exports) de un reporter en código Eurostat"""
+    iso = EUROSTAT_TO_ISO.get(reporter_code, reporter_code)
+    return [OUTPUT_DIR / f'services_partners_{iso}_{flow_name}.csv' for flow_name in FLOW_FILES.values()]
+
+
+def pending_work(manifest):
+    """
+    Unidades pendientes al reanudar: (países a descargar, reporters a procesar).
+    Un país se vuelve a descargar si falló su descarga o si falta procesar su reporter,
+    porque el CSV intermedio no se conserva entre ejecuciones.
+    """
+    reporters = [r for r in TARGET_REPORTERS if not manifest.is_done(f'process:{r}')]
+    countries = [
+        country for country in REPORTERS
+        if not manifest.is_done(f'download:{country}')
+        or EUROSTAT_TO_ISO.get(country, country) in reporters
+    ]
+    return countries, reporters
+
+
+def download_services_data(incremental=False, countries=None, manifest=None):
     """
     FASE 1: Descarga datos de BOP iterativamente por país
+    Cada respuesta se escribe en streaming al final de all_bop_services.csv (sin cargarla en
+    memoria ni pasar por un archivo temporal); la cabecera solo se escribe una vez.
+    Con incremental=True, los países ya procesados solo descargan la ventana de revisión.
+    countries: subconjunto de REPORTERS a descargar (todos por defecto)
+    manifest: RunManifest donde registrar cada país (unidad 'download:<país>')
     Retorna: número de registros descargados
     """
     print("\n" + "=" * 80)
@@ -89,79 +137,154 @@ def download_services_data():
     if FINAL_OUTPUT.exists():
         FINAL_OUTPUT.unlink()
         
-    temp_file = CACHE_DIR / "temp_chunk.csv"
+    if countries is None:
+        countries = REPORTERS
+
+    def record(country, status, **kwargs):
+        if manifest is not None:
+            manifest.record(f'download:{country}', status, **kwargs)
+
+    # Sin pausas fijas: el límite global de peticiones del cliente y el AdaptiveLimiter
+    # marcan el ritmo (frena solo si Eurostat responde 429/5xx o Retry-After)
+    limiter = AdaptiveLimiter(1)
     first_chunk = True
-    total_countries = len(REPORTERS)
+    total_countries = len(countries)
     rows_saved = 0
 
     print(f"Paso 1: Descargando datos iterativamente ({total_countries} países)...")
 
-    for i, country in enumerate(REPORTERS, 1):
-        print(f"[{i}/{total_countries}] Descargando {country}...", end=" ", flush=True)
-        
-        url = get_curl_url(country)
-        
-        # Ejecutar CURL
-        result = subprocess.run(
-            ['curl', '-s', '-o', str(temp_file), url], 
-            capture_output=True,
-            text=True
-        )
+    for i, country in enumerate(countries, 1):
+        delta_start = revision_start(output_files(country)) if incremental else None
+        start_period = month_to_quarter(delta_start) if delta_start else FULL_START_QUARTER
+
+        print(f"[{i}/{total_countries}] Descargando {country} (desde {start_period})...", end=" ", flush=True)
 
-        if result.returncode != 0:
-            print(f"✗ Error curl: {result.stderr}")
+        url = get_curl_url(country, start_period)
+
+        # Descargar en streaming al archivo consolidado (reintentos y S:Fault en el cliente
+        # compartido; un intento fallido se deshace, así que el archivo nunca queda a medias)
+        offset = FINAL_OUTPUT.stat().st_size if FINAL_OUTPUT.exists() else 0
+        try:
+            stats = download_to_file(url, FINAL_OUTPUT, timeout=120, limiter=limiter, label=f"BOP {country}",
+                                     append=True, skip_header=not first_chunk)
+        except EurostatError as e:
+            print(f"✗ Error Eurostat: {str(e)[:100]}...")
+            record(country, 'failed', error=e)
+            continue
+        except OSError as e:
+            print(f"✗ Error IO: {e}")
+            if FINAL_OUTPUT.exists():
+                os.truncate(FINAL_OUTPUT, offset)
+            record(country, 'failed', error=e)
             continue
 
+        n_bytes = stats['bytes_transferred']
+        seconds = stats['seconds']
+        count = stats['rows']
+
         # Verificar datos
-        if not temp_file.exists() or temp_file.stat().st_size < 10:
+        if n_bytes < 10:
             print("⚠️ Error API.")
+            os.truncate(FINAL_OUTPUT, offset)
+            record(country, 'failed', n_bytes=n_bytes, seconds=seconds, error='Respuesta vacía')
             continue
 
-        try:
-            with open(temp_file, 'r', encoding='utf-8') as f_in:
-                lines = f_in.readlines()
-            
-            # Chequeo de error XML en el contenido
-            if len(lines) > 0 and "S:Fault" in lines[0]:
-                print(f"✗ Error Eurostat: {lines[0][:100]}...") # Muestra el inicio del error
-                continue
-
-            # Si hay pocas líneas, puede ser solo cabecera
-            if len(lines) < 2:
-                print(f"⚠️ Sin datos (Solo cabecera).")
-                continue
-                
-            with open(FINAL_OUTPUT, 'a', encoding='utf-8') as f_out:
-                count = len(lines) - 1
-                if first_chunk:
-                    f_out.writelines(lines)
-                    first_chunk = False
-                    print(f"✓ Guardado ({count} registros).")
-                else:
-                    # Escribir solo datos (saltar header)
-                    f_out.writelines(lines[1:])
-                    print(f"✓ Añadido ({count} registros).")
-                
-                rows_saved += count
-
-        except Exception as e:
-            print(f"✗ Error IO: {e}")
-
-        # Pausa amable
-        time.sleep(0.5)
+        # Si no hay filas, puede ser solo cabecera
+        if count == 0:
+            print(f"⚠️ Sin datos (Solo cabecera).")
+            record(country, 'empty', n_bytes=n_bytes, seconds=seconds)
+        else:
+            print(f"✓ {'Guardado' if first_chunk else 'Añadido'} ({count} registros).")
+            rows_saved += count
+            record(country, 'ok', n_bytes=n_bytes, seconds=seconds, rows=count)
+        first_chunk = False
 
-    if temp_file.exists():
-        temp_file.unlink()
 
     print()
     print(f"✓ Descarga consolidada en: {FINAL_OUTPUT}")
     print(f"📊 Total registros descargados: {rows_saved}")
+    print_request_stats()
 
     return rows_saved
 
-def process_services_data():
+def transform_reporter(reporter_code, subset, incremental=False):
+    """
+    Interpola a mensual las filas de un reporter y escribe sus archivos (imports, exports).
+    Se ejecuta en un proceso del pool: recibe solo su partición y escribe solo archivos
+    propios del reporter (CSV, Parquet, agregados). No toca el manifiesto, el registro de
+    versiones ni SQLite: los actualiza el proceso principal con lo que devuelve.
+    Retorna: (estado, bytes escritos, segundos, error o motivo,
+              [(archivo escrito, tabla para SQLite o None si BALANZA_SQLITE no está activo)])
+    """
+    t0 = time.time()
+    try:
+        # Interpolación Trimestral -> Mensual
+        subset = subset.assign(date=pd.PeriodIndex(subset['TIME_PERIOD'], freq='Q').to_timestamp())
+
+        df_pivot = subset.pivot_table(
+            values='OBS_VALUE',
+            index='date',
+            columns=['partner', 'stk_flow'],
+            aggfunc='sum'
+        )
+
+        if df_pivot.empty:
+            return 'empty', 0, time.time() - t0, 'Vacío tras pivotar', []
+
+        # Rango mensual
+        idx = pd.date_range(
+            df_pivot.index.min(),
+            df_pivot.index.max() + pd.offsets.QuarterEnd(0),
+            freq='MS'
+        )
+
+        # Reindexar e interpolar (/ 3)
+        df_monthly = df_pivot.reindex(idx).interpolate(method='linear') / 3
+
+        # Aplanar
+        df_flat = df_monthly.stack([0, 1]).reset_index()
+        df_flat.columns = ['date', 'partner', 'stk_flow', 'value']
+
+        # Formatos
+        df_flat['TIME_PERIOD'] = df_flat['date'].dt.strftime('%Y-%m')
+        df_flat['reporter'] = reporter_code
+
+        # Guardar Archivos
+        n_bytes, written = 0, []
+        for flow_code, flow_name in FLOW_FILES.items():
+            flow_data = df_flat[df_flat['stk_flow'] == flow_code].copy()
+
+            if not flow_data.empty:
+                # Millones -> Unidades
+                flow_data['OBS_VALUE'] = flow_data['value'] * 1_000_000
+
+                final_df = flow_data[['reporter', 'partner', 'TIME_PERIOD', 'OBS_VALUE']]
+
+                outfile = OUTPUT_DIR / f'services_partners_{reporter_code}_{flow_name}.csv'
+                if incremental and outfile.exists():
+                    final_df = upsert(read_cache_csv(outfile), final_df.astype(str), KEY_COLUMNS)
+                final_df.to_csv(outfile, index=False)
+                write_parquet(final_df, outfile, partitioned=True)
+                write_rollups(final_df, outfile)
+                written.append((outfile, final_df if SQL_ENABLED else None))
+                n_bytes += outfile.stat().st_size
+
+        if not n_bytes:
+            return 'empty', 0, time.time() - t0, 'Sin flujos', []
+        return 'ok', n_bytes, time.time() - t0, None, written
+
+    except Exception as e:
+        return 'failed', 0, time.time() - t0, str(e), []
+
+
+def process_services_data(incremental=False, reporters=None, manifest=None, workers=PROCESS_WORKERS):
     """
     FASE 2: Procesa all_bop_services.csv y genera archivos por país
+    Con incremental=True, los meses procesados se fusionan (upsert) con los archivos existentes.
+    reporters: subconjunto de TARGET_REPORTERS a procesar (todos por defecto)
+    manifest: RunManifest donde registrar cada reporter (unidad 'process:<ISO>')
+    workers: procesos en paralelo; la tabla se parte por reporter con un solo groupby y
+             cada proceso recibe solo su partición (workers=1 procesa en este proceso)
     Retorna: número de países procesados exitosamente
     """
     print("\n" + "=" * 80)
@@ -203,94 +326,122 @@ def process_services_data():
         print("✗ Error: Columna TIME_PERIOD no encontrada.")
         sys.exit(1)
 
-    success_count = 0
-
-    for reporter_code in TARGET_REPORTERS:
-        print(f"📊 Procesando {reporter_code}...", end=" ", flush=True)
-
-        subset = df[df['geo'] == reporter_code].copy()
-
-        if subset.empty:
-            print(f"⚠️ Sin datos")
-            continue
-
-        try:
-            # Interpolación Trimestral -> Mensual
-            subset['date'] = pd.PeriodIndex(subset['TIME_PERIOD'], freq='Q').to_timestamp()
-
-            df_pivot = subset.pivot_table(
-                values='OBS_VALUE',
-                index='date',
-                columns=['partner', 'stk_flow'],
-                aggfunc='sum'
-            )
-
-            if df_pivot.empty:
-                print("⚠️ Vacío tras pivotar")
-                continue
-
-            # Rango mensual
-            idx = pd.date_range(
-                df_pivot.index.min(),
-                df_pivot.index.max() + pd.offsets.QuarterEnd(0),
-                freq='MS'
-            )
-
-            # Reindexar e interpolar (/ 3)
-            df_monthly = df_pivot.reindex(idx).interpolate(method='linear') / 3
-
-            # Aplanar
-            df_flat = df_monthly.stack([0, 1]).reset_index()
-            df_flat.columns = ['date', 'partner', 'stk_flow', 'value']
-
-            # Formatos
-            df_flat['TIME_PERIOD'] = df_flat['date'].dt.strftime('%Y-%m')
-            df_flat['reporter'] = reporter_code
+    if reporters is None:
+        reporters = TARGET_REPORTERS
 
-            # Guardar Archivos
-            generated = False
-            flow_map = {'DEB': 'imports', 'CRE': 'exports'}
+    def record(reporter_code, status, **kwargs):
+        if manifest is not None:
+            manifest.record(f'process:{reporter_code}', status, **kwargs)
 
-            for flow_code, flow_name in flow_map.items():
-                flow_data = df_flat[df_flat['stk_flow'] == flow_code].copy()
+    # Particionar una sola vez: cada tarea recibe solo las filas de su reporter
+    groups = {code: subset for code, subset in df.groupby('geo', sort=False) if code in reporters}
+    del df
 
-                if not flow_data.empty:
-                    # Millones -> Unidades
-                    flow_data['OBS_VALUE'] = flow_data['value'] * 1_000_000
+    workers = max(1, min(workers, len(groups)))
+    print(f"⚙️  Procesando {len(groups)} reporters con {workers} proceso(s)...")
 
-                    final_df = flow_data[['reporter', 'partner', 'TIME_PERIOD', 'OBS_VALUE']]
-
-                    outfile = OUTPUT_DIR / f'services_partners_{reporter_code}_{flow_name}.csv'
-                    final_df.to_csv(outfile, index=False)
-                    generated = True
-
-            if generated:
-                print("✓ OK")
-                success_count += 1
-            else:
-                print("⚠️ Sin flujos")
-
-        except Exception as e:
-            print(f"✗ Error: {e}")
+    success_count = 0
+    for reporter_code in reporters:
+        if reporter_code not in groups:
+            print(f"📊 {reporter_code}: ⚠️ Sin datos")
+            record(reporter_code, 'empty')
+
+    def collect(reporter_code, result):
+        nonlocal success_count
+        status, n_bytes, seconds, error, written = result
+        # SQLite y versiones se actualizan aquí, en un solo proceso: un solo escritor en
+        # trade.sqlite, y un fallo del registro no invalida los archivos ya escritos
+        # (sin registro, el widget usa su fecha y tamaño)
+        for outfile, table in written:
+            if table is not None:
+                load_table(table, outfile)
+            try:
+                record_version(outfile)
+            except (OSError, ValueError) as e:
+                print(f"📊 {reporter_code}: ⚠️ No se pudo registrar la versión de {outfile.name}: {e}")
+        if status == 'ok':
+            print(f"📊 {reporter_code}: ✓ OK ({seconds:.1f}s)")
+            success_count += 1
+        elif status == 'failed':
+            print(f"📊 {reporter_code}: ✗ Error: {error}")
+        else:
+            print(f"📊 {reporter_code}: ⚠️ {error}")
+            error = None
+        record(reporter_code, status, n_bytes=n_bytes, seconds=seconds, error=error)
+
+    if workers == 1:
+        for reporter_code in list(groups):
+            collect(reporter_code, transform_reporter(reporter_code, groups.pop(reporter_code), incremental))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(transform_reporter, reporter_code, groups.pop(reporter_code), incremental): reporter_code
+                for reporter_code in list(groups)
+            }
+            for future in as_completed(futures):
+                collect(futures[future], future.result())
 
     print()
-    print(f"📊 Países procesados: {success_count}/{len(TARGET_REPORTERS)}")
+    print(f"📊 Países procesados: {success_count}/{len(reporters)}")
     return success_count
 
-def main():
+def main(incremental=False, force=False, resume=False, workers=PROCESS_WORKERS):
+    """
+    workers: procesos para la fase de procesamiento
+    Retorna: número de unidades fallidas (0 si todo fue bien)
+    """
     print("=" * 80)
     print("ETL SERVICIOS COMPLETO - SOCIOS COMERCIALES")
+    print(f"Modo: {'incremental' if incremental else 'completo'}{' (reanudando)' if resume else ''}")
     print("=" * 80)
 
+    manifest = RunManifest(VERSION_STAGE, resume=resume)
+    countries, reporters = REPORTERS, TARGET_REPORTERS
+
+    if manifest.resumed:
+        # Reanudar: misma versión objetivo, solo las unidades que no terminaron bien
+        version = manifest.get('version')
+        countries, reporters = pending_work(manifest)
+        print(f"🔁 Reanudando: {len(countries)} países por descargar, {len(reporters)} por procesar")
+        if not countries and not reporters:
+            manifest.finish()
+            print("✓ No quedan unidades pendientes")
+            return 0
+    else:
+        # Fase 0: ¿Ha publicado Eurostat datos nuevos? (consulta de metadatos, sin descargar datos)
+        version = None
+        if not force:
+            changed, version = check_dataset_version(VERSION_STAGE, 'BOP_C6_Q')
+            has_outputs = any(OUTPUT_DIR.glob('services_partners_*.csv'))
+            if version is not None and not changed and has_outputs:
+                print(f"✓ BOP_C6_Q sin cambios en Eurostat (última actualización: {version.get('last_update') or 'N/A'})")
+                print(f"   Se conservan los archivos en: {CACHE_DIR.absolute()}")
+                for outfile in OUTPUT_DIR.glob('services_partners_*.csv'):
+                    sync_parquet(outfile, partitioned=True)
+                    sync_rollups(outfile)
+                    sync_table(outfile)
+                    sync_version(outfile)
+                for reporter_code in TARGET_REPORTERS:
+                    manifest.record(f'process:{reporter_code}', 'skipped')
+                manifest.finish()
+                return 0
+        manifest.set('version', version)
+
     # Fase 1: Descarga
-    rows_saved = download_services_data()
+    rows_saved = download_services_data(incremental, countries, manifest)
 
     if rows_saved == 0:
         print("✗ Error CRÍTICO: No se han descargado datos válidos.")
+        manifest.finish()
         sys.exit(1)
 
     # Fase 2: Procesamiento
-    success_count = process_services_data()
+    success_count = process_services_data(incremental, reporters, manifest, workers)
+
+    failed = manifest.summary()['failed']
+    if version is not None and not failed:
+        save_dataset_version(VERSION_STAGE, version)
+    manifest.finish()
 
     # Fase 3: Limpieza de archivo temporal
     if FINAL_OUTPUT.exists():
@@ -300,10 +451,26 @@ def main():
 
     print()
     print("=" * 80)
-    print("✅ ETL COMPLETADO")
+    print("✅ ETL COMPLETADO" if not failed else f"⚠️  ETL COMPLETADO CON {len(failed)} UNIDADES FALLIDAS")
     print(f"✓ Datos procesados: {success_count} países")
+    if failed:
+        print(f"   Fallidas: {', '.join(failed)}")
+        print("   Repetir solo las fallidas con: python3 etl_partners_services.py --resume")
     print(f"📁 Directorio: {CACHE_DIR.absolute()}")
     print("=" * 80)
+    return len(failed)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='ETL de socios comerciales de servicios (BOP)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Descargar solo los periodos recientes y fusionarlos con los archivos existentes')
+    parser.add_argument('--force', action='store_true',
+                        help='Descargar aunque Eurostat no haya publicado datos nuevos')
+    parser.add_argument('--resume', action='store_true',
+                        help='Repetir solo los países fallidos o pendientes de la última ejecución')
+    parser.add_argument('--workers', type=int, default=PROCESS_WORKERS,
+                        help=f'Procesos para la fase de procesamiento (por defecto: {PROCESS_WORKERS})')
+    args = parser.parse_args()
+
+    failed = main(incremental=args.incremental, force=args.force, resume=args.resume, workers=args.workers)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,485 @@
+"""
+Cliente HTTP compartido para la API de Eurostat
+================================================
+
+Usado por los tres ETL (etl_loader_completo, etl_partners, etl_partners_services):
+- Sesión única con pool de conexiones keep-alive (sin handshake TLS por petición)
+- Transferencia comprimida (gzip/deflate)
+- Reintentos con backoff exponencial en timeouts, errores de red, 429 y 5xx,
+  respetando la cabecera Retry-After
+- Detección de errores SOAP de Eurostat (S:Fault) en el cuerpo de la respuesta
+- Registro de tiempos y bytes por petición
+- Consulta barata de la versión publicada de un dataflow (metadatos + peticiones condicionales)
+- Descarga en streaming a disco con descompresión incremental (compress=true)
+- Límite global de peticiones simultáneas por proceso (EUROSTAT_MAX_REQUESTS), que
+  update_all_data reparte entre las etapas que se ejecutan a la vez
+- URL base configurable (EUROSTAT_BASE_URL) para apuntar los ETL a un servidor local
+  (ver eurostat_standin.py y benchmark_etl.py)
+"""
+
+import os
+import random
+import re
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Reintentos por petición (además del primer intento)
+MAX_RETRIES = 4
+# Backoff inicial y máximo entre reintentos (segundos)
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+# Tamaño del pool de conexiones (debe cubrir las peticiones simultáneas)
+POOL_SIZE = 16
+# Tamaño de bloque en descargas en streaming (bytes)
+CHUNK_SIZE = 1024 * 1024
+# Máximo de peticiones en curso en este proceso (0 = sin límite global)
+MAX_CONCURRENT_REQUESTS = int(os.environ.get('EUROSTAT_MAX_REQUESTS', '0') or 0)
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'text/csv, text/plain, application/csv, */*',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Accept-Encoding': 'gzip, deflate',
+    'Connection': 'keep-alive',
+}
+
+# Raíz de la API de Eurostat (EUROSTAT_BASE_URL=http://127.0.0.1:8765 para el servidor local)
+DEFAULT_BASE_URL = 'https://ec.europa.eu/eurostat/api'
+BASE_URL = os.environ.get('EUROSTAT_BASE_URL', DEFAULT_BASE_URL).rstrip('/')
+
+# Endpoints de datos SDMX 3.0 usados por los ETL
+COMEXT_DATA_URL = f"{BASE_URL}/comext/dissemination/sdmx/3.0/data/dataflow/ESTAT/ds-059331/1.0/*.*.*.*.*.*"
+BOP_DATA_URL = f"{BASE_URL}/dissemination/sdmx/3.0/data/dataflow/ESTAT/bop_c6_q/1.0/*.*.*.*.*.*.*.*"
+
+# Estructura del dataflow (pocos KB): incluye la anotación UPDATE_DATA con la última publicación
+METADATA_URLS = {
+    'DS-059331': f"{BASE_URL}/comext/dissemination/sdmx/2.1/dataflow/ESTAT/DS-059331/1.0",
+    'BOP_C6_Q': f"{BASE_URL}/dissemination/sdmx/2.1/dataflow/ESTAT/BOP_C6_Q/1.0",
+}
+
+_ANNOTATION_RE = re.compile(r'<(?:\w+:)?Annotation>(.*?)</(?:\w+:)?Annotation>', re.DOTALL)
+_ANNOTATION_TITLE_RE = re.compile(r'<(?:\w+:)?AnnotationTitle>([^<]+)</(?:\w+:)?AnnotationTitle>')
+
+_session = None
+_session_lock = threading.Lock()
+
+_request_slots = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS) if MAX_CONCURRENT_REQUESTS > 0 else None
+_slot_local = threading.local()
+
+# Registro de peticiones: dicts con label, status, bytes, seconds, attempts
+REQUEST_LOG = []
+_log_lock = threading.Lock()
+
+
+class EurostatError(Exception):
+    """Error definitivo de Eurostat tras agotar reintentos (HTTP, red o S:Fault)"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class AdaptiveLimiter:
+    """
+    Limita las peticiones simultáneas a Eurostat y se adapta a la respuesta del servidor.
+
+    - 429 / 5xx: reduce el límite a la mitad y pausa nuevas peticiones (backoff exponencial
+      o el tiempo indicado por Retry-After, el mayor de los dos)
+    - Respuestas correctas: recupera el límite de uno en uno hasta el máximo configurado
+    """
+
+    def __init__(self, max_concurrency):
+        self.max_concurrency = max(1, max_concurrency)
+        self.limit = self.max_concurrency
+        self.in_flight = 0
+        self._successes = 0
+        self._backoff = BACKOFF_BASE
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """Bloquea hasta que haya hueco para una petición más"""
+        with self._cond:
+            while True:
+                wait = self._paused_until - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                elif self.in_flight >= self.limit:
+                    self._cond.wait()
+                else:
+                    break
+            self.in_flight += 1
+
+    def release(self, throttled=False, retry_after=None):
+        """Libera el hueco; throttled=True si el servidor pidió frenar (429/5xx)"""
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(1, self.limit // 2)
+                pause = max(self._backoff, retry_after or 0)
+                self._paused_until = max(self._paused_until, time.monotonic() + pause)
+                self._backoff = min(self._backoff * 2, BACKOFF_MAX)
+                self._successes = 0
+            else:
+                self._backoff = BACKOFF_BASE
+                self._successes += 1
+                if self.limit < self.max_concurrency and self._successes >= self.limit:
+                    self.limit += 1
+                    self._successes = 0
+            self._cond.notify_all()
+
+
+@contextmanager
+def request_slot():
+    """
+    Ocupa una plaza del límite global de peticiones mientras dura el bloque.
+    Es reentrante por hilo: una descarga en streaming ocupa una sola plaza
+    aunque llame internamente a fetch().
+    """
+    depth = getattr(_slot_local, 'depth', 0)
+    if _request_slots is not None and depth == 0:
+        _request_slots.acquire()
+    _slot_local.depth = depth + 1
+    try:
+        yield
+    finally:
+        _slot_local.depth = depth
+        if _request_slots is not None and depth == 0:
+            _request_slots.release()
+
+
+def get_session():
+    """Retorna la sesión HTTP compartida (se crea la primera vez)"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers.update(DEFAULT_HEADERS)
+            _session = session
+        return _session
+
+
+def parse_retry_after(value):
+    """Convierte la cabecera Retry-After (segundos o fecha HTTP) a segundos"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        target = parsedate_to_datetime(value)
+        return max(0.0, target.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def check_fault(text):
+    """
+    Lanza EurostatError si el texto (inicio del cuerpo) es un error SOAP de Eurostat.
+    Eurostat puede responder HTTP 200 con un XML <S:Fault> en lugar del CSV.
+    """
+    if text and 'S:Fault' in text[:2000]:
+        raise EurostatError(f"Eurostat S:Fault: {text[:300].strip()}")
+
+
+def fetch(url, params=None, timeout=120, stream=False, limiter=None,
+          max_retries=MAX_RETRIES, label='', headers=None):
+    """
+    Petición GET con reintentos y backoff exponencial.
+
+    Args:
+        url (str): URL completa o base
+        params (dict): Parámetros de consulta (opcional)
+        timeout (int): Timeout por intento en segundos
+        stream (bool): Si True, no descarga el cuerpo (el llamador itera la respuesta
+                       y debe comprobar S:Fault en el primer bloque con check_fault)
+        limiter (AdaptiveLimiter): Control de concurrencia compartido (opcional)
+        max_retries (int): Reintentos además del primer intento
+        label (str): Etiqueta para logs y estadísticas
+        headers (dict): Cabeceras adicionales (p.ej. If-None-Match)
+
+    Returns:
+        requests.Response con status 2xx/304 (atributos extra: fetch_seconds, attempts)
+
+    Raises:
+        EurostatError: si tras los reintentos no hay respuesta válida
+    """
+    session = get_session()
+    start = time.time()
+    backoff = BACKOFF_BASE
+    last_error = None
+    status = None
+
+    for attempt in range(max_retries + 1):
+        if limiter is not None:
+            limiter.acquire()
+
+        response = None
+        retry_after = None
+        retryable = False
+        try:
+            with request_slot():
+                response = session.get(url, params=params, headers=headers, timeout=timeout, stream=stream)
+                status = response.status_code
+                if status == 429 or status >= 500:
+                    retryable = True
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                    last_error = EurostatError(f"HTTP {status}", status)
+                    response.close()
+                elif status >= 400:
+                    last_error = EurostatError(f"HTTP {status}: {response.text[:300]}", status)
+                elif not stream:
+                    check_fault(response.text)
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+            retryable = True
+            last_error = EurostatError(f"Error de red: {e}")
+        except requests.exceptions.RequestException as e:
+            last_error = EurostatError(f"Error de la petición: {e}")
+        except EurostatError as e:
+            last_error = e
+        finally:
+            if limiter is not None:
+                limiter.release(throttled=retryable, retry_after=retry_after)
+
+        if last_error is None:
+            response.fetch_seconds = time.time() - start
+            response.attempts = attempt + 1
+            if not stream:
+                record_request(label, status, len(response.content), response.fetch_seconds, attempt + 1)
+            return response
+
+        if not retryable or attempt == max_retries:
+            break
+
+        delay = max(backoff, retry_after or 0) + random.uniform(0, 0.5)
+        print(f"   ⏳ {label or url[:60]}: {last_error}, reintento {attempt + 1}/{max_retries} en {delay:.1f}s")
+        if limiter is None:
+            time.sleep(delay)
+        backoff = min(backoff * 2, BACKOFF_MAX)
+        last_error = None
+
+    record_request(label, status, 0, time.time() - start, attempt + 1, error=str(last_error))
+    raise last_error
+
+
+def download_to_file(url, dest_file, params=None, timeout=300, limiter=None,
+                     max_retries=MAX_RETRIES, label='', append=False, skip_header=False):
+    """
+    Descarga en streaming directamente a disco, sin mantener la respuesta en memoria.
+
+    Si el cuerpo viene comprimido en gzip (compress=true de Eurostat) se descomprime
+    de forma incremental. Durante la escritura se comprueba S:Fault en el primer bloque,
+    se extrae la cabecera CSV y se cuentan las filas.
+
+    Args:
+        url (str): URL completa o base
+        dest_file (str): Archivo de destino (se sobrescribe salvo con append)
+        params, timeout, limiter, label: como en fetch()
+        max_retries (int): Reintentos en total, sumando los de fetch y los de las
+                           descargas interrumpidas
+        append (bool): Añadir al final de dest_file (un intento fallido se deshace truncando)
+        skip_header (bool): No escribir la línea de cabecera (para consolidar varias descargas)
+
+    Returns:
+        dict: header (lista de columnas), rows, bytes_transferred, bytes_written, seconds
+
+    Raises:
+        EurostatError: si la descarga falla tras los reintentos (S:Fault incluido);
+                       con append, dest_file queda como estaba
+    """
+    start = time.time()
+    offset = os.path.getsize(dest_file) if append and os.path.exists(dest_file) else 0
+
+    # Un solo presupuesto de max_retries + 1 intentos: los que gasta fetch (HTTP 429/5xx,
+    # red) y los de las descargas interrumpidas
+    attempts = 0
+    while True:
+        # La plaza del límite global se mantiene hasta terminar de leer el cuerpo
+        with request_slot():
+            try:
+                response = fetch(url, params=params, timeout=timeout, stream=True, limiter=limiter,
+                                 max_retries=max_retries - attempts, label=label)
+            except EurostatError:
+                _truncate(dest_file, offset, append)
+                raise
+            try:
+                stats = _stream_body(response, dest_file, append, skip_header)
+                error = None
+            except (requests.exceptions.RequestException, zlib.error) as e:
+                error = e
+            except EurostatError:
+                _truncate(dest_file, offset, append)
+                raise
+            finally:
+                response.close()
+
+        attempts += response.attempts
+        if error is None:
+            break
+        _truncate(dest_file, offset, append)
+        if attempts > max_retries:
+            record_request(label, response.status_code, 0, time.time() - start, attempts, error=str(error))
+            raise EurostatError(f"Descarga interrumpida: {error}")
+        print(f"   ⏳ {label or url[:60]}: descarga interrumpida ({error}), reintento {attempts}/{max_retries}")
+        time.sleep(min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX))
+
+    stats['seconds'] = time.time() - start
+    record_request(label, response.status_code, stats['bytes_transferred'], stats['seconds'], attempts)
+    return stats
+
+
+def _truncate(dest_file, offset, append):
+    """Deshace lo escrito por un intento fallido (solo en modo append; si no, se sobrescribe)"""
+    if append and os.path.exists(dest_file):
+        os.truncate(dest_file, offset)
+
+
+def _stream_body(response, dest_file, append=False, skip_header=False):
+    """
+    Escribe el cuerpo de una respuesta en streaming a dest_file (ver download_to_file).
+    Hasta tener la primera línea completa no se escribe nada: así S:Fault se detecta
+    antes de tocar el archivo y la cabecera se puede omitir (skip_header).
+    """
+    decompressor = None
+    header_buffer = b''
+    header = None
+    lines = 0
+    written = 0
+    last_byte = b'\n'
+
+    def write(data):
+        nonlocal written, lines, last_byte
+        if data:
+            f.write(data)
+            written += len(data)
+            lines += data.count(b'\n')
+            last_byte = data[-1:]
+
+    def body(data):
+        # Primer bloque(s): acumular hasta la cabecera completa, comprobando S:Fault
+        nonlocal header, header_buffer
+        if header is not None:
+            return data
+        header_buffer += data
+        check_fault(header_buffer[:2000].decode('utf-8', errors='replace'))
+        if b'\n' not in header_buffer:
+            return b''
+        first_line, rest = header_buffer.split(b'\n', 1)
+        header = first_line.decode('utf-8-sig').strip().split(',')
+        header_buffer = b''
+        return rest if skip_header else first_line + b'\n' + rest
+
+    with open(dest_file, 'ab' if append else 'wb') as f:
+        for chunk in response.iter_content(CHUNK_SIZE):
+            if not chunk:
+                continue
+            if header is None and not header_buffer and decompressor is None and chunk[:2] == b'\x1f\x8b':
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            data = decompressor.decompress(chunk) if decompressor else chunk
+            write(body(data))
+
+        if decompressor is not None:
+            write(body(decompressor.flush()))
+
+        # Respuesta de una sola línea sin salto final: es la cabecera
+        if header is None and header_buffer:
+            header = header_buffer.decode('utf-8-sig').strip().split(',')
+            if not skip_header:
+                write(header_buffer)
+
+        if last_byte != b'\n':
+            write(b'\n')  # Última fila sin salto de línea final (la siguiente descarga empieza en línea nueva)
+
+    return {
+        'header': header or [],
+        'rows': max(0, lines - (0 if skip_header else 1)),
+        'bytes_transferred': response.raw.tell() or written,
+        'bytes_written': written,
+    }
+
+
+def probe_dataset_version(dataflow, previous=None, timeout=30):
+    """
+    Consulta la versión publicada de un dataflow sin descargar datos.
+
+    Pide la estructura del dataflow (pocos KB) con If-None-Match / If-Modified-Since
+    de la versión anterior; un 304 confirma que no hay cambios.
+
+    Args:
+        dataflow (str): Clave de METADATA_URLS ('DS-059331', 'BOP_C6_Q')
+        previous (dict): Versión guardada en la ejecución anterior (opcional)
+
+    Returns:
+        dict: last_update (anotación UPDATE_DATA), etag, last_modified, not_modified
+
+    Raises:
+        EurostatError: si la consulta falla
+    """
+    previous = previous or {}
+    headers = {}
+    if previous.get('etag'):
+        headers['If-None-Match'] = previous['etag']
+    if previous.get('last_modified'):
+        headers['If-Modified-Since'] = previous['last_modified']
+
+    response = fetch(METADATA_URLS[dataflow], headers=headers, timeout=timeout,
+                     max_retries=1, label=f"metadatos {dataflow}")
+
+    if response.status_code == 304:
+        return {**previous, 'not_modified': True}
+
+    last_update = None
+    for annotation in _ANNOTATION_RE.findall(response.text):
+        if 'UPDATE_DATA' in annotation:
+            title = _ANNOTATION_TITLE_RE.search(annotation)
+            last_update = title.group(1).strip() if title else None
+            break
+
+    return {
+        'last_update': last_update,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'not_modified': False,
+    }
+
+
+def record_request(label, status, n_bytes, seconds, attempts, error=None):
+    """Añade una entrada al registro de peticiones (thread-safe)"""
+    with _log_lock:
+        REQUEST_LOG.append({
+            'label': label,
+            'status': status,
+            'bytes': n_bytes,
+            'seconds': seconds,
+            'attempts': attempts,
+            'error': error,
+        })
+
+
+def print_request_stats():
+    """Imprime un resumen de las peticiones realizadas en este proceso"""
+    with _log_lock:
+        log = list(REQUEST_LOG)
+
+    if not log:
+        return
+
+    total_bytes = sum(r['bytes'] for r in log)
+    total_seconds = sum(r['seconds'] for r in log)
+    retries = sum(r['attempts'] - 1 for r in log)
+    failed = sum(1 for r in log if r['error'])
+    slowest = max(log, key=lambda r: r['seconds'])
+
+    print(f"🌐 Peticiones HTTP: {len(log)} ({failed} fallidas, {retries} reintentos)")
+    print(f"   Transferido: {total_bytes / (1024 * 1024):.1f} MB en {total_seconds:.1f}s acumulados")
+    print(f"   Más lenta: {slowest['label'] or '-'} ({slowest['seconds']:.1f}s)")
@@ -0,0 +1,505 @@
+"""
+Servidor local que imita la API de Eurostat
+============================================
+
+Sustituto offline de los endpoints SDMX usados por los ETL, para medir y probar
+concurrencia, parseo y reintentos sin depender de la API real:
+- Datos SDMX 3.0 de Comext DS-059331 (build_eurostat_api_url, download_partner_data)
+- Datos SDMX 3.0 de BOP_C6_Q (build_bop_services_api_url, get_curl_url)
+- Estructura SDMX 2.1 de ambos dataflows (anotación UPDATE_DATA, ETag, 304)
+
+Las respuestas son CSV sintéticos y deterministas generados a partir de los filtros
+c[...] de la consulta (mismas columnas que Eurostat según formatVersion y labels), o
+respuestas grabadas (--fixtures DIR; con --record se graban desde la API real).
+
+Fallos configurables: latencia, 429 con Retry-After, 503, S:Fault con HTTP 200 y
+cuerpos que llegan gota a gota (--drip-rate bytes/s).
+
+Uso:
+    python3 eurostat_standin.py --port 8765 --latency 0.2 --throttle-rate 0.05
+    EUROSTAT_BASE_URL=http://127.0.0.1:8765 python3 etl_partners.py --force
+
+Estadísticas del servidor: GET /_standin/stats
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from datetime import datetime
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
+from eurostat_client import DEFAULT_BASE_URL, DEFAULT_HEADERS
+
+COMEXT_DATA_PREFIX = '/comext/dissemination/sdmx/3.0/data/dataflow/ESTAT/ds-059331/'
+BOP_DATA_PREFIX = '/dissemination/sdmx/3.0/data/dataflow/ESTAT/bop_c6_q/'
+METADATA_PATHS = {
+    '/comext/dissemination/sdmx/2.1/dataflow/ESTAT/DS-059331/1.0': 'DS-059331',
+    '/dissemination/sdmx/2.1/dataflow/ESTAT/BOP_C6_Q/1.0': 'BOP_C6_Q',
+}
+STATS_PATH = '/_standin/stats'
+
+# Anotación UPDATE_DATA por defecto (fija para que las versiones sean reproducibles)
+DEFAULT_LAST_UPDATE = '2026-01-12T23:00:00+0100'
+
+# Etiquetas (labels=label_only) de los códigos que piden los ETL
+COMEXT_REPORTER_LABELS = {
+    'AT': 'Austria',
+    'BE': "Belgium (incl. Luxembourg 'LU' -> 1998)",
+    'BG': 'Bulgaria',
+    'HR': 'Croatia',
+    'CY': 'Cyprus',
+    'CZ': 'Czechia',
+    'DK': 'Denmark',
+    'EE': 'Estonia',
+    'FI': 'Finland',
+    'FR': ("France (incl. Saint Barthélemy 'BL' -> 2012; incl. French Guiana 'GF', Guadeloupe 'GP', "
+           "Martinique 'MQ', Réunion 'RE' from 1997; incl. Mayotte 'YT' from 2014)"),
+    'DE': "Germany (incl. German Democratic Republic 'DD' from 1991)",
+    'GR': 'Greece',
+    'HU': 'Hungary',
+    'IE': 'Ireland (Eire)',
+    'IT': "Italy (incl. San Marino 'SM' -> 1993)",
+    'LV': 'Latvia',
+    'LT': 'Lithuania',
+    'LU': 'Luxembourg',
+    'MT': 'Malta',
+    'NL': 'Netherlands',
+    'PL': 'Poland',
+    'PT': 'Portugal',
+    'RO': 'Romania',
+    'SK': 'Slovakia',
+    'SI': 'Slovenia',
+    'ES': "Spain (incl. Canary Islands 'XB' from 1997)",
+    'SE': 'Sweden',
+    'GB': 'United Kingdom',
+    'NO': "Norway (incl. Svalbard and Jan Mayen 'SJ' -> 1994 and again from 1997)",
+    'CH': "Switzerland (incl. Liechtenstein 'LI' -> 1994)",
+    'EU27_2020': ('European Union - 27 countries (AT, BE, BG, CY, CZ, DE, DK, EE, EL, ES, FI, FR, HR, HU, IE, '
+                  'IT, LT, LU, LV, MT, NL, PL, PT, RO, SE, SI, SK)'),
+    'WORLD': 'All countries of the world',
+}
+SITC_LABELS = {
+    'TOTAL': 'Total all products',
+    '0': 'Food and live animals',
+    '1': 'Beverages and tobacco',
+    '2': 'Crude materials, inedible, except fuels',
+    '3': 'Mineral fuels, lubricants and related materials',
+    '4': 'Animal and vegetable oils, fats and waxes',
+    '5': 'Chemicals and related products, n.e.s.',
+    '6': 'Manufactured goods classified chiefly by material',
+    '7': 'Machinery and transport equipment',
+    '8': 'Miscellaneous manufactured articles',
+    '9': 'Commodities and transactions not classified elsewhere',
+}
+BOP_GEO_LABELS = {
+    'AT': 'Austria', 'BE': 'Belgium', 'BG': 'Bulgaria', 'HR': 'Croatia', 'CY': 'Cyprus',
+    'CZ': 'Czechia', 'DK': 'Denmark', 'EE': 'Estonia', 'FI': 'Finland', 'FR': 'France',
+    'DE': 'Germany', 'EL': 'Greece', 'HU': 'Hungary', 'IE': 'Ireland', 'IT': 'Italy',
+    'LV': 'Latvia', 'LT': 'Lithuania', 'LU': 'Luxembourg', 'MT': 'Malta', 'NL': 'Netherlands',
+    'PL': 'Poland', 'PT': 'Portugal', 'RO': 'Romania', 'SK': 'Slovakia', 'SI': 'Slovenia',
+    'ES': 'Spain', 'SE': 'Sweden', 'UK': 'United Kingdom', 'NO': 'Norway', 'CH': 'Switzerland',
+    'IS': 'Iceland', 'WRL_REST': 'Rest of the world',
+}
+OTHER_LABELS = {
+    'freq': {'M': 'Monthly', 'Q': 'Quarterly'},
+    'flow': {'1': 'IMPORT', '2': 'EXPORT'},
+    'indicators': {'VALUE_EUR': 'VALUE_IN_EUROS'},
+    'currency': {'MIO_EUR': 'Million euro'},
+    'bop_item': {'S': 'Services'},
+    'sector10': {'S1': 'Total economy'},
+    'sectpart': {'S1': 'Total economy'},
+    'stk_flow': {'CRE': 'Credit', 'DEB': 'Debit'},
+}
+
+# Dimensiones de cada dataflow (orden de columnas) y valor por defecto si no se filtra
+COMEXT_DIMENSIONS = [
+    ('freq', ['M']),
+    ('reporter', ['ES']),
+    ('partner', ['WORLD']),
+    ('product', ['TOTAL']),
+    ('flow', ['1', '2']),
+    ('indicators', ['VALUE_EUR']),
+]
+BOP_DIMENSIONS = [
+    ('freq', ['Q']),
+    ('currency', ['MIO_EUR']),
+    ('bop_item', ['S']),
+    ('sector10', ['S1']),
+    ('sectpart', ['S1']),
+    ('stk_flow', ['CRE', 'DEB']),
+    ('partner', ['WRL_REST']),
+    ('geo', ['ES']),
+]
+
+_PERIOD_RE = re.compile(r'(ge|le):(\d{4})-(Q?)(\d{1,2})')
+
+
+class StandinConfig:
+    """
+    Comportamiento del servidor.
+
+    Args:
+        latency (float): Segundos de espera antes de responder a cada petición de datos
+        throttle_rate (float): Probabilidad de responder 429 con Retry-After
+        retry_after (int): Valor de Retry-After en los 429 (segundos)
+        error_rate (float): Probabilidad de responder 503
+        fault_rate (float): Probabilidad de responder HTTP 200 con un XML S:Fault
+        drip_rate (int): Bytes/s al enviar el cuerpo (0 = sin límite)
+        from_year (int): Recorta los periodos generados a partir de este año (respuestas más pequeñas)
+        last_update (str): Anotación UPDATE_DATA de los metadatos
+        fixtures (str): Directorio de respuestas grabadas (se sirven si existen)
+        record (bool): Si falta la respuesta grabada, pedirla a la API real y guardarla
+        seed (int): Semilla de los fallos aleatorios
+    """
+
+    def __init__(self, latency=0.0, throttle_rate=0.0, retry_after=1, error_rate=0.0, fault_rate=0.0,
+                 drip_rate=0, from_year=None, last_update=DEFAULT_LAST_UPDATE, fixtures=None,
+                 record=False, seed=0):
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        self.fault_rate = fault_rate
+        self.drip_rate = drip_rate
+        self.from_year = from_year
+        self.last_update = last_update
+        self.fixtures = Path(fixtures) if fixtures else None
+        self.record = record
+        self.seed = seed
+
+
+def _filter_values(query, dimension, default):
+    """Valores pedidos para una dimensión (c[dim]=A,B,C) o el valor por defecto"""
+    values = query.get(f'c[{dimension}]')
+    if not values:
+        return default
+    return [v.strip() for v in values[0].split(',') if v.strip()]
+
+
+def _requested_periods(query, freq, from_year=None):
+    """
+    Periodos pedidos ('YYYY-MM' o 'YYYY-Qn') según c[TIME_PERIOD]=ge:..+le:.. o startPeriod/endPeriod.
+    Sin límite superior se llega hasta el último periodo del año en curso.
+    """
+    step = 1 if freq == 'M' else 3
+    start = 2002 * 12
+    end = datetime.now().year * 12 + 11
+
+    bounds = ' '.join(query.get('c[TIME_PERIOD]', []) + [
+        f"ge:{v}" for v in query.get('startPeriod', [])] + [f"le:{v}" for v in query.get('endPeriod', [])])
+    for op, year, is_quarter, number in _PERIOD_RE.findall(bounds):
+        number = int(number)
+        month = (number - 1) * 3 if is_quarter else number - 1
+        if op == 'ge':
+            start = int(year) * 12 + month
+        else:
+            end = int(year) * 12 + (month + 2 if is_quarter else month)
+
+    if from_year is not None:
+        start = max(start, from_year * 12)
+
+    start -= start % step
+    periods = []
+    for index in range(start, end + 1, step):
+        year, month = divmod(index, 12)
+        periods.append(f"{year}-{month + 1:02d}" if freq == 'M' else f"{year}-Q{month // 3 + 1}")
+    return periods
+
+
+def _label(dimension, code, label_only):
+    """Código o etiqueta de un valor de dimensión según labels=id / label_only"""
+    if not label_only:
+        return code
+    if dimension in ('reporter', 'partner'):
+        label = COMEXT_REPORTER_LABELS.get(code, code)
+    elif dimension == 'product':
+        label = SITC_LABELS.get(code, code)
+    elif dimension == 'geo':
+        label = BOP_GEO_LABELS.get(code, code)
+    else:
+        label = OTHER_LABELS.get(dimension, {}).get(code, code)
+    return f'"{label}"' if ',' in label else label
+
+
+def synthetic_csv(dataflow, query, config):
+    """
+    Genera el CSV de una consulta de datos. Los valores son deterministas (dependen solo de
+    la serie y el periodo), así que dos consultas solapadas devuelven las mismas cifras.
+    """
+    if dataflow == 'DS-059331':
+        dimensions, dataflow_id, quarterly = COMEXT_DIMENSIONS, 'ESTAT:DS-059331(1.0)', False
+    else:
+        dimensions, dataflow_id, quarterly = BOP_DIMENSIONS, 'ESTAT:BOP_C6_Q(1.0)', True
+
+    label_only = query.get('labels', ['id'])[0] == 'label_only'
+    version_1 = query.get('formatVersion', ['2.0'])[0] == '1.0'
+    freq = 'Q' if quarterly else 'M'
+    periods = _requested_periods(query, freq, config.from_year)
+
+    series = [[]]
+    for dimension, default in dimensions:
+        values = _filter_values(query, dimension, default)
+        series = [prefix + [(dimension, v)] for prefix in series for v in values]
+
+    names = [dimension for dimension, _ in dimensions]
+    if version_1:
+        header = ['DATAFLOW', 'LAST UPDATE', *names, 'TIME_PERIOD', 'OBS_VALUE', 'OBS_FLAG']
+        if quarterly:
+            header.append('CONF_STATUS')
+        last_update = datetime.strptime(config.last_update[:19], '%Y-%m-%dT%H:%M:%S').strftime('%d/%m/%y %H:%M:%S')
+        prefix = f"{dataflow_id},{last_update}"
+        suffix = ',,' if quarterly else ','
+    else:
+        header = ['STRUCTURE', 'STRUCTURE_ID', *names, 'TIME_PERIOD', 'OBS_VALUE']
+        prefix = f"dataflow,{dataflow_id}"
+        suffix = ''
+
+    lines = [','.join(header)]
+    for serie in series:
+        key = '.'.join(code for _, code in serie)
+        cells = ','.join(_label(dimension, code, label_only) for dimension, code in serie)
+        base = zlib.crc32(key.encode()) % 9000 + 1000
+        for i, period in enumerate(periods):
+            # Tendencia suave + estacionalidad, en euros (Comext) o millones (BOP)
+            value = base * (1 + i / 240) * (1 + 0.1 * ((zlib.crc32(f"{key}{period}".encode()) % 21) - 10) / 10)
+            value = f"{value:.2f}" if quarterly else f"{int(value * 1000)}"
+            lines.append(f"{prefix},{cells},{period},{value}{suffix}")
+
+    return '\n'.join(lines) + '\n'
+
+
+def metadata_xml(dataflow, last_update):
+    """Estructura mínima del dataflow con la anotación UPDATE_DATA"""
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<m:Structure xmlns:m="http://www.sdmx.org/resources/sdmxml/schemas/v2_1/message" '
+        'xmlns:s="http://www.sdmx.org/resources/sdmxml/schemas/v2_1/structure" '
+        'xmlns:c="http://www.sdmx.org/resources/sdmxml/schemas/v2_1/common">'
+        f'<m:Structures><s:Dataflows><s:Dataflow id="{dataflow}" agencyID="ESTAT" version="1.0">'
+        '<c:Annotations><c:Annotation>'
+        f'<c:AnnotationTitle>{last_update}</c:AnnotationTitle>'
+        '<c:AnnotationType>UPDATE_DATA</c:AnnotationType>'
+        '</c:Annotation></c:Annotations>'
+        f'<c:Name xml:lang="en">{dataflow}</c:Name>'
+        '</s:Dataflow></s:Dataflows></m:Structures></m:Structure>\n'
+    )
+
+
+FAULT_XML = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<S:Envelope xmlns:S="http://schemas.xmlsoap.org/soap/envelope/"><S:Body><S:Fault>'
+    '<faultcode>S:Server</faultcode><faultstring>Internal error (stand-in)</faultstring>'
+    '</S:Fault></S:Body></S:Envelope>\n'
+)
+
+
+def fixture_path(config, path, query_string):
+    """Archivo de la respuesta grabada para una petición (clave = hash de ruta + consulta ordenada)"""
+    canonical = path + '?' + '&'.join(sorted(query_string.split('&')))
+    return config.fixtures / f"{hashlib.sha1(canonical.encode()).hexdigest()[:20]}.csv"
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    """Atiende las peticiones usando server.config y acumula server.stats"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        path = parts.path
+        query = parse_qs(parts.query, keep_blank_values=True)
+        config = self.server.config
+
+        if path == STATS_PATH:
+            with self.server.stats_lock:
+                body = json.dumps(self.server.stats, indent=2).encode()
+            return self._send(200, body, 'application/json', count=False)
+
+        if path in METADATA_PATHS:
+            return self._metadata(METADATA_PATHS[path])
+
+        if path.startswith(COMEXT_DATA_PREFIX):
+            dataflow = 'DS-059331'
+        elif path.startswith(BOP_DATA_PREFIX):
+            dataflow = 'BOP_C6_Q'
+        else:
+            return self._send(404, b'Unknown stand-in endpoint\n', 'text/plain')
+
+        # Fallos inyectados
+        if config.latency:
+            time.sleep(config.latency)
+        roll = self.server.roll()
+        if roll < config.throttle_rate:
+            self._count('throttled')
+            return self._send(429, b'Too Many Requests\n', 'text/plain',
+                              {'Retry-After': str(config.retry_after)})
+        roll -= config.throttle_rate
+        if roll < config.error_rate:
+            self._count('errors')
+            return self._send(503, b'Service Unavailable\n', 'text/plain')
+        roll -= config.error_rate
+        if roll < config.fault_rate:
+            self._count('faults')
+            return self._send(200, FAULT_XML.encode(), 'application/xml')
+
+        text = self._recorded(path, parts.query)
+        if text is None:
+            text = synthetic_csv(dataflow, query, config)
+
+        body = text.encode('utf-8')
+        self._count('rows', text.count('\n') - 1)
+        if query.get('compress', ['false'])[0] == 'true':
+            body = gzip.compress(body, compresslevel=5)
+        self._send(200, body, 'text/csv', drip=True)
+
+    def _recorded(self, path, query_string):
+        """Respuesta grabada (o grabada ahora desde la API real con --record), o None"""
+        config = self.server.config
+        if config.fixtures is None:
+            return None
+        fixture = fixture_path(config, path, query_string)
+        if fixture.exists():
+            self._count('fixtures')
+            return fixture.read_text(encoding='utf-8')
+        if not config.record:
+            return None
+
+        response = requests.get(f"{DEFAULT_BASE_URL}{path}?{query_string}", headers=DEFAULT_HEADERS, timeout=300)
+        response.raise_for_status()
+        body = response.content
+        if body[:2] == b'\x1f\x8b':
+            body = gzip.decompress(body)
+        fixture.parent.mkdir(parents=True, exist_ok=True)
+        fixture.write_bytes(body)
+        self._count('recorded')
+        return body.decode('utf-8')
+
+    def _metadata(self, dataflow):
+        last_update = self.server.config.last_update
+        etag = f'"{hashlib.sha1(f"{dataflow}{last_update}".encode()).hexdigest()[:16]}"'
+        if self.headers.get('If-None-Match') == etag:
+            return self._send(304, b'', 'application/xml', {'ETag': etag})
+        body = metadata_xml(dataflow, last_update).encode()
+        self._send(200, body, 'application/xml', {'ETag': etag, 'Last-Modified': formatdate(usegmt=True)})
+
+    def _count(self, key, n=1):
+        with self.server.stats_lock:
+            self.server.stats[key] = self.server.stats.get(key, 0) + n
+
+    def _send(self, status, body, content_type, headers=None, drip=False, count=True):
+        if count:
+            with self.server.stats_lock:
+                stats = self.server.stats
+                stats['requests'] = stats.get('requests', 0) + 1
+                stats['bytes'] = stats.get('bytes', 0) + len(body)
+                by_status = stats.setdefault('by_status', {})
+                by_status[str(status)] = by_status.get(str(status), 0) + 1
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+        try:
+            rate = self.server.config.drip_rate
+            if not drip or not rate:
+                self.wfile.write(body)
+                return
+            # Cuerpo gota a gota: bloques de ~1/10 s al ritmo configurado
+            chunk = max(1, rate // 10)
+            for i in range(0, len(body), chunk):
+                self.wfile.write(body[i:i + chunk])
+                self.wfile.flush()
+                time.sleep(chunk / rate)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # El cliente cortó (timeout): es parte de lo que se quiere probar
+
+
+class StandinServer(ThreadingHTTPServer):
+    """ThreadingHTTPServer con la configuración, las estadísticas y el generador de fallos"""
+
+    daemon_threads = True
+
+    def __init__(self, address, config):
+        super().__init__(address, StandinHandler)
+        self.config = config
+        self.stats = {}
+        self.stats_lock = threading.Lock()
+        self._random = random.Random(config.seed)
+        self._random_lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def roll(self):
+        with self._random_lock:
+            return self._random.random()
+
+
+def start_server(config=None, host='127.0.0.1', port=0):
+    """
+    Arranca el servidor en un hilo (port=0 = puerto libre).
+    Retorna el servidor; su URL está en server.base_url y se para con server.shutdown().
+    """
+    server = StandinServer((host, port), config or StandinConfig())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_config_arguments(parser):
+    """Opciones de StandinConfig (compartidas con benchmark_etl.py)"""
+    parser.add_argument('--latency', type=float, default=0.0, help='Segundos de espera por petición de datos')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Probabilidad de 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After de los 429 (segundos)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Probabilidad de 503')
+    parser.add_argument('--fault-rate', type=float, default=0.0, help='Probabilidad de S:Fault con HTTP 200')
+    parser.add_argument('--drip-rate', type=int, default=0, help='Bytes/s al enviar el cuerpo (0 = sin límite)')
+    parser.add_argument('--from-year', type=int, default=None, help='Generar datos solo desde este año')
+    parser.add_argument('--last-update', default=DEFAULT_LAST_UPDATE, help='Anotación UPDATE_DATA de los metadatos')
+    parser.add_argument('--fixtures', default=None, help='Directorio de respuestas grabadas')
+    parser.add_argument('--record', action='store_true', help='Grabar en --fixtures las respuestas que falten (API real)')
+    parser.add_argument('--seed', type=int, default=0, help='Semilla de los fallos aleatorios')
+
+
+def config_from_args(args):
+    """StandinConfig a partir de las opciones de add_config_arguments"""
+    if args.record and not args.fixtures:
+        raise SystemExit('--record necesita --fixtures DIR')
+    return StandinConfig(latency=args.latency, throttle_rate=args.throttle_rate, retry_after=args.retry_after,
+                         error_rate=args.error_rate, fault_rate=args.fault_rate, drip_rate=args.drip_rate,
+                         from_year=args.from_year, last_update=args.last_update, fixtures=args.fixtures,
+                         record=args.record, seed=args.seed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Servidor local que imita la API de Eurostat (SDMX)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = StandinServer((args.host, args.port), config_from_args(args))
+    print(f"🧪 Eurostat stand-in escuchando en {server.base_url}")
+    print(f"   Usar con: EUROSTAT_BASE_URL={server.base_url} python3 update_all_data.py --force")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n📊 {json.dumps(server.stats)}")
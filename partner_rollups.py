@@ -0,0 +1,95 @@
+"""
+Agregados precalculados de socios comerciales
+==============================================
+
+La pestaña "Socios Comerciales" suma en cada interacción las filas por sector de cada
+socio. Los ETL de socios dejan esos agregados calculados una vez por actualización, en
+<directorio de la caché>/rollups/<mismo nombre que el CSV> (+ Parquet, ver data_store):
+- level 'M': total de todos los sectores por socio y mes
+- level 'Q' / 'Y': totales por socio y trimestre / año
+- rank: posición del socio en ese periodo (1 = mayor valor)
+
+Los valores ausentes cuentan como 0, igual que en las sumas del widget.
+"""
+
+import os
+from pathlib import Path
+
+import pandas as pd
+
+from data_store import read_table, write_parquet
+
+ROLLUP_DIRNAME = 'rollups'
+LEVELS = ['M', 'Q', 'Y']
+SOURCE_COLUMNS = ['partner', 'TIME_PERIOD', 'OBS_VALUE']
+ROLLUP_COLUMNS = ['level', 'period', 'partner', 'OBS_VALUE', 'rank']
+
+
+def rollup_path(csv_file):
+    """Ruta del CSV de agregados de una caché de socios"""
+    csv_file = Path(csv_file)
+    return csv_file.parent / ROLLUP_DIRNAME / csv_file.name
+
+
+def build_rollups(df):
+    """
+    Agregados de un reporter/flujo a partir de sus filas (partner, TIME_PERIOD, OBS_VALUE;
+    la columna product, si la hay, se suma).
+    """
+    values = pd.to_numeric(df['OBS_VALUE'], errors='coerce')
+    partner = df['partner'].astype(str).rename('partner')
+    period = df['TIME_PERIOD'].astype(str).rename('period')
+    monthly = values.groupby([partner, period]).sum().rename('OBS_VALUE').reset_index()
+
+    month = pd.to_numeric(monthly['period'].str[5:7], errors='coerce')
+    keys = {
+        'M': monthly['period'],
+        'Q': monthly['period'].str[:4] + '-Q' + ((month - 1) // 3 + 1).astype('Int64').astype(str),
+        'Y': monthly['period'].str[:4],
+    }
+
+    frames = []
+    for level in LEVELS:
+        totals = (monthly['OBS_VALUE'].groupby([monthly['partner'], keys[level].rename('period')])
+                  .sum().rename('OBS_VALUE').reset_index())
+        totals.insert(0, 'level', level)
+        frames.append(totals)
+    rollups = pd.concat(frames, ignore_index=True)
+    rollups['rank'] = (rollups.groupby(['level', 'period'])['OBS_VALUE']
+                       .rank(method='first', ascending=False).astype(int))
+    return rollups[ROLLUP_COLUMNS]
+
+
+def write_rollups(df, csv_file):
+    """Calcula y guarda los agregados de una caché de socios (df = su contenido)"""
+    path = rollup_path(csv_file)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    rollups = build_rollups(df)
+    tmp_file = path.with_suffix('.csv.tmp')
+    rollups.to_csv(tmp_file, index=False)
+    os.replace(tmp_file, path)
+    write_parquet(rollups, path)
+    return path
+
+
+def rollups_are_current(csv_file):
+    """True si los agregados existen y no son más antiguos que el CSV"""
+    path = rollup_path(csv_file)
+    return path.exists() and path.stat().st_mtime >= Path(csv_file).stat().st_mtime
+
+
+def sync_rollups(csv_file):
+    """Genera los agregados de un CSV existente si faltan o están desfasados"""
+    if not Path(csv_file).exists() or rollups_are_current(csv_file):
+        return None
+    return write_rollups(read_table(csv_file, columns=SOURCE_COLUMNS, dtype={'partner': str}), csv_file)
+
+
+def read_rollups(csv_file):
+    """Agregados de una caché de socios, o None si faltan o están desfasados"""
+    if not Path(csv_file).exists() or not rollups_are_current(csv_file):
+        return None
+    rollups = read_table(rollup_path(csv_file), dtype={'level': str, 'period': str, 'partner': str})
+    for column in ['level', 'period', 'partner']:
+        rollups[column] = rollups[column].astype(str)
+    return rollups
@@ -0,0 +1,176 @@
+"""
+Series mensuales de socios para la pestaña "Socios Comerciales"
+================================================================
+
+PartnerSeries recorre una sola vez las tablas de socios de un país (las que devuelve
+load_partners_data) y las suma en un array denso values[flujo, sector, socio, mes]:
+- Flujos: Importaciones, Exportaciones
+- Sectores: TOTAL (totales por socio/mes de partner_rollups) y cada producto
+- Meses: todos los meses entre el primero y el último con datos
+Junto a los valores se cuentan las filas de cada celda, para distinguir un socio sin
+datos de uno con valor 0 (como hace groupby sobre las filas). De ambos se guardan las
+sumas acumuladas por mes (period_sums): el total de un rango son dos lecturas por socio.
+
+summary() responde a una consulta (sector, rango de fechas) con todo lo que muestra la
+pestaña: totales por socio y flujo (KPIs, barras, balance), series por socio (evolución)
+y tablas socio x mes. Todo sale del array, así que el coste depende del tamaño del
+resultado (socios x meses) y no del número de filas. Cada consulta se memoriza.
+"""
+
+import threading
+
+import numpy as np
+import pandas as pd
+
+from period_sums import month_number, month_periods, month_range, prefix_sums, range_total
+
+FLOWS = ['Importaciones', 'Exportaciones']
+FLOW_KEYS = {'Importaciones': 'imports', 'Exportaciones': 'exports'}
+TOTAL_SECTOR = 'TOTAL'
+
+
+def _positions(values, index):
+    """Posición de cada valor de una columna (texto o category) en index; -1 si no está"""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        positions = index.get_indexer(values.cat.categories.astype(str))
+        positions = np.append(positions, -1)  # Código -1 (NaN) -> última posición
+        return positions[values.cat.codes.to_numpy()]
+    return index.get_indexer(values.astype(str))
+
+
+def _month_positions(periods, first_month):
+    """Posición de cada TIME_PERIOD en el eje de meses; -1 si no es un mes"""
+    if isinstance(periods.dtype, pd.CategoricalDtype):
+        numbers = np.append(month_number(periods.cat.categories.astype(str)), -1)
+        numbers = numbers[periods.cat.codes.to_numpy()]
+    else:
+        numbers = month_number(periods.astype(str).to_numpy())
+    return np.where(numbers >= 0, numbers - first_month, -1)
+
+
+def _distinct(values):
+    """Valores distintos (texto) de una columna, sin leer fila a fila si es category"""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return set(values.cat.remove_unused_categories().cat.categories.astype(str))
+    return set(values.dropna().astype(str).unique())
+
+
+class PartnerSeries:
+    """
+    Array denso de una tabla de socios (ver módulo); de solo lectura una vez creado.
+    partners_data: mapping con imports, exports, imports_total y exports_total
+    """
+
+    def __init__(self, partners_data):
+        tables = []  # (flujo, sector TOTAL o None = columna product, tabla)
+        for flow in FLOWS:
+            tables.append((flow, TOTAL_SECTOR, partners_data[f'{FLOW_KEYS[flow]}_total']))
+            tables.append((flow, None, partners_data[FLOW_KEYS[flow]]))
+
+        partners, products, months = set(), set(), set()
+        for _, sector, df in tables:
+            partners |= _distinct(df['partner'])
+            months |= _distinct(df['TIME_PERIOD'])
+            if sector is None:
+                products |= _distinct(df['product']) - {TOTAL_SECTOR}
+        numbers = month_number(sorted(months))
+        numbers = numbers[numbers >= 0]
+        first, last = (numbers.min(), numbers.max()) if len(numbers) else (0, -1)
+
+        self.partners = pd.Index(sorted(partners), name='partner')
+        self.sectors = pd.Index([TOTAL_SECTOR] + sorted(products), name='sector')
+        self.first_month = int(first)
+        self.periods = month_periods(self.first_month, int(last - first + 1))
+
+        shape = (len(FLOWS), len(self.sectors), len(self.partners), len(self.periods))
+        cells = int(np.prod(shape[1:]))
+        self.values = np.zeros(shape, dtype='float64')
+        self.counts = np.zeros(shape, dtype='int32')
+        for flow, sector, df in tables:
+            partner = _positions(df['partner'], self.partners)
+            month = _month_positions(df['TIME_PERIOD'], self.first_month)
+            if sector is None:
+                sector_pos = _positions(df['product'], self.sectors)
+                valid = (partner >= 0) & (month >= 0) & (sector_pos > 0)  # product TOTAL -> ya en totales
+            else:
+                sector_pos = np.zeros(len(df), dtype='int64')
+                valid = (partner >= 0) & (month >= 0)
+            cell = (sector_pos[valid] * len(self.partners) + partner[valid]) * len(self.periods) + month[valid]
+            weights = np.nan_to_num(df['OBS_VALUE'].to_numpy('float64')[valid])
+            f = FLOWS.index(flow)
+            self.values[f] += np.bincount(cell, weights=weights, minlength=cells).reshape(shape[1:])
+            self.counts[f] += np.bincount(cell, minlength=cells).reshape(shape[1:]).astype('int32')
+        self.cumulative = prefix_sums(self.values)
+        self.cumulative_counts = prefix_sums(self.counts)
+
+        self._summaries = {}
+        self._lock = threading.Lock()
+
+    def month_range(self, start, end):
+        """Posiciones [lo, hi) de los meses entre dos fechas"""
+        return month_range(self.first_month, len(self.periods), start, end)
+
+    def summary(self, sector, start, end):
+        """PartnerSummary de un sector (TOTAL o código de producto) entre dos fechas (memorizado)"""
+        lo, hi = self.month_range(start, end)
+        key = (sector, lo, hi)
+        with self._lock:
+            summary = self._summaries.get(key)
+        if summary is None:
+            if sector in self.sectors:
+                s = self.sectors.get_loc(sector)
+                values, counts = self.values[:, s, :, lo:hi], self.counts[:, s, :, lo:hi]
+                totals = range_total(self.cumulative[:, s], lo, hi)
+                present = range_total(self.cumulative_counts[:, s], lo, hi) > 0
+            else:
+                values = np.zeros((len(FLOWS), len(self.partners), 0))
+                counts = np.zeros((len(FLOWS), len(self.partners), 0), dtype='int32')
+                totals = np.zeros((len(FLOWS), len(self.partners)))
+                present = np.zeros((len(FLOWS), len(self.partners)), dtype=bool)
+            summary = PartnerSummary(values, counts, totals, present, self.partners, self.periods[lo:hi])
+            with self._lock:
+                self._summaries[key] = summary
+        return summary
+
+
+class PartnerSummary:
+    """
+    Resultado de una consulta de PartnerSeries (sector y rango de meses).
+    values / counts: [flujo, socio, mes] (vistas del array, sin copia)
+    totals / present: [flujo, socio] total del rango y si hay filas (de las sumas acumuladas)
+    """
+
+    def __init__(self, values, counts, totals, present, partners, periods):
+        self.values = values
+        self.counts = counts
+        self.partners = partners
+        self.periods = pd.Index(periods, name='TIME_PERIOD')
+        self.totals = pd.DataFrame(totals.T, index=partners, columns=FLOWS)
+        self.present = pd.DataFrame(present.T, index=partners, columns=FLOWS)
+        self.empty = not self.present.to_numpy().any()
+
+    def partner_totals(self, flows=FLOWS):
+        """Total del periodo por socio, sumando flujos (solo socios con datos en ellos)"""
+        present = self.present[flows].any(axis=1)
+        return self.totals.loc[present, flows].sum(axis=1).rename('OBS_VALUE')
+
+    def monthly(self, signs):
+        """
+        Tabla socio x TIME_PERIOD con la suma de los flujos por su signo (p.ej.
+        {'Exportaciones': 1, 'Importaciones': -1} = balance). Solo socios y meses con datos.
+        """
+        f = [FLOWS.index(flow) for flow in signs]
+        weights = np.array(list(signs.values()), dtype='float64')
+        values = np.tensordot(weights, self.values[f], axes=1)
+        counts = self.counts[f].sum(axis=0)
+        rows, columns = counts.any(axis=1), counts.any(axis=0)
+        return pd.DataFrame(values[rows][:, columns], index=self.partners[rows], columns=self.periods[columns])
+
+    def partner_months(self, partner, flows=FLOWS):
+        """Serie mensual de un socio (suma de flujos; solo meses con datos), indexada por fecha"""
+        p = self.partners.get_loc(partner)
+        f = [FLOWS.index(flow) for flow in flows]
+        has_data = self.counts[f, p].sum(axis=0) > 0
+        dates = pd.to_datetime(self.periods[has_data], format='%Y-%m')
+        return pd.Series(self.values[f, p].sum(axis=0)[has_data], index=pd.Index(dates, name='fecha'),
+                         name='OBS_VALUE')
@@ -0,0 +1,122 @@
+"""
+Sumas acumuladas por mes (totales de cualquier rango de fechas en O(1))
+=======================================================================
+
+Las tablas del widget son series mensuales (país/sector/flujo, socio/sector/flujo...).
+Para cada serie se guarda, además de los valores de cada mes, su suma acumulada con un
+cero delante:
+
+    cumulative[..., m] = suma de los meses 0 .. m-1
+
+El total de los meses [lo, hi) es cumulative[..., hi] - cumulative[..., lo]: dos lecturas
+por serie, sin recorrer los meses ni las filas. Con las filas de cada celda se hace lo
+mismo (counts) para saber si una serie tiene datos en el rango.
+
+PeriodSums construye estos arrays para una tabla con columnas de clave, fecha y valores
+(pestaña "Balance por País"); partner_series usa las mismas funciones para los socios.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def month_number(periods):
+    """Periodos 'YYYY-MM' (array de texto) -> año * 12 + mes - 1 (-1 si no es un mes)"""
+    months = pd.to_datetime(pd.Index(periods, dtype=str), format='%Y-%m', errors='coerce')
+    numbers = months.year * 12 + months.month - 1
+    return np.where(months.isna(), -1, numbers).astype('int64')
+
+
+def month_periods(first_month, n_months):
+    """'YYYY-MM' de n_months meses consecutivos desde first_month (año * 12 + mes - 1)"""
+    start = pd.Period(year=first_month // 12, month=first_month % 12 + 1, freq='M')
+    return pd.period_range(start, periods=n_months, freq='M').strftime('%Y-%m')
+
+
+def month_range(first_month, n_months, start, end):
+    """Posiciones [lo, hi) de los meses cuyo día 1 cae entre dos fechas (inclusive)"""
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    first = start.year * 12 + start.month - 1 + int(start > pd.Timestamp(start.year, start.month, 1))
+    last = end.year * 12 + end.month - 1
+    lo = min(max(first - first_month, 0), n_months)
+    hi = min(max(last - first_month + 1, lo), n_months)
+    return lo, hi
+
+
+def prefix_sums(values):
+    """Suma acumulada sobre el último eje (meses) con un cero delante"""
+    cumulative = np.zeros(values.shape[:-1] + (values.shape[-1] + 1,), dtype=values.dtype)
+    np.cumsum(values, axis=-1, out=cumulative[..., 1:])
+    return cumulative
+
+
+def range_total(cumulative, lo, hi):
+    """Total de los meses [lo, hi) a partir de las sumas acumuladas"""
+    return cumulative[..., hi] - cumulative[..., lo]
+
+
+class PeriodSums:
+    """
+    Series mensuales de una tabla (una por combinación de claves) con sus sumas acumuladas.
+    df: tabla con las columnas keys, date_column (datetime, día 1 de cada mes) y values
+    """
+
+    def __init__(self, df, keys, values, date_column='fecha'):
+        self.keys = list(keys)
+        self.columns = list(values)
+        dates = pd.DatetimeIndex(df[date_column])
+        months = np.where(dates.isna(), -1, dates.year * 12 + dates.month - 1).astype('int64')
+        valid = months >= 0
+        first, last = (months[valid].min(), months[valid].max()) if valid.any() else (0, -1)
+        self.first_month = int(first)
+        self.periods = month_periods(self.first_month, int(last - first + 1))
+        self.dates = pd.DatetimeIndex(pd.to_datetime(self.periods, format='%Y-%m'), name=date_column)
+
+        # Una serie por combinación de claves (en el orden de groupby)
+        if len(self.keys) == 1:
+            codes, series = pd.factorize(df[self.keys[0]], sort=True)
+            self.series = pd.Index(series, name=self.keys[0])
+        else:
+            codes, self.series = pd.MultiIndex.from_frame(df[self.keys]).factorize(sort=True)
+        valid &= codes >= 0
+        n_series, n_months = len(self.series), len(self.periods)
+        cell = codes[valid] * n_months + months[valid] - self.first_month
+
+        self.counts = np.bincount(cell, minlength=n_series * n_months).reshape(n_series, n_months)
+        self.cumulative_counts = prefix_sums(self.counts)
+        self.values, self.cumulative = {}, {}
+        for column in self.columns:
+            weights = np.nan_to_num(df[column].to_numpy('float64')[valid])
+            self.values[column] = np.bincount(cell, weights=weights,
+                                              minlength=n_series * n_months).reshape(n_series, n_months)
+            self.cumulative[column] = prefix_sums(self.values[column])
+
+    def month_range(self, start, end):
+        """Posiciones [lo, hi) de los meses entre dos fechas"""
+        return month_range(self.first_month, len(self.periods), start, end)
+
+    def totals(self, start, end):
+        """Total de cada serie con datos entre dos fechas (una fila por serie, como groupby)"""
+        lo, hi = self.month_range(start, end)
+        present = range_total(self.cumulative_counts, lo, hi) > 0
+        return pd.DataFrame({column: range_total(self.cumulative[column], lo, hi)[present]
+                             for column in self.columns}, index=self.series[present])
+
+    def has_data(self, start, end, series):
+        """True si alguna de las series (valores de clave) tiene datos entre dos fechas"""
+        lo, hi = self.month_range(start, end)
+        rows = self._rows(series)
+        return bool(range_total(self.cumulative_counts[rows], lo, hi).sum() > 0)
+
+    def monthly(self, start, end, series=None):
+        """Suma mensual de las series pedidas (None = todas) entre dos fechas, solo meses con datos"""
+        lo, hi = self.month_range(start, end)
+        rows = self._rows(series) if series is not None else slice(None)
+        has_data = self.counts[rows, lo:hi].sum(axis=0) > 0
+        return pd.DataFrame({column: self.values[column][rows, lo:hi].sum(axis=0)[has_data]
+                             for column in self.columns}, index=self.dates[lo:hi][has_data])
+
+    def _rows(self, series):
+        """Posiciones de las series pedidas (las que no existen se ignoran)"""
+        positions = self.series.get_indexer(pd.Index(series))
+        return positions[positions >= 0]
@@ -0,0 +1,134 @@
+"""
+Precarga en segundo plano de datos del widget
+==============================================
+
+Prefetcher ejecuta en un hilo de trabajo las cargas que probablemente se pidan a
+continuación (p.ej. socios de servicios mientras se miran los de bienes). La función
+de carga es la misma que usa el widget, cacheada con st.cache_resource: cuando la
+sesión la pide, el resultado ya está en la caché (o se está calculando y espera a ese
+cálculo en lugar de repetirlo).
+
+Presupuesto de memoria: cada carga terminada suma su tamaño (size) mientras siga en la
+caché (cached); cuando la caché la libera (datos nuevos o entrada poco usada), su tamaño
+se descuenta y se puede volver a precargar. No se encola nada si lo precargado que sigue
+en caché más la carga más grande vista hasta ahora superaría el presupuesto.
+
+Las vistas por país se cuentan en data/widget_views.json para precargar al arrancar
+los países más vistos.
+"""
+
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+VIEWS_FILE = Path('data/widget_views.json')
+
+_views_lock = threading.Lock()
+
+
+class Prefetcher:
+    """
+    Cola de precarga con presupuesto de memoria.
+    loader: función de carga (cacheada); se llama como loader(*args)
+    budget_bytes: memoria máxima de lo precargado
+    size: función resultado -> bytes (None = no cuenta)
+    cached: función (*args) -> True mientras el resultado siga en la caché y al día
+            (None = lo precargado cuenta para siempre)
+    """
+
+    def __init__(self, loader, budget_bytes, size=None, cached=None, workers=1):
+        self.loader = loader
+        self.budget_bytes = budget_bytes
+        self.size = size
+        self.cached = cached
+        self.largest_bytes = 0
+        self._requested = set()
+        self._loaded = {}  # args -> bytes de las cargas terminadas
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch')
+
+    @property
+    def used_bytes(self):
+        """Memoria de lo precargado que sigue en la caché"""
+        return sum(self._loaded.values())
+
+    def release(self):
+        """Descuenta las cargas que la caché ya liberó (o cuyos datos cambiaron); se pueden volver a pedir"""
+        if self.cached is None:
+            return
+        with self._lock:
+            loaded = list(self._loaded)
+        stale = [args for args in loaded if not self.cached(*args)]
+        with self._lock:
+            for args in stale:
+                self._loaded.pop(args, None)
+                self._requested.discard(args)
+
+    def fits(self):
+        """True si cabe otra carga en el presupuesto (estimada como la mayor vista); presupuesto 0 = sin precarga"""
+        return self.budget_bytes > 0 and self.used_bytes + self.largest_bytes <= self.budget_bytes
+
+    def submit(self, *args):
+        """Encola loader(*args) si no se ha pedido ya y cabe en el presupuesto. Retorna True si se encola."""
+        self.release()
+        with self._lock:
+            if args in self._requested or not self.fits():
+                return False
+            self._requested.add(args)
+        self._executor.submit(self._load, args)
+        return True
+
+    def _load(self, args):
+        with self._lock:
+            if not self.fits():  # Otras cargas terminaron mientras esta esperaba en la cola
+                self._requested.discard(args)
+                return
+        try:
+            result = self.loader(*args)
+        except Exception as e:
+            print(f"⚠️  Precarga {args}: {e}")
+            return
+        n_bytes = self.size(result) if self.size is not None and result is not None else 0
+        with self._lock:
+            self._loaded[args] = n_bytes
+            self.largest_bytes = max(self.largest_bytes, n_bytes)
+
+    def stats(self):
+        """Cargas pedidas y memoria usada / presupuesto"""
+        self.release()
+        with self._lock:
+            return {'requested': len(self._requested), 'used_bytes': self.used_bytes,
+                    'budget_bytes': self.budget_bytes}
+
+
+def load_views(path=VIEWS_FILE):
+    """{clave: vistas} guardado ({} si no hay archivo)"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def record_view(key, path=VIEWS_FILE):
+    """Suma una vista a key (escritura atómica; los errores de disco no afectan al widget)"""
+    path = Path(path)
+    with _views_lock:
+        views = load_views(path)
+        views[key] = views.get(key, 0) + 1
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = path.with_suffix('.json.tmp')
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(views, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_file, path)
+        except OSError:
+            pass
+
+
+def most_viewed(n, path=VIEWS_FILE):
+    """Las n claves con más vistas"""
+    views = load_views(path)
+    return sorted(views, key=lambda key: (-views[key], key))[:n]
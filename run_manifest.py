@@ -0,0 +1,134 @@
+"""
+Manifiesto de ejecución de los ETL
+===================================
+
+Cada etapa (etl_loader_completo, etl_partners, etl_partners_services) registra el
+estado de cada unidad de trabajo en data/manifest/<etapa>.json:
+- Unidades: dataset agregado, archivo reporter/flujo, país de servicios...
+- Estado ('ok', 'skipped', 'failed', 'empty'), bytes, segundos y error
+
+El archivo se reescribe tras cada unidad, de modo que si el proceso muere a mitad,
+una ejecución con --resume repite solo las unidades fallidas o pendientes.
+Hay un archivo por etapa para que varias etapas puedan ejecutarse a la vez.
+"""
+
+import json
+import threading
+from datetime import datetime
+from pathlib import Path
+
+MANIFEST_DIR = Path('data/manifest')
+
+# Estados que no hay que repetir al reanudar ('empty' = Eurostat no tiene datos para esa unidad)
+DONE_STATUSES = {'ok', 'skipped', 'empty'}
+
+
+def manifest_path(stage, root='.'):
+    """Ruta del manifiesto de una etapa (root permite leer el de un área de staging)"""
+    return Path(root) / MANIFEST_DIR / f'{stage}.json'
+
+
+def load_manifest(stage, root='.'):
+    """Lee el manifiesto de una etapa, o None si no existe"""
+    try:
+        with open(manifest_path(stage, root), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+class RunManifest:
+    """
+    Estado persistente de las unidades de trabajo de una etapa.
+
+    Con resume=True se parte del manifiesto anterior (si existe) y pending() devuelve
+    solo las unidades que no terminaron bien; si no, se empieza un manifiesto nuevo.
+    """
+
+    def __init__(self, stage, resume=False):
+        self.stage = stage
+        self.path = manifest_path(stage)
+        self._lock = threading.Lock()
+
+        previous = load_manifest(stage) if resume else None
+        now = datetime.now().isoformat(timespec='seconds')
+        if previous is not None:
+            self.data = previous
+            self.data['resumed_at'] = now
+            self.data.pop('finished_at', None)
+        else:
+            self.data = {'stage': stage, 'started_at': now, 'units': {}}
+        self.resumed = previous is not None
+        self._save()
+
+    def is_done(self, unit):
+        """True si la unidad terminó bien en esta ejecución o en la que se reanuda"""
+        return self.data['units'].get(unit, {}).get('status') in DONE_STATUSES
+
+    def pending(self, units):
+        """Filtra las unidades que faltan por hacer (todas si no se reanuda)"""
+        return [unit for unit in units if not self.is_done(unit)]
+
+    def get(self, key, default=None):
+        """Valor auxiliar guardado en el manifiesto (p.ej. parámetros de la ejecución)"""
+        return self.data.get(key, default)
+
+    def set(self, key, value):
+        """Guarda un valor auxiliar para poder reanudar con los mismos parámetros"""
+        with self._lock:
+            self.data[key] = value
+            self._save()
+
+    def record(self, unit, status, n_bytes=0, seconds=0.0, error=None, **extra):
+        """Registra el resultado de una unidad y persiste el manifiesto"""
+        entry = {
+            'status': status,
+            'bytes': int(n_bytes),
+            'seconds': round(seconds, 2),
+            'finished_at': datetime.now().isoformat(timespec='seconds'),
+        }
+        if error:
+            entry['error'] = str(error)[:300]
+        entry.update(extra)
+
+        with self._lock:
+            self.data['units'][unit] = entry
+            self._save()
+
+    def summary(self):
+        """Cuenta de unidades por estado, bytes y segundos acumulados"""
+        return summarize(self.data)
+
+    def finish(self):
+        """Marca la etapa como terminada (con o sin fallos)"""
+        with self._lock:
+            self.data['finished_at'] = datetime.now().isoformat(timespec='seconds')
+            self.data['summary'] = summarize(self.data)
+            self._save()
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.path.with_suffix('.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, indent=2, ensure_ascii=False)
+        tmp_file.replace(self.path)
+
+
+def summarize(data):
+    """Resumen de un manifiesto (dict leído con load_manifest o RunManifest.data)"""
+    counts = {}
+    total_bytes = 0
+    total_seconds = 0.0
+    for entry in data.get('units', {}).values():
+        counts[entry['status']] = counts.get(entry['status'], 0) + 1
+        total_bytes += entry.get('bytes', 0)
+        total_seconds += entry.get('seconds', 0.0)
+
+    return {
+        'units': sum(counts.values()),
+        'by_status': counts,
+        'failed': [unit for unit, entry in data.get('units', {}).items()
+                   if entry['status'] not in DONE_STATUSES],
+        'bytes': total_bytes,
+        'seconds': round(total_seconds, 2),
+    }
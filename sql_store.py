@@ -0,0 +1,211 @@
+"""
+Almacén SQLite opcional de las cachés (consultas indexadas)
+============================================================
+
+Con BALANZA_SQLITE=1 los ETL cargan además cada caché en una base SQLite junto a sus
+CSV (<directorio de la caché>/trade.sqlite, una por etapa para que el staging de
+update_all_data siga funcionando). Todas las tablas tienen el mismo esquema:
+
+    reporter, partner, product, flow, period, value
+    PRIMARY KEY (reporter, flow, period, partner, product)   -- tabla WITHOUT ROWID
+    INDEX (reporter, partner, product, flow, period)
+
+- Cachés por archivo (partners_ES_imports.csv): reporter y flow salen del nombre y
+  al actualizar se sustituyen solo las filas de ese reporter/flujo
+- Cachés agregadas: se sustituye la tabla completa
+
+query() devuelve solo el corte pedido, ya agregado por las columnas indicadas, con los
+nombres de columna de los CSV (TIME_PERIOD, OBS_VALUE), de modo que el widget puede usarla
+en lugar de leer la caché y filtrarla. Si la base no existe o es anterior al CSV, el widget
+sigue leyendo los archivos.
+"""
+
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from data_store import GROUP_FILE_PATTERN
+
+SQL_ENABLED = os.environ.get('BALANZA_SQLITE', '0') == '1'
+DB_FILENAME = 'trade.sqlite'
+SQL_TIMEOUT = 60  # Segundos de espera si otro hilo/proceso está escribiendo
+
+KEY_COLUMNS = ['reporter', 'partner', 'product', 'flow', 'period']
+
+# Tabla y columnas de origen de cada caché (por directorio). None = constante o nombre de archivo
+TABLES = {
+    'goods': {'table': 'goods', 'reporter': 'reporter', 'partner': 'partner', 'product': 'product',
+              'flow': 'flow'},
+    'services': {'table': 'services', 'reporter': 'geo', 'partner': 'partner', 'product': 'bop_item',
+                 'flow': 'stk_flow'},
+    'partners': {'table': 'partners_goods', 'reporter': 'reporter', 'partner': 'partner',
+                 'product': 'product', 'flow': None},
+    'partners_services': {'table': 'partners_services', 'reporter': 'reporter', 'partner': 'partner',
+                          'product': None, 'flow': None},
+}
+CONSTANT_PRODUCT = 'TOTAL'  # Socios de servicios: solo total
+
+
+def db_path(csv_file):
+    """Base SQLite de la etapa de una caché"""
+    return Path(csv_file).parent / DB_FILENAME
+
+
+def table_spec(csv_file):
+    """Especificación de TABLES para una caché, o None si no se carga en SQLite"""
+    return TABLES.get(Path(csv_file).parent.name)
+
+
+def connect(csv_file):
+    """Conexión a la base de una caché (WAL: el widget puede leer mientras un ETL escribe)"""
+    conn = sqlite3.connect(db_path(csv_file), timeout=SQL_TIMEOUT)
+    conn.execute('PRAGMA journal_mode=WAL')
+    return conn
+
+
+def _create_table(conn, table):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            reporter TEXT NOT NULL, partner TEXT NOT NULL, product TEXT NOT NULL,
+            flow TEXT NOT NULL, period TEXT NOT NULL, value REAL,
+            PRIMARY KEY (reporter, flow, period, partner, product)
+        ) WITHOUT ROWID""")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_partner ON {table} "
+                 f"(reporter, partner, product, flow, period)")
+    conn.execute("CREATE TABLE IF NOT EXISTS sources (source TEXT PRIMARY KEY, mtime REAL NOT NULL)")
+
+
+def _group(csv_file):
+    """(reporter, flujo) de una caché por archivo, o None si es agregada"""
+    match = GROUP_FILE_PATTERN.search(Path(csv_file).name)
+    return None if match is None else (match['reporter'], match['flow'])
+
+
+def _rows(df, csv_file, spec):
+    """Filas de la caché con el esquema común (texto para las claves, value numérico)"""
+    group = _group(csv_file)
+    n = len(df)
+    rows = pd.DataFrame(index=pd.RangeIndex(n))
+    for column in ['reporter', 'partner', 'product', 'flow']:
+        source = spec[column]
+        if source is not None and source in df.columns:
+            rows[column] = df[source].astype(str).to_numpy()
+        elif column == 'flow' and group is not None:
+            rows[column] = group[1]
+        elif column == 'reporter' and group is not None:
+            rows[column] = group[0]
+        else:
+            rows[column] = CONSTANT_PRODUCT if column == 'product' else ''
+    rows['period'] = df['TIME_PERIOD'].astype(str).to_numpy()
+    values = df['OBS_VALUE']
+    if not pd.api.types.is_numeric_dtype(values):
+        values = pd.to_numeric(values.where(~values.isin(['', ':'])), errors='coerce')
+    rows['value'] = values.astype('float64').to_numpy()
+    # Claves repetidas (p.ej. dimensiones que no están en el esquema común) se suman, como en el widget
+    if rows.duplicated(subset=KEY_COLUMNS).any():
+        rows = rows.groupby(KEY_COLUMNS, sort=False, as_index=False)['value'].sum(min_count=1)
+    return rows  # NaN se guarda como NULL
+
+
+def load_table(df, csv_file):
+    """
+    Carga en SQLite el contenido de una caché (df = tabla ya leída), sustituyendo sus filas
+    anteriores en una sola transacción. Retorna las filas cargadas o None.
+    """
+    spec = table_spec(csv_file)
+    if not SQL_ENABLED or spec is None or 'TIME_PERIOD' not in df.columns:
+        return None
+
+    table = spec['table']
+    group = _group(csv_file)
+    rows = _rows(df, csv_file, spec)
+    started = time.time()
+    try:
+        conn = connect(csv_file)
+        try:
+            with conn:  # Una transacción: los lectores ven la carga anterior o la nueva
+                _create_table(conn, table)
+                if group is None:
+                    conn.execute(f"DELETE FROM {table}")
+                else:
+                    conn.execute(f"DELETE FROM {table} WHERE reporter = ? AND flow = ?", group)
+                conn.executemany(f"INSERT INTO {table} ({', '.join(rows.columns)}) VALUES (?, ?, ?, ?, ?, ?)",
+                                 rows.itertuples(index=False, name=None))
+                conn.execute("INSERT OR REPLACE INTO sources (source, mtime) VALUES (?, ?)",
+                             (Path(csv_file).name, started))
+        finally:
+            conn.close()
+        return len(rows)
+    except sqlite3.Error as e:
+        print(f"   ⚠️  No se pudo cargar {Path(csv_file).name} en SQLite: {e}")
+        return None
+
+
+def sql_is_current(csv_file):
+    """True si la caché está cargada en SQLite y la carga no es anterior al CSV"""
+    path = db_path(csv_file)
+    if table_spec(csv_file) is None or not path.exists():
+        return False
+    try:
+        conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True, timeout=SQL_TIMEOUT)
+        try:
+            row = conn.execute("SELECT mtime FROM sources WHERE source = ?", (Path(csv_file).name,)).fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return False
+    csv_path = Path(csv_file)
+    return row is not None and (not csv_path.exists() or row[0] >= csv_path.stat().st_mtime)
+
+
+def sync_table(csv_file):
+    """Carga en SQLite un CSV existente si no está cargado o la carga es anterior al CSV"""
+    if not SQL_ENABLED or not Path(csv_file).exists() or sql_is_current(csv_file):
+        return None
+    try:
+        df = pd.read_csv(csv_file, dtype=str, keep_default_na=False)
+    except (ValueError, pd.errors.EmptyDataError):
+        return None
+    return load_table(df, csv_file)
+
+
+def query(csv_file, columns, reporters=None, product=None, periods=None):
+    """
+    Corte de una caché agregado por columns (de KEY_COLUMNS), con la suma de value.
+    reporters: lista de reporters (None = todos; en cachés por archivo, el del archivo)
+    product: filtrar un producto/sector
+    periods: (primer, último) 'YYYY-MM' inclusive
+    Retorna un DataFrame con columns (period -> TIME_PERIOD) y OBS_VALUE.
+    Los valores ausentes suman 0, como en pandas.
+    """
+    table = table_spec(csv_file)['table']
+    conditions, params = [], []
+    group = _group(csv_file)
+    if group is not None:
+        conditions.append("reporter = ? AND flow = ?")
+        params.extend(group)
+    elif reporters is not None:
+        conditions.append(f"reporter IN ({', '.join('?' * len(reporters))})")
+        params.extend(reporters)
+    if product is not None:
+        conditions.append("product = ?")
+        params.append(product)
+    if periods is not None:
+        conditions.append("period BETWEEN ? AND ?")
+        params.extend(periods)
+
+    select = ', '.join(columns)
+    sql = f"SELECT {select}, TOTAL(value) AS value FROM {table}"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += f" GROUP BY {select} ORDER BY {select}"
+
+    conn = sqlite3.connect(f'file:{db_path(csv_file)}?mode=ro', uri=True, timeout=SQL_TIMEOUT)
+    try:
+        df = pd.read_sql_query(sql, conn, params=params)
+    finally:
+        conn.close()
+    return df.rename(columns={'period': 'TIME_PERIOD', 'value': 'OBS_VALUE'})
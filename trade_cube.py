@@ -0,0 +1,189 @@
+"""
+Cubo denso de comercio bilateral de bienes (memory-mapped)
+===========================================================
+
+Los 62 CSV de data/partners/ son en realidad una rejilla densa:
+31 reporters × 2 flujos × 40 socios × 10 sectores SITC × ~288 meses (~7M celdas).
+build_cube() la guarda como un array NumPy (float64, NaN = sin dato) en
+data/partners/cube/values.npy, con los ejes en axes.json.
+
+TradeCube lo abre con np.load(mmap_mode='r'): cortar por reporter, flujo, socio,
+sector o rango de meses es una vista del array (sin copiar ni agrupar), solo se leen
+del disco las páginas que se tocan y varios procesos del widget comparten esas páginas.
+
+Orden de los ejes: (reporter, flow, partner, product, period). El periodo va el último
+para que la serie de cada celda, y el bloque de cada reporter/flujo, sean contiguos.
+"""
+
+import json
+import os
+import re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from data_store import read_table
+
+CACHE_DIR = Path('data/partners')
+CUBE_DIR = CACHE_DIR / 'cube'
+VALUES_FILE = 'values.npy'
+AXES_FILE = 'axes.json'
+
+AXES = ['reporter', 'flow', 'partner', 'product', 'period']
+FLOWS = ['imports', 'exports']
+CACHE_FILE_PATTERN = re.compile(r'^partners_(?P<reporter>[A-Z]{2})_(?P<flow>imports|exports)\.csv$')
+CELL_COLUMNS = ['partner', 'product', 'TIME_PERIOD', 'OBS_VALUE']
+
+
+def cache_files(cache_dir=CACHE_DIR):
+    """{(reporter, flujo): ruta} de los CSV de socios de bienes"""
+    files = {}
+    for path in sorted(Path(cache_dir).glob('partners_*.csv')):
+        match = CACHE_FILE_PATTERN.match(path.name)
+        if match:
+            files[(match['reporter'], match['flow'])] = path
+    return files
+
+
+def cube_is_current(cache_dir=CACHE_DIR, cube_dir=None):
+    """True si el cubo existe y no es más antiguo que ninguno de los CSV de socios"""
+    cube_dir = Path(cube_dir) if cube_dir is not None else Path(cache_dir) / CUBE_DIR.name
+    axes_file = cube_dir / AXES_FILE
+    if not axes_file.exists() or not (cube_dir / VALUES_FILE).exists():
+        return False
+    newest = max((path.stat().st_mtime for path in cache_files(cache_dir).values()), default=0)
+    return axes_file.stat().st_mtime >= newest
+
+
+def _cells(path):
+    """Celdas de un CSV de socios (texto para los ejes, OBS_VALUE numérico)"""
+    df = read_table(path, columns=CELL_COLUMNS, dtype=str)
+    df = df.dropna(subset=['partner', 'product', 'TIME_PERIOD'])
+    for column in ['partner', 'product', 'TIME_PERIOD']:
+        df[column] = df[column].astype(str)
+    df['OBS_VALUE'] = pd.to_numeric(df['OBS_VALUE'], errors='coerce')
+    return df
+
+
+def build_cube(cache_dir=CACHE_DIR, cube_dir=None):
+    """
+    Construye el cubo a partir de los CSV (o sus Parquet) de socios de bienes.
+    Se escribe en archivos temporales que sustituyen a los anteriores al terminar:
+    un widget que tenga abierto el cubo anterior sigue leyendo su versión.
+    Retorna el directorio del cubo o None si no hay datos.
+    """
+    cache_dir = Path(cache_dir)
+    cube_dir = Path(cube_dir) if cube_dir is not None else cache_dir / CUBE_DIR.name
+    files = cache_files(cache_dir)
+    if not files:
+        return None
+
+    # Pasada 1: ejes (solo las columnas de clave)
+    partners, products, periods = set(), set(), set()
+    for path in files.values():
+        df = _cells(path)
+        partners.update(df['partner'].unique())
+        products.update(df['product'].unique())
+        periods.update(df['TIME_PERIOD'].unique())
+    axes = {
+        'reporter': sorted({reporter for reporter, _ in files}),
+        'flow': FLOWS,
+        'partner': sorted(partners),
+        'product': sorted(products),
+        'period': sorted(periods),
+    }
+    shape = tuple(len(axes[axis]) for axis in AXES)
+
+    # Pasada 2: rellenar el array en disco, un archivo reporter/flujo cada vez
+    cube_dir.mkdir(parents=True, exist_ok=True)
+    tmp_values = cube_dir / f'{VALUES_FILE}.tmp'
+    tmp_axes = cube_dir / f'{AXES_FILE}.tmp'
+    values = np.lib.format.open_memmap(tmp_values, mode='w+', dtype='float64', shape=shape)
+    values[:] = np.nan
+    reporter_index = {reporter: i for i, reporter in enumerate(axes['reporter'])}
+    for (reporter, flow), path in files.items():
+        df = _cells(path)
+        partner_codes = pd.Categorical(df['partner'], categories=axes['partner']).codes
+        product_codes = pd.Categorical(df['product'], categories=axes['product']).codes
+        period_codes = pd.Categorical(df['TIME_PERIOD'], categories=axes['period']).codes
+        block = values[reporter_index[reporter], FLOWS.index(flow)]
+        block[partner_codes, product_codes, period_codes] = df['OBS_VALUE'].to_numpy()
+    values.flush()
+    del values
+
+    with open(tmp_axes, 'w', encoding='utf-8') as f:
+        json.dump(axes, f, ensure_ascii=False)
+    # Primero los valores y después los ejes: axes.json marca el cubo como completo
+    os.replace(tmp_values, cube_dir / VALUES_FILE)
+    os.replace(tmp_axes, cube_dir / AXES_FILE)
+    return cube_dir
+
+
+class TradeCube:
+    """
+    Cubo de comercio bilateral abierto en modo memory-mapped (solo lectura).
+
+    view() devuelve vistas del array: los argumentos que se pasan fijan ese eje (el
+    resultado pierde la dimensión) y los que no, se conservan completos. Ejemplos:
+        cube.view('ES', 'exports')                    # (partner, product, period)
+        cube.view(flow='exports', partner='CN')       # (reporter, product, period) de todos
+        cube.view('ES', 'imports', periods=('2024-01', '2024-12')).sum(axis=(1, 2))
+    """
+
+    def __init__(self, cube_dir=CUBE_DIR):
+        cube_dir = Path(cube_dir)
+        with open(cube_dir / AXES_FILE, 'r', encoding='utf-8') as f:
+            self.axes = json.load(f)
+        self.values = np.load(cube_dir / VALUES_FILE, mmap_mode='r')
+        if self.values.shape != tuple(len(self.axes[axis]) for axis in AXES):
+            raise ValueError(f"Cubo inconsistente en {cube_dir}: {self.values.shape}")
+        self._index = {axis: {value: i for i, value in enumerate(self.axes[axis])} for axis in AXES}
+
+    def has(self, axis, value):
+        """True si value está en el eje axis"""
+        return value in self._index[axis]
+
+    def period_slice(self, periods=None):
+        """Slice del eje de periodos para (primero, último) 'YYYY-MM' inclusive (None = todos)"""
+        if periods is None:
+            return slice(None)
+        axis = self.axes['period']
+        start = np.searchsorted(axis, periods[0], side='left') if periods[0] else 0
+        end = np.searchsorted(axis, periods[1], side='right') if periods[1] else len(axis)
+        return slice(int(start), int(end))
+
+    def view(self, reporter=None, flow=None, partner=None, product=None, periods=None):
+        """Vista del cubo (sin copiar) fijando los ejes indicados"""
+        key = tuple(slice(None) if value is None else self._index[axis][value]
+                    for axis, value in zip(AXES[:-1], (reporter, flow, partner, product)))
+        return self.values[key + (self.period_slice(periods),)]
+
+    def frame(self, reporter, flow, periods=None):
+        """
+        Celdas con dato de un reporter/flujo en formato largo, con las columnas que usa
+        el widget de los CSV de socios (reporter, partner, product, TIME_PERIOD, OBS_VALUE).
+        """
+        period_slice = self.period_slice(periods)
+        block = self.view(reporter, flow, periods=periods)
+        partner_idx, product_idx, period_idx = np.nonzero(~np.isnan(block))
+        period_axis = np.asarray(self.axes['period'])[period_slice]
+        return pd.DataFrame({
+            'reporter': reporter,
+            'partner': np.asarray(self.axes['partner'])[partner_idx],
+            'product': np.asarray(self.axes['product'])[product_idx],
+            'TIME_PERIOD': period_axis[period_idx],
+            'OBS_VALUE': block[partner_idx, product_idx, period_idx],
+        })
+
+
+def open_cube(cache_dir=CACHE_DIR, cube_dir=None):
+    """TradeCube si el cubo existe y está al día respecto a los CSV, si no None"""
+    cube_dir = Path(cube_dir) if cube_dir is not None else Path(cache_dir) / CUBE_DIR.name
+    if not cube_is_current(cache_dir, cube_dir):
+        return None
+    try:
+        return TradeCube(cube_dir)
+    except (OSError, ValueError) as e:
+        print(f"⚠️  No se pudo abrir el cubo de comercio: {e}")
+        return None
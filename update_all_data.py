@@ -1,38 +1,256 @@
 """
 Script maestro para actualizar todos los datos del widget
-Ejecuta los 3 ETL en secuencia con manejo de errores y logging
+Ejecuta los 3 ETL como un grafo de dependencias con manejo de errores y logging
+
+Los ETL no comparten datos, así que se lanzan a la vez (cada uno en su proceso) y el
+tiempo total se acerca al de la etapa más lenta. La salida de cada etapa se muestra en
+vivo con su prefijo, y el máximo de peticiones simultáneas a Eurostat (--max-requests)
+se reparte entre las etapas.
+
+Cada ETL registra sus unidades de trabajo en data/manifest/<etapa>.json; con --resume
+solo se repiten las unidades fallidas o pendientes. Con --force cada ETL descarga en un
+área de staging (data_staging/<etapa>/) que solo sustituye a data/ si termina bien.
 """
 
+import json
+import os
 import subprocess
 import sys
 import argparse
 import shutil
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
 from datetime import datetime
 
-def run_etl_script(script_name, description):
-    """Ejecuta un script ETL con logging de tiempo"""
-    print(f"\n{'='*80}")
-    print(f"🔄 {description}")
-    print(f"{'='*80}\n")
+from run_manifest import MANIFEST_DIR, load_manifest, manifest_path, summarize
+
+BASE_DIR = Path(__file__).resolve().parent
+STAGING_DIR = Path('data_staging')
+VERSIONS_FILE = Path('data/dataset_versions.json')
+
+# Peticiones simultáneas a Eurostat entre todas las etapas (por defecto)
+MAX_REQUESTS = 10
+
+# Grafo de etapas:
+# - stage: nombre en data/manifest/ y en data_staging/
+# - dirs: directorios de data/ que genera
+# - depends_on: scripts que tienen que terminar bien antes
+# - requests: peticiones simultáneas que necesita (None = el resto del presupuesto)
+ETL_STAGES = {
+    'etl_loader_completo.py': {
+        'stage': 'aggregate',
+        'description': 'Mercancías + Servicios agregados',
+        'dirs': ['data/goods', 'data/services'],
+        'depends_on': [],
+        'requests': 4,  # Una por shard de mercancías a la vez (GOODS_SHARD_WORKERS)
+    },
+    'etl_partners.py': {
+        'stage': 'partners_goods',
+        'description': 'Socios comerciales - BIENES',
+        'dirs': ['data/partners'],
+        'depends_on': [],
+        'requests': None,
+    },
+    'etl_partners_services.py': {
+        'stage': 'partners_services',
+        'description': 'Socios comerciales - SERVICIOS',
+        'dirs': ['data/partners_services'],
+        'depends_on': [],
+        'requests': 1,
+    },
+}
+
+_print_lock = threading.Lock()
+
+def log(message=''):
+    """print() que no mezcla líneas de etapas que se ejecutan a la vez"""
+    with _print_lock:
+        print(message, flush=True)
+
+def split_request_budget(scripts, budget):
+    """
+    Reparte el máximo de peticiones simultáneas entre las etapas.
+    Las etapas con demanda fija reciben la suya; el resto se reparte entre las demás.
+    Cada etapa recibe al menos 1.
+    """
+    fixed = {s: ETL_STAGES[s]['requests'] for s in scripts if ETL_STAGES[s]['requests'] is not None}
+    flexible = [s for s in scripts if ETL_STAGES[s]['requests'] is None]
+
+    shares = {s: max(1, min(n, budget)) for s, n in fixed.items()}
+    remaining = budget - sum(shares.values())
+    for s in flexible:
+        shares[s] = max(1, remaining // len(flexible))
+    return shares
+
+def run_etl_script(script_name, description, extra_args=(), cwd=None, max_requests=None, label=None):
+    """
+    Ejecuta un script ETL mostrando su salida en vivo (cada línea con el prefijo de la etapa).
+    cwd = área de staging, si se usa; max_requests = límite global de peticiones del proceso.
+    """
+    label = label or script_name
+    log(f"\n{'='*80}")
+    log(f"🔄 {description} [{label}]")
+    log(f"{'='*80}")
 
     start_time = datetime.now()
 
-    result = subprocess.run(
-        ['python3', script_name],
-        capture_output=True,
-        text=True
+    env = dict(os.environ, PYTHONUNBUFFERED='1')
+    if max_requests:
+        env['EUROSTAT_MAX_REQUESTS'] = str(max_requests)
+
+    tail = deque(maxlen=20)
+    process = subprocess.Popen(
+        ['python3', str(BASE_DIR / script_name), *extra_args],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        bufsize=1,
+        cwd=cwd,
+        env=env
     )
+    for line in process.stdout:
+        line = line.rstrip()
+        tail.append(line)
+        log(f"[{label}] {line}")
+    returncode = process.wait()
 
     elapsed = (datetime.now() - start_time).total_seconds()
 
-    if result.returncode == 0:
-        print(f"\n✅ {description} completado en {elapsed:.1f}s")
-        return True
+    if returncode == 0:
+        log(f"\n✅ {description} completado en {elapsed:.1f}s")
+        return True, elapsed
     else:
-        print(f"\n❌ {description} falló:")
-        print(result.stderr[-500:] if len(result.stderr) > 500 else result.stderr)
-        return False
+        log(f"\n❌ {description} falló (código {returncode}). Últimas líneas:")
+        log('\n'.join(f"   {line}" for line in list(tail)[-10:]))
+        return False, elapsed
+
+def prepare_staging(script_name, resume=False):
+    """Crea (o reutiliza con --resume) el área de staging de un ETL"""
+    staging_root = STAGING_DIR / ETL_STAGES[script_name]['stage']
+    if staging_root.exists() and not resume:
+        shutil.rmtree(staging_root)
+    staging_root.mkdir(parents=True, exist_ok=True)
+    return staging_root
+
+def swap_in_staging(script_name, staging_root):
+    """
+    Sustituye los directorios de data/ de un ETL por los de su área de staging.
+    El directorio anterior se conserva como <dir>.old hasta que el nuevo está en su sitio.
+    """
+    stage = ETL_STAGES[script_name]['stage']
+
+    for dir_name in ETL_STAGES[script_name]['dirs']:
+        staged, target = staging_root / dir_name, Path(dir_name)
+        if not staged.exists():
+            continue
+        backup = target.with_name(target.name + '.old')
+        if backup.exists():
+            shutil.rmtree(backup)
+        if target.exists():
+            target.rename(backup)
+        shutil.move(str(staged), str(target))
+        if backup.exists():
+            shutil.rmtree(backup)
+        log(f"   ✓ {dir_name}/ actualizado desde staging")
+
+    # Versiones de Eurostat descargadas por la etapa
+    staged_versions = staging_root / VERSIONS_FILE
+    if staged_versions.exists():
+        try:
+            versions = json.loads(VERSIONS_FILE.read_text(encoding='utf-8'))
+        except (FileNotFoundError, json.JSONDecodeError):
+            versions = {}
+        versions.update(json.loads(staged_versions.read_text(encoding='utf-8')))
+        VERSIONS_FILE.parent.mkdir(parents=True, exist_ok=True)
+        VERSIONS_FILE.write_text(json.dumps(versions, indent=2, ensure_ascii=False), encoding='utf-8')
+
+    # Manifiesto de la etapa
+    staged_manifest = manifest_path(stage, staging_root)
+    if staged_manifest.exists():
+        MANIFEST_DIR.mkdir(parents=True, exist_ok=True)
+        shutil.move(str(staged_manifest), str(manifest_path(stage)))
+
+    shutil.rmtree(staging_root)
+
+def print_manifest_summary(scripts, staged_roots):
+    """Resumen de unidades por etapa a partir de los manifiestos"""
+    print(f"\n📋 Unidades de trabajo (data/manifest/):")
+    for script in scripts:
+        stage = ETL_STAGES[script]['stage']
+        data = load_manifest(stage, staged_roots.get(script, '.'))
+        if data is None:
+            print(f"   - {stage}: sin manifiesto")
+            continue
+        summary = summarize(data)
+        counts = ', '.join(f"{status}={n}" for status, n in sorted(summary['by_status'].items()))
+        print(f"   - {stage}: {summary['units']} unidades ({counts}), "
+              f"{summary['bytes'] / 1024 / 1024:.1f} MB, {summary['seconds']:.0f}s")
+        if summary['failed']:
+            shown = ', '.join(summary['failed'][:10])
+            more = f" (+{len(summary['failed']) - 10})" if len(summary['failed']) > 10 else ''
+            print(f"     ❌ Fallidas: {shown}{more}")
+
+def run_stage_graph(scripts, extra_args, force=False, resume=False, max_requests=MAX_REQUESTS, parallel=True):
+    """
+    Ejecuta las etapas respetando depends_on: en cada momento se lanzan todas las que
+    tienen sus dependencias completadas (una a una si parallel=False). Una etapa cuya
+    dependencia falla no se ejecuta.
+
+    Returns:
+        tuple: (results, elapsed, staged_roots) - results[script] = True/False/None (no ejecutada)
+    """
+    pending = list(scripts)
+    results, elapsed, staged_roots = {}, {}, {}
+    running = {}
+
+    # Con ejecución secuencial cada etapa puede usar todo el presupuesto
+    shares = split_request_budget(scripts, max_requests) if parallel else dict.fromkeys(scripts, max_requests)
+
+    with ThreadPoolExecutor(max_workers=len(scripts) if parallel else 1) as executor:
+        while pending or running:
+            # Etapas cuya dependencia ha fallado (o no se ejecutó)
+            for script in list(pending):
+                deps = [d for d in ETL_STAGES[script]['depends_on'] if d in scripts]
+                if any(d in results and results[d] is not True for d in deps):
+                    log(f"\n⏭️  {script} no se ejecuta: falló una dependencia ({', '.join(deps)})")
+                    results[script] = None
+                    pending.remove(script)
+
+            ready = [s for s in pending
+                     if all(results.get(d) is True for d in ETL_STAGES[s]['depends_on'] if d in scripts)]
+            if not parallel:
+                ready = ready[:1] if not running else []
+
+            for script in ready:
+                pending.remove(script)
+                stage = ETL_STAGES[script]
+                staging_root = prepare_staging(script, resume) if force else None
+                args = list(extra_args)
+                if script == 'etl_partners.py':
+                    args += ['--workers', str(shares[script])]
+                future = executor.submit(run_etl_script, script, stage['description'], args,
+                                         staging_root, shares[script], stage['stage'])
+                running[future] = (script, staging_root)
+
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                script, staging_root = running.pop(future)
+                ok, elapsed[script] = future.result()
+                results[script] = ok
+                if staging_root is None:
+                    continue
+                if ok:
+                    swap_in_staging(script, staging_root)
+                else:
+                    staged_roots[script] = staging_root
+                    log(f"   ℹ️  Caché actual intacta; staging conservado en {staging_root}/")
+
+    return results, elapsed, staged_roots
 
 def main():
     parser = argparse.ArgumentParser(
@@ -40,54 +258,69 @@ def main():
         formatter_class=argparse.RawDescriptionHelpFormatter,
         epilog="""
 Ejemplos:
-  python3 update_all_data.py                    # Actualizar solo si cache expirado
+  python3 update_all_data.py                    # Actualizar solo si Eurostat publicó datos nuevos
   python3 update_all_data.py --force            # Forzar actualización completa
   python3 update_all_data.py --skip-partners    # Solo agregados (más rápido)
+  python3 update_all_data.py --incremental      # Solo periodos recientes (delta)
+  python3 update_all_data.py --resume           # Repetir solo las unidades fallidas
+  python3 update_all_data.py --force --resume   # Continuar una actualización forzada interrumpida
+  python3 update_all_data.py --sequential       # Una etapa detrás de otra
         """
     )
     parser.add_argument('--force', action='store_true',
-                       help='Forzar actualización eliminando cache')
+                       help='Forzar actualización completa (se descarga en staging y se sustituye al terminar)')
     parser.add_argument('--skip-partners', action='store_true',
                        help='Saltar actualización de socios (más rápido)')
+    parser.add_argument('--incremental', action='store_true',
+                       help='Descargar solo la ventana de revisión reciente y fusionarla con la cache')
+    parser.add_argument('--resume', action='store_true',
+                       help='Repetir solo las unidades fallidas o pendientes de la última ejecución')
+    parser.add_argument('--max-requests', type=int, default=MAX_REQUESTS,
+                       help=f'Peticiones simultáneas a Eurostat entre todas las etapas (default: {MAX_REQUESTS})')
+    parser.add_argument('--sequential', action='store_true',
+                       help='Ejecutar las etapas una detrás de otra en lugar de en paralelo')
     args = parser.parse_args()
 
+    if args.force and args.incremental:
+        parser.error('--force y --incremental son incompatibles')
+    if args.max_requests < 1:
+        parser.error('--max-requests debe ser >= 1')
+
     print("=" * 80)
     print("ACTUALIZACIÓN MAESTRA - WIDGET BALANZA COMERCIAL")
     print("=" * 80)
 
-    # Forzar actualización
+    # Forzar actualización: la caché actual se mantiene hasta que cada ETL termine bien
     if args.force:
-        print("\n🗑️  FORZANDO ACTUALIZACIÓN: Eliminando cache...")
-        dirs_to_clean = ['data/goods', 'data/services', 'data/partners', 'data/partners_services']
-        for dir_name in dirs_to_clean:
-            dir_path = Path(dir_name)
-            if dir_path.exists():
-                shutil.rmtree(dir_path)
-                print(f"   ✓ {dir_name}/ eliminado")
-        print()
+        print(f"\n📦 FORZANDO ACTUALIZACIÓN: descarga en {STAGING_DIR}/ "
+              f"({'reanudando' if args.resume else 'desde cero'})")
 
     # Definir ETLs a ejecutar
-    etl_scripts = [
-        ('etl_loader_completo.py', 'Mercancías + Servicios agregados'),
-    ]
+    etl_scripts = ['etl_loader_completo.py']
 
     if not args.skip_partners:
-        etl_scripts.extend([
-            ('etl_partners.py', 'Socios comerciales - BIENES'),
-            ('etl_partners_services.py', 'Socios comerciales - SERVICIOS'),
-        ])
+        etl_scripts.extend(['etl_partners.py', 'etl_partners_services.py'])
+
+    print(f"\n🚦 {'Secuencial' if args.sequential else 'En paralelo'}: {len(etl_scripts)} etapas, "
+          f"máx. {args.max_requests} peticiones simultáneas a Eurostat")
 
     start_total = datetime.now()
-    success_count = 0
-    failed_scripts = []
+
+    # Cada ETL consulta la versión publicada en Eurostat y se salta si no hay cambios;
+    # --force lo desactiva para que se descargue todo
+    extra_args = ['--incremental'] if args.incremental else []
+    if args.force:
+        extra_args.append('--force')
+    if args.resume:
+        extra_args.append('--resume')
 
     # Ejecutar ETLs
-    for script, description in etl_scripts:
-        if run_etl_script(script, description):
-            success_count += 1
-        else:
-            failed_scripts.append(script)
-            print(f"\n⚠️ Continuando con siguiente ETL...")
+    results, elapsed, staged_roots = run_stage_graph(
+        etl_scripts, extra_args, force=args.force, resume=args.resume,
+        max_requests=args.max_requests, parallel=not args.sequential)
+
+    success_count = sum(1 for ok in results.values() if ok)
+    failed_scripts = [script for script in etl_scripts if not results.get(script)]
 
     # Resumen
     elapsed_total = (datetime.now() - start_total).total_seconds()
@@ -96,19 +329,24 @@ Ejemplos:
     print(f"📊 RESUMEN DE ACTUALIZACIÓN")
     print(f"{'='*80}")
     print(f"✓ Scripts exitosos: {success_count}/{len(etl_scripts)}")
-    print(f"⏱️  Tiempo total: {elapsed_total/60:.1f} minutos")
+    for script in etl_scripts:
+        if script in elapsed:
+            print(f"   - {script}: {elapsed[script]/60:.1f} min")
+    print(f"⏱️  Tiempo total: {elapsed_total/60:.1f} minutos "
+          f"(suma de etapas: {sum(elapsed.values())/60:.1f} min)")
+    print_manifest_summary(etl_scripts, staged_roots)
 
     if failed_scripts:
         print(f"\n❌ Scripts fallidos:")
         for script in failed_scripts:
-            print(f"   - {script}")
+            print(f"   - {script}{' (no ejecutado)' if results.get(script) is None else ''}")
 
     if success_count == len(etl_scripts):
         print("\n✅ ACTUALIZACIÓN COMPLETA - Todos los datos actualizados")
         sys.exit(0)
     elif success_count > 0:
         print(f"\n⚠️ ACTUALIZACIÓN PARCIAL - {success_count}/{len(etl_scripts)} completados")
-        print("💡 Ejecuta scripts fallidos manualmente para completar")
+        print(f"💡 Repite solo las unidades fallidas con: python3 update_all_data.py {'--force ' if args.force else ''}--resume")
         sys.exit(1)
     else:
         print("\n❌ ACTUALIZACIÓN FALLIDA - Ningún script completado")
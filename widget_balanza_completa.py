@@ -5,6 +5,8 @@ import logging
 # Suprimir TODOS los warnings de deprecación
 warnings.filterwarnings('ignore')
 logging.getLogger('plotly').setLevel(logging.ERROR)
+# Los hilos de precarga (prefetch.py) llaman a funciones cacheadas sin ScriptRunContext
+logging.getLogger('streamlit.runtime.scriptrunner_utils.script_run_context').setLevel(logging.ERROR)
 
 # Redirigir stderr temporalmente para capturar warnings de Plotly
 import io
@@ -14,11 +16,27 @@ import streamlit as st
 import pandas as pd
 import plotly.graph_objects as go
 import os
+import threading
+from collections import OrderedDict
 from datetime import datetime
+from pathlib import Path
+from types import MappingProxyType
 
 # Restaurar stderr
 sys.stderr = sys.__stderr__
 
+# Lectura de cachés: Parquet si existe y está al día, si no CSV
+from codelists import CODELIST_FILE, display_names, load_codelists, translate, values_for
+from data_store import (compact_frame, frame_memory, month_dates, period_bounds, read_partitions, read_table, table_exists,
+                        table_mtime, table_reporters)
+from data_versions import data_version, file_signature
+from partner_rollups import build_rollups, read_rollups
+from partner_series import FLOWS, PartnerSeries
+from period_sums import PeriodSums
+from prefetch import Prefetcher, most_viewed, record_view
+from sql_store import query, sql_is_current
+from trade_cube import AXES_FILE, CUBE_DIR, cube_is_current, open_cube
+
 # Importar desde etl_loader_completo
 try:
     from etl_loader_completo import update_data_if_needed, CSV_CACHE_FILE_GOODS, CSV_CACHE_FILE_SERVICES
@@ -145,76 +163,203 @@ def format_currency(value):
     else:
         return f"€{value:,.0f}"
 
-@st.cache_data(ttl=3600)
-def load_goods_data():
-    """Carga datos de mercancías (bienes)"""
-    if not os.path.exists(CSV_CACHE_FILE_GOODS):
+def year_periods(years):
+    """(primer año, último año) -> ('YYYY-01', 'YYYY-12'), o None"""
+    return None if years is None else (f"{years[0]}-01", f"{years[1]}-12")
+
+
+# Dimensiones con códigos en las cachés agregadas (nombres en codelists)
+CODED_DIMENSIONS = ['reporter', 'product', 'flow', 'geo', 'bop_item', 'stk_flow']
+
+# Columnas que usan los loaders (en Parquet solo se leen estas)
+GOODS_COLUMNS = ['reporter', 'product', 'flow', 'TIME_PERIOD', 'OBS_VALUE']
+SERVICES_COLUMNS = ['geo', 'bop_item', 'stk_flow', 'TIME_PERIOD', 'OBS_VALUE']
+PARTNER_COLUMNS = {
+    'goods': ['partner', 'product', 'TIME_PERIOD', 'OBS_VALUE'],
+    'services': ['partner', 'TIME_PERIOD', 'OBS_VALUE'],
+}
+
+# Cachés de socios por tipo de datos: (directorio, prefijo de los archivos)
+PARTNER_CACHES = {
+    'goods': (Path('data/partners'), 'partners'),
+    'services': (Path('data/partners_services'), 'services_partners'),
+}
+
+# Representación compacta de las tablas cacheadas (data_store.compact_frame)
+BALANCE_KEYS = ['pais', 'sector', 'tipo']
+BALANCE_VALUES = ['exportaciones', 'importaciones', 'balance']
+PARTNER_KEYS = ['partner', 'product', 'flow_type', 'tipo']
+ROLLUP_KEYS = ['level', 'period', 'partner']
+
+
+def compact_balance(df):
+    """Tabla de balanza (pestaña 1) con claves category y valores float32 si es exacto"""
+    return compact_frame(df, keys=BALANCE_KEYS, values=BALANCE_VALUES)
+
+
+def compact_partners(df):
+    """Tabla de socios con claves category y TIME_PERIOD como índice de mes"""
+    return compact_frame(df, keys=PARTNER_KEYS, period='TIME_PERIOD', values=['OBS_VALUE'])
+
+
+def partner_files(country_code, data_type):
+    """CSV de importaciones y exportaciones de socios de un país"""
+    cache_dir, prefix = PARTNER_CACHES[data_type]
+    return (cache_dir / f'{prefix}_{country_code}_imports.csv',
+            cache_dir / f'{prefix}_{country_code}_exports.csv')
+
+
+# Las cachés no caducan por tiempo: cada loader recibe como último argumento la versión
+# de los datos que lee (data_versions) y solo se vuelve a ejecutar cuando cambia. Una
+# actualización de los ETL invalida así solo los países y datasets cuyos datos cambiaron.
+
+@st.cache_resource
+def loaded_versions():
+    """
+    {loader: {argumentos: versión en caché}} (de la entrada menos usada a la más usada),
+    compartido por todas las sesiones, con su bloqueo
+    """
+    return {}, threading.Lock()
+
+
+def load_versioned(loader, version, *args, max_entries=None):
+    """
+    loader(*args, version) cacheado; si la versión cambió, libera la entrada anterior.
+    max_entries: entradas que se conservan del loader; se liberan las menos usadas
+    """
+    versions, lock = loaded_versions()
+    with lock:
+        entries = versions.setdefault(loader.__name__, OrderedDict())
+        previous = entries.pop(args, None)
+        entries[args] = version
+        evicted = []
+        while max_entries is not None and len(entries) > max_entries:
+            evicted.append(entries.popitem(last=False))
+    if previous is not None and previous != version:
+        loader.clear(*args, previous)
+    for evicted_args, evicted_version in evicted:
+        loader.clear(*evicted_args, evicted_version)
+    return loader(*args, version)
+
+
+def cached_version(loader, *args):
+    """Versión de loader(*args) en caché (None si no se ha cargado o ya se liberó)"""
+    versions, lock = loaded_versions()
+    with lock:
+        return versions.get(loader.__name__, {}).get(args)
+
+
+def codelists_version():
+    """Versión de la tabla de nombres (codelists): fecha y tamaño, None si no existe"""
+    signature = file_signature(CODELIST_FILE)
+    return None if signature is None else tuple(signature)
+
+
+def goods_version(pais=None):
+    """Versión de la caché de mercancías (de un país, o de todos) y de sus nombres"""
+    reporters = None if pais is None else reporter_values(pais)
+    return data_version(CSV_CACHE_FILE_GOODS, reporters), codelists_version()
+
+
+def services_version():
+    """Versión de la caché de servicios y de sus nombres"""
+    return data_version(CSV_CACHE_FILE_SERVICES), codelists_version()
+
+
+def partners_version(country_code, data_type):
+    """Versión de los CSV de socios (importaciones, exportaciones) de un país"""
+    return tuple(data_version(csv_file) for csv_file in partner_files(country_code, data_type))
+
+
+@st.cache_data
+def _load_display_names(version):
+    codelists = load_codelists()
+    return {dimension: display_names(codelists, dimension) for dimension in CODED_DIMENSIONS}
+
+
+def load_display_names():
+    """
+    {dimensión: {valor: nombre}} para traducir los códigos de las cachés agregadas
+    (tabla de codelists; incluye las etiquetas de cachés antiguas)
+    """
+    return load_versioned(_load_display_names, codelists_version())
+
+
+def reporter_values(pais):
+    """Valores de reporter de un país en la caché de mercancías (código y etiquetas antiguas)"""
+    return values_for(load_display_names()['reporter'], pais)
+
+
+@st.cache_data
+def _load_goods_countries(version):
+    if not table_exists(CSV_CACHE_FILE_GOODS):
         st.error("⚠️ Ejecuta primero 'python etl_loader_completo.py' para generar los datos.")
         st.stop()
 
-    df_raw = pd.read_csv(CSV_CACHE_FILE_GOODS)
-
-    # Mapeo de países
-    PAISES_NOMBRES = {
-        'Austria': 'Austria',
-        'Belgium (incl. Luxembourg \'LU\' -> 1998)': 'Bélgica',
-        'Bulgaria': 'Bulgaria',
-        'Croatia': 'Croacia',
-        'Cyprus': 'Chipre',
-        'Czechia': 'República Checa',
-        'Denmark': 'Dinamarca',
-        'Estonia': 'Estonia',
-        'Finland': 'Finlandia',
-        'France (incl. Saint Barthélemy \'BL\' -> 2012; incl. French Guiana \'GF\', Guadeloupe \'GP\', Martinique \'MQ\', Réunion \'RE\' from 1997; incl. Mayotte \'YT\' from 2014)': 'Francia',
-        'Germany (incl. German Democratic Republic \'DD\' from 1991)': 'Alemania',
-        'Greece': 'Grecia',
-        'Hungary': 'Hungría',
-        'Ireland (Eire)': 'Irlanda',
-        'Italy (incl. San Marino \'SM\' -> 1993)': 'Italia',
-        'Latvia': 'Letonia',
-        'Lithuania': 'Lituania',
-        'Luxembourg': 'Luxemburgo',
-        'Malta': 'Malta',
-        'Netherlands': 'Países Bajos',
-        'Poland': 'Polonia',
-        'Portugal': 'Portugal',
-        'Romania': 'Rumanía',
-        'Slovakia': 'Eslovaquia',
-        'Slovenia': 'Eslovenia',
-        'Spain (incl. Canary Islands \'XB\' from 1997)': 'España',
-        'Sweden': 'Suecia',
-        'United Kingdom': 'Reino Unido',
-        'Norway (incl. Svalbard and Jan Mayen \'SJ\' -> 1994 and again from 1997)': 'Noruega',
-        'Switzerland (incl. Liechtenstein \'LI\' -> 1994)': 'Suiza',
-        'European Union - 27 countries (AT, BE, BG, CY, CZ, DE, DK, EE, EL, ES, FI, FR, HR, HU, IE, IT, LT, LU, LV, MT, NL, PL, PT, RO, SE, SI, SK)': 'Unión Europea (27)',
-    }
-
-    # Mapeo de sectores
-    SECTORES_NOMBRES = {
-        'Food and live animals': 'Alimentos y animales vivos',
-        'Beverages and tobacco': 'Bebidas y tabaco',
-        'Crude materials, inedible, except fuels': 'Materiales crudos',
-        'Mineral fuels, lubricants and related materials': 'Combustibles minerales',
-        'Animal and vegetable oils, fats and waxes': 'Aceites y grasas',
-        'Chemicals and related products, n.e.s.': 'Productos químicos',
-        'Manufactured goods classified chiefly by material': 'Manufacturas por material',
-        'Machinery and transport equipment': 'Maquinaria y transporte',
-        'Miscellaneous manufactured articles': 'Manufacturas diversas',
-        'Commodities and transactions not classified elsewhere': 'Otros',
-        'Total all products': 'Total Comercio'
-    }
-
-    df_raw['pais'] = df_raw['reporter'].map(PAISES_NOMBRES)
-    df_raw['sector'] = df_raw['product'].map(SECTORES_NOMBRES)
+    names = load_display_names()['reporter']
+    reporters = table_reporters(CSV_CACHE_FILE_GOODS)
+    return sorted({names[r] for r in reporters if r in names})
+
+
+def load_goods_countries():
+    """Países con datos de mercancías (sin cargar la caché completa)"""
+    return load_versioned(_load_goods_countries, goods_version())
+
+
+@st.cache_data
+def _load_goods_period(pais, version):
+    reporters = None if pais is None else reporter_values(pais)
+    bounds = period_bounds(CSV_CACHE_FILE_GOODS, reporters)
+    if bounds is None:
+        return None
+    return tuple(pd.to_datetime(b, format='%Y-%m') for b in bounds)
+
+
+def load_goods_period(pais=None):
+    """Primer y último mes con datos de mercancías de un país (None = todos los países)"""
+    return load_versioned(_load_goods_period, goods_version(pais), pais)
+
+
+# Las tablas grandes se cachean con st.cache_resource: una sola copia por proceso que
+# comparten todas las sesiones (st.cache_data entrega a cada llamada una copia
+# deserializada). Son de solo lectura: se filtran o se derivan, nunca se modifican.
+# Cada combinación (país, periodo...) es una entrada: se guardan como máximo
+# TABLE_CACHE_ENTRIES por loader y load_versioned libera las menos usadas (la precarga
+# llena hasta 2 x (PREFETCH_TOP_COUNTRIES + 1) entradas de socios).
+TABLE_CACHE_ENTRIES = int(os.environ.get('BALANZA_CACHE_ENTRIES', '12'))
+
+def load_goods_data(pais, years=None):
+    """
+    Carga datos de mercancías (bienes) de un país (compartido, solo lectura).
+    years: (primer año, último año); solo se leen esas particiones
+    """
+    return load_versioned(_load_goods_data, goods_version(pais), pais, years,
+                          max_entries=TABLE_CACHE_ENTRIES)
+
+
+@st.cache_resource(max_entries=TABLE_CACHE_ENTRIES)
+def _load_goods_data(pais, years, version):
+    if sql_is_current(CSV_CACHE_FILE_GOODS):
+        # Consulta indexada en SQLite (sql_store): solo el país y los meses pedidos
+        df_raw = query(CSV_CACHE_FILE_GOODS, ['reporter', 'product', 'flow', 'period'],
+                       reporters=reporter_values(pais), periods=year_periods(years))
+    else:
+        df_raw = read_partitions(CSV_CACHE_FILE_GOODS, reporters=reporter_values(pais), years=years,
+                                 columns=GOODS_COLUMNS)
+
+    # Códigos -> nombres (codelists): se traduce cada valor distinto una vez
+    names = load_display_names()
+    df_raw['pais'] = translate(df_raw['reporter'], names['reporter'])
+    df_raw['sector'] = translate(df_raw['product'], names['product'])
+    df_raw['flujo'] = translate(df_raw['flow'], names['flow'])
     df_raw = df_raw.dropna(subset=['pais', 'sector'])
 
     df_raw = df_raw.rename(columns={
         'TIME_PERIOD': 'fecha',
-        'OBS_VALUE': 'valor',
-        'flow': 'flujo'
+        'OBS_VALUE': 'valor'
     })
 
-    df_raw['fecha'] = pd.to_datetime(df_raw['fecha'])
+    df_raw['fecha'] = month_dates(df_raw['fecha'])
     df_raw['valor'] = pd.to_numeric(df_raw['valor'].replace(':', '0'), errors='coerce').fillna(0)
 
     df_pivot = df_raw.pivot_table(
@@ -242,52 +387,26 @@ def load_goods_data():
     df_pivot['balance'] = df_pivot['exportaciones'] - df_pivot['importaciones']
     df_pivot['tipo'] = 'Bienes'
 
-    return df_pivot
+    return compact_balance(df_pivot)
 
 
-@st.cache_data(ttl=3600)
 def load_services_data():
-    """Carga datos de servicios (incluye turismo)"""
-    if not os.path.exists(CSV_CACHE_FILE_SERVICES):
+    """Carga datos de servicios (incluye turismo; compartido, solo lectura)"""
+    return load_versioned(_load_services_data, services_version())
+
+
+@st.cache_resource
+def _load_services_data(version):
+    if not table_exists(CSV_CACHE_FILE_SERVICES):
         return pd.DataFrame()  # Retornar vacío si no existe
 
     try:
-        df_raw = pd.read_csv(CSV_CACHE_FILE_SERVICES)
-
-        # Mapeo de códigos de países BOP a español
-        PAISES_BOP = {
-            'Austria': 'Austria',
-            'Belgium': 'Bélgica',
-            'Bulgaria': 'Bulgaria',
-            'Croatia': 'Croacia',
-            'Cyprus': 'Chipre',
-            'Czechia': 'República Checa',
-            'Denmark': 'Dinamarca',
-            'Estonia': 'Estonia',
-            'Finland': 'Finlandia',
-            'France': 'Francia',
-            'Germany': 'Alemania',
-            'Greece': 'Grecia',
-            'Hungary': 'Hungría',
-            'Ireland': 'Irlanda',
-            'Italy': 'Italia',
-            'Latvia': 'Letonia',
-            'Lithuania': 'Lituania',
-            'Luxembourg': 'Luxemburgo',
-            'Malta': 'Malta',
-            'Netherlands': 'Países Bajos',
-            'Poland': 'Polonia',
-            'Portugal': 'Portugal',
-            'Romania': 'Rumanía',
-            'Slovakia': 'Eslovaquia',
-            'Slovenia': 'Eslovenia',
-            'Spain': 'España',
-            'Sweden': 'Suecia',
-            'United Kingdom': 'Reino Unido',
-        }
-
-        # Filtrar y mapear países
-        df_raw['pais'] = df_raw['geo'].map(PAISES_BOP)
+        df_raw = read_table(CSV_CACHE_FILE_SERVICES, columns=SERVICES_COLUMNS)
+
+        # Filtrar y traducir países y flujos (codelists)
+        names = load_display_names()
+        df_raw['pais'] = translate(df_raw['geo'], names['geo'])
+        df_raw['stk_flow'] = translate(df_raw['stk_flow'], names['stk_flow'])
         df_raw = df_raw.dropna(subset=['pais'])
 
         # Renombrar columnas
@@ -297,7 +416,7 @@ def load_services_data():
         })
 
         # Convertir fecha a datetime (formato YYYY-MM después de interpolación)
-        df_raw['fecha'] = pd.to_datetime(df_raw['fecha'], format='%Y-%m', errors='coerce')
+        df_raw['fecha'] = month_dates(df_raw['fecha'])
 
         # Convertir valor a numérico
         # IMPORTANTE: Los datos BOP vienen en MILLONES de EUR
@@ -317,10 +436,10 @@ def load_services_data():
         if df_raw.empty:
             return pd.DataFrame()
 
-        # Los datos BOP vienen con stk_flow = CRE (créditos/exportaciones) y DEB (débitos/importaciones)
-        # Ya no estimamos, sino que usamos los valores reales
+        # Los datos BOP vienen con stk_flow = CRE (créditos/exportaciones) y DEB (débitos/importaciones),
+        # ya traducidos a exportaciones / importaciones
 
-        # Pivotar para tener CRE y DEB como columnas separadas
+        # Pivotar para tener exportaciones e importaciones como columnas separadas
         df_pivot = df_raw.pivot_table(
             index=['fecha', 'pais', 'bop_item'],
             columns='stk_flow',
@@ -331,31 +450,6 @@ def load_services_data():
 
         df_pivot.columns.name = None
 
-        # Renombrar columnas CRE -> exportaciones, DEB -> importaciones
-        column_mapping = {}
-        for col in df_pivot.columns:
-            if col == 'Credit':
-                column_mapping[col] = 'exportaciones'
-            elif col == 'Debit':
-                column_mapping[col] = 'importaciones'
-
-        df_pivot = df_pivot.rename(columns=column_mapping)
-
-        # Si no hay las columnas esperadas, intentar nombres alternativos
-        if 'exportaciones' not in df_pivot.columns:
-            # Buscar cualquier columna que contenga 'cre' o 'credit'
-            for col in df_pivot.columns:
-                if 'cre' in str(col).lower() or 'credit' in str(col).lower():
-                    df_pivot = df_pivot.rename(columns={col: 'exportaciones'})
-                    break
-
-        if 'importaciones' not in df_pivot.columns:
-            # Buscar cualquier columna que contenga 'deb' or 'debit'
-            for col in df_pivot.columns:
-                if 'deb' in str(col).lower() or 'debit' in str(col).lower():
-                    df_pivot = df_pivot.rename(columns={col: 'importaciones'})
-                    break
-
         # Asegurar que existen las columnas
         if 'exportaciones' not in df_pivot.columns:
             df_pivot['exportaciones'] = 0
@@ -368,20 +462,14 @@ def load_services_data():
         df_raw = df_pivot
 
         # Añadir sector según bop_item
-        df_raw['sector'] = df_raw['bop_item'].map({
-            'Services': 'Servicios',
-            'Services: transport': 'Servicios de Transporte',
-            'S': 'Servicios',
-            'SC': 'Servicios (comerciales)',
-            'CA': 'Cuenta Corriente'
-        }).fillna('Servicios')
+        df_raw['sector'] = translate(df_raw['bop_item'], names['bop_item']).fillna('Servicios')
 
         df_raw['tipo'] = 'Servicios'
 
         # Seleccionar columnas necesarias
         df_result = df_raw[['fecha', 'pais', 'sector', 'exportaciones', 'importaciones', 'balance', 'tipo']]
 
-        return df_result
+        return compact_balance(df_result)
 
     except Exception as e:
         # Mostrar error solo si no es un DataFrame vacío esperado
@@ -389,69 +477,261 @@ def load_services_data():
         return pd.DataFrame()
 
 
-@st.cache_data(ttl=3600)
-def load_partners_data(country_code, data_type='goods'):
+def load_balance_data(pais, years=None):
+    """Bienes + servicios de un país para la pestaña 1 (compartido, solo lectura)"""
+    return load_versioned(_load_balance_data, (goods_version(pais), services_version()), pais, years,
+                          max_entries=TABLE_CACHE_ENTRIES)
+
+
+@st.cache_resource(max_entries=TABLE_CACHE_ENTRIES)
+def _load_balance_data(pais, years, version):
+    df_goods = load_goods_data(pais, years)
+    df_services = load_services_data()
+    if df_services.empty:
+        return df_goods
+    return pd.concat([df_goods, df_services[df_services['pais'] == pais]], ignore_index=True)
+
+
+@st.cache_resource(max_entries=TABLE_CACHE_ENTRIES)
+def _load_balance_sums(pais, years, with_services, version):
+    df = load_balance_data(pais, years) if with_services else load_goods_data(pais, years)
+    return PeriodSums(df[df['pais'] == pais], keys=['sector'], values=BALANCE_VALUES)
+
+
+def load_balance_sums(pais, years=None, with_services=False):
+    """
+    Series por sector y mes de la pestaña 1 con sus sumas acumuladas (period_sums), compartidas.
+    with_services: bienes + servicios (load_balance_data), si no solo bienes
+    """
+    version = (goods_version(pais), services_version()) if with_services else goods_version(pais)
+    return load_versioned(_load_balance_sums, version, pais, years, with_services,
+                          max_entries=TABLE_CACHE_ENTRIES)
+
+
+@st.cache_resource
+def _load_trade_cube(version):
+    return open_cube()
+
+
+def load_trade_cube():
+    """
+    Cubo de socios de bienes en memory-mapped (ver trade_cube), compartido entre sesiones.
+    Se vuelve a abrir cuando el ETL lo reconstruye. None si no existe o está desfasado
+    respecto a los CSV.
     """
-    Carga datos de socios comerciales para un país específico.
+    if not cube_is_current():
+        return None
+    signature = file_signature(CUBE_DIR / AXES_FILE)
+    return load_versioned(_load_trade_cube, tuple(signature))
+
+
+def load_partners_data(country_code, data_type='goods', years=None):
+    """
+    Carga datos de socios comerciales para un país específico (compartido, solo lectura).
 
     Args:
         country_code: Código ISO del país (e.g., 'ES', 'FR', 'DE')
         data_type: 'goods' (bienes) o 'services' (servicios)
+        years: (primer año, último año); solo se leen esas particiones (None = todos)
 
     Returns:
-        dict: Diccionario con DataFrames de imports, exports y combined
-              None si no existen los datos
+        Mapping: DataFrames de imports, exports y sus totales mensuales (de solo lectura)
+                 None si no existen los datos
     """
-    from pathlib import Path
+    return load_versioned(_load_partners_data, partners_version(country_code, data_type),
+                          country_code, data_type, years, max_entries=TABLE_CACHE_ENTRIES)
+
+
+def partners_cached(country_code, data_type='goods', years=None):
+    """True si load_partners_data(...) está en caché con la versión actual de los datos"""
+    version = cached_version(_load_partners_data, country_code, data_type, years)
+    return version is not None and version == partners_version(country_code, data_type)
 
-    if data_type == 'goods':
-        cache_dir = Path('data/partners')
-        prefix = 'partners'
-    else:  # services
-        cache_dir = Path('data/partners_services')
-        prefix = 'services_partners'
 
-    imports_file = cache_dir / f'{prefix}_{country_code}_imports.csv'
-    exports_file = cache_dir / f'{prefix}_{country_code}_exports.csv'
+@st.cache_resource(max_entries=TABLE_CACHE_ENTRIES)
+def _load_partners_data(country_code, data_type, years, version):
+    imports_file, exports_file = partner_files(country_code, data_type)
 
-    if not imports_file.exists() or not exports_file.exists():
+    if not table_exists(imports_file) or not table_exists(exports_file):
         return None
 
     try:
-        df_imports = pd.read_csv(imports_file)
-        df_exports = pd.read_csv(exports_file)
+        use_sql = sql_is_current(imports_file) and sql_is_current(exports_file)
+        cube = load_trade_cube() if data_type == 'goods' and not use_sql else None
+        if use_sql:
+            # Consulta indexada en SQLite (sql_store)
+            row_columns = ['partner', 'product', 'period'] if data_type == 'goods' else ['partner', 'period']
+            df_imports = query(imports_file, row_columns, periods=year_periods(years))
+            df_exports = query(exports_file, row_columns, periods=year_periods(years))
+        elif cube is not None and cube.has('reporter', country_code):
+            # Vista del cubo: solo se leen las páginas del reporter/flujo y meses pedidos
+            df_imports = cube.frame(country_code, 'imports', year_periods(years))[PARTNER_COLUMNS[data_type]]
+            df_exports = cube.frame(country_code, 'exports', year_periods(years))[PARTNER_COLUMNS[data_type]]
+        else:
+            # Solo las columnas que usa el widget (sin STRUCTURE, freq, indicators...)
+            df_imports = read_partitions(imports_file, years=years, columns=PARTNER_COLUMNS[data_type])
+            df_exports = read_partitions(exports_file, years=years, columns=PARTNER_COLUMNS[data_type])
 
         # Añadir columna de flujo
         df_imports['flow_type'] = 'Importaciones'
         df_exports['flow_type'] = 'Exportaciones'
 
         # Convertir TIME_PERIOD a datetime
-        df_imports['fecha'] = pd.to_datetime(df_imports['TIME_PERIOD'])
-        df_exports['fecha'] = pd.to_datetime(df_exports['TIME_PERIOD'])
+        for df in (df_imports, df_exports):
+            df['fecha'] = month_dates(df['TIME_PERIOD'])
 
-        # Para bienes: convertir product a string
+        # Para bienes: product viene de la caché
         # Para servicios: no hay columna product (solo TOTAL)
-        if data_type == 'goods' and 'product' in df_imports.columns:
-            df_imports['product'] = df_imports['product'].astype(str)
-            df_exports['product'] = df_exports['product'].astype(str)
-        elif data_type == 'services':
+        if data_type == 'services':
             # Añadir columna product='TOTAL' para compatibilidad
             df_imports['product'] = 'TOTAL'
             df_exports['product'] = 'TOTAL'
 
-        return {
+        # Representación compacta: claves category, TIME_PERIOD como índice de mes
+        df_imports = compact_partners(df_imports)
+        df_exports = compact_partners(df_exports)
+
+        # Agregados precalculados por el ETL (partner_rollups); si faltan o están
+        # desfasados se calculan aquí con la misma función
+        rollups = {}
+        for flow_key, csv_file, df in (('imports', imports_file, df_imports), ('exports', exports_file, df_exports)):
+            flow_rollups = read_rollups(csv_file)
+            if flow_rollups is None and use_sql:
+                # Totales por socio/mes agregados en SQLite
+                flow_rollups = build_rollups(query(csv_file, ['partner', 'period'], periods=year_periods(years)))
+            elif flow_rollups is None:
+                flow_rollups = build_rollups(df)
+            elif years is not None:
+                flow_rollups = flow_rollups[flow_rollups['period'].str[:4].between(str(years[0]), str(years[1]))]
+            rollups[flow_key] = compact_frame(flow_rollups, keys=ROLLUP_KEYS)
+
+        imports_total = monthly_totals(rollups['imports'], 'Importaciones')
+        exports_total = monthly_totals(rollups['exports'], 'Exportaciones')
+
+        return MappingProxyType({
             'imports': df_imports,
             'exports': df_exports,
-            'combined': pd.concat([df_imports, df_exports], ignore_index=True)
-        }
+            'imports_total': imports_total,
+            'exports_total': exports_total,
+            'rollups': MappingProxyType(rollups),
+        })
     except Exception as e:
         st.warning(f"Error cargando datos de socios ({data_type}) para {country_code}: {e}")
         return None
 
 
+def monthly_totals(rollups, flow_type):
+    """Totales de todos los sectores por socio y mes (nivel 'M' de partner_rollups)"""
+    monthly = rollups[rollups['level'] == 'M']
+    return compact_partners(pd.DataFrame({
+        'partner': monthly['partner'].astype(str).to_numpy(),
+        'fecha': month_dates(monthly['period']).to_numpy(),
+        'TIME_PERIOD': monthly['period'].astype(str).to_numpy(),
+        'flow_type': flow_type,
+        'OBS_VALUE': monthly['OBS_VALUE'].to_numpy(),
+    }))
+
+
+def combine_totals(*frames):
+    """Suma totales mensuales de varias fuentes (p.ej. bienes + servicios) por socio/mes/flujo"""
+    combined = (pd.concat(frames, ignore_index=True)
+                .groupby(['partner', 'fecha', 'TIME_PERIOD', 'flow_type'], observed=True)['OBS_VALUE'].sum().reset_index())
+    return compact_partners(combined)
+
+
+def load_partners_combined(country_code, years=None):
+    """
+    Socios de bienes + servicios de un país (compartido, solo lectura), con columna tipo.
+    None si falta alguno de los dos (ver load_partners_data).
+    """
+    version = (partners_version(country_code, 'goods'), partners_version(country_code, 'services'))
+    return load_versioned(_load_partners_combined, version, country_code, years,
+                          max_entries=TABLE_CACHE_ENTRIES)
+
+
+@st.cache_resource(max_entries=TABLE_CACHE_ENTRIES)
+def _load_partners_combined(country_code, years, version):
+    partners_goods = load_partners_data(country_code, 'goods', years)
+    partners_services = load_partners_data(country_code, 'services', years)
+    if partners_goods is None or partners_services is None:
+        return None
+
+    frames = {}
+    for flow_key in ('imports', 'exports'):
+        frames[flow_key] = [partners_goods[flow_key].assign(tipo='Bienes'),
+                            partners_services[flow_key].assign(tipo='Servicios')]
+    return MappingProxyType({
+        'imports': compact_partners(pd.concat(frames['imports'], ignore_index=True)),
+        'exports': compact_partners(pd.concat(frames['exports'], ignore_index=True)),
+        'imports_total': combine_totals(partners_goods['imports_total'], partners_services['imports_total']),
+        'exports_total': combine_totals(partners_goods['exports_total'], partners_services['exports_total']),
+    })
+
+
+@st.cache_resource(max_entries=TABLE_CACHE_ENTRIES)
+def _load_partner_series(country_code, data_types, years, version):
+    if len(data_types) == 2:
+        partners_data = load_partners_combined(country_code, years)
+    else:
+        partners_data = load_partners_data(country_code, data_types[0], years)
+    return None if partners_data is None else PartnerSeries(partners_data)
+
+
+def load_partner_series(country_code, data_types, years=None):
+    """
+    Series mensuales de socios de un país (partner_series) para la pestaña 2, compartidas.
+    data_types: ('goods',), ('services',) o ('goods', 'services')
+    """
+    version = tuple(partners_version(country_code, data_type) for data_type in data_types)
+    return load_versioned(_load_partner_series, version, country_code, data_types, years,
+                          max_entries=TABLE_CACHE_ENTRIES)
+
+
+# Precarga en segundo plano (prefetch.py): memoria máxima de lo precargado y
+# países más vistos que se cargan al arrancar (además del país por defecto)
+PREFETCH_BUDGET_MB = float(os.environ.get('BALANZA_PREFETCH_MB', '512'))
+PREFETCH_TOP_COUNTRIES = 4
+PAIS_POR_DEFECTO = 'España'
+
+
+def partners_memory(partners_data):
+    """Bytes de las tablas de un resultado de load_partners_data"""
+    total = 0
+    for value in partners_data.values():
+        frames = value.values() if isinstance(value, MappingProxyType) else [value]
+        total += sum(frame_memory(df) for df in frames)
+    return total
+
+
+def default_years(pais):
+    """Años del periodo que muestra el selector de fechas al elegir un país"""
+    bounds = load_goods_period(pais)
+    return None if bounds is None else (bounds[0].year, bounds[1].year)
+
+
+@st.cache_resource
+def get_prefetcher():
+    """
+    Precarga compartida por todas las sesiones. Se crea con la primera sesión (arranque
+    del servidor) y encola los socios de bienes y servicios del país por defecto y de
+    los más vistos, con su periodo por defecto.
+    """
+    prefetcher = Prefetcher(load_partners_data, PREFETCH_BUDGET_MB * 1_000_000, size=partners_memory,
+                            cached=partners_cached)
+    paises_disponibles = load_goods_countries()
+    for pais in dict.fromkeys([PAIS_POR_DEFECTO] + most_viewed(PREFETCH_TOP_COUNTRIES)):
+        if pais not in paises_disponibles or pais not in CODIGO_PAIS:
+            continue
+        years = default_years(pais)
+        for data_type in ('goods', 'services'):
+            prefetcher.submit(CODIGO_PAIS[pais], data_type, years)
+    return prefetcher
+
+
 # --- CARGA DE DATOS ---
+# Mercancías se carga por país y periodo (ver más abajo); aquí solo la lista de países
 try:
-    df_goods = load_goods_data()
+    paises = load_goods_countries()
     df_services = load_services_data()
 except Exception as e:
     st.error(f"Error cargando datos: {e}")
@@ -460,16 +740,14 @@ except Exception as e:
 # --- SIDEBAR (CONFIGURACIÓN) ---
 st.sidebar.title("Configuración")
 
-# Preparar ambos datasets (siempre)
-df_full_goods = df_goods
+# Servicios (pequeño) se mantiene completo
 df_full_services = df_services if not df_services.empty else None
 
 # 1. Selector de País (usa bienes como base)
-paises = sorted(df_full_goods['pais'].unique())
 
 # Mantener selección de país al cambiar entre modos
 if 'pais_seleccionado' not in st.session_state:
-    st.session_state.pais_seleccionado = 'España' if 'España' in paises else paises[0]
+    st.session_state.pais_seleccionado = PAIS_POR_DEFECTO if PAIS_POR_DEFECTO in paises else paises[0]
 
 # Verificar que el país seleccionado existe en los datos actuales
 if st.session_state.pais_seleccionado not in paises:
@@ -483,12 +761,15 @@ pais_sel = st.sidebar.selectbox("País", paises, index=idx_def, key='selector_pa
 if pais_sel != st.session_state.pais_seleccionado:
     st.session_state.pais_seleccionado = pais_sel
 
+# Contar la vista del país (una vez por cambio de país) para la precarga al arrancar
+prefetcher = get_prefetcher()
+if st.session_state.get('pais_contado') != pais_sel:
+    st.session_state.pais_contado = pais_sel
+    record_view(pais_sel)
+
 # 2. Selector de Rango temporal
 # Usar bienes para determinar fechas disponibles (dataset más completo)
-df_temp = df_full_goods[df_full_goods['pais'] == pais_sel].sort_values('fecha')
-fechas_disponibles = sorted(df_temp['fecha'].unique())
-min_date = fechas_disponibles[0].date()
-max_date = fechas_disponibles[-1].date()
+min_date, max_date = (fecha.date() for fecha in load_goods_period(pais_sel))
 
 st.sidebar.subheader("Periodo de Análisis")
 
@@ -514,6 +795,15 @@ with col2:
 start_datetime = pd.to_datetime(start_date)
 end_datetime = pd.to_datetime(end_date)
 
+# Años del periodo: los loaders solo leen esas particiones
+periodo_anios = (start_date.year, end_date.year)
+
+try:
+    sums_goods = load_balance_sums(pais_sel, periodo_anios)
+except Exception as e:
+    st.error(f"Error cargando datos: {e}")
+    st.stop()
+
 # --- DASHBOARD ---
 st.title(f"🌍 Balanza Comercial: {pais_sel}")
 date_str_start = start_datetime.strftime('%B %Y')
@@ -538,20 +828,20 @@ with tab1:
 
     # Determinar qué datos usar según el modo seleccionado
     if modo == "Solo Bienes":
-        df_full = df_full_goods
+        sums = sums_goods
         modo_activo = "Solo Bienes"
     elif df_full_services is None:
         # Usuario seleccionó "Bienes + Servicios" pero no hay datos de servicios
-        df_full = df_full_goods
+        sums = sums_goods
         modo_activo = "Solo Bienes"
         st.warning("⚠️ **Datos de servicios no disponibles** - Mostrando solo mercancías")
     else:
-        # Combinar bienes y servicios
-        df_full = pd.concat([df_full_goods, df_full_services], ignore_index=True)
+        # Combinar bienes y servicios (una vez por país y periodo, compartido entre sesiones)
+        sums = load_balance_sums(pais_sel, periodo_anios, with_services=True)
         modo_activo = "Bienes + Servicios"
 
         # --- PROTECCIÓN CONTRA EFECTO ACANTILADO ---
-        max_fecha_bienes = df_full_goods['fecha'].max()
+        max_fecha_bienes = load_goods_period()[1]  # Último mes de todos los países
         max_fecha_servicios = df_full_services['fecha'].max()
 
         # Almacenar fecha de corte
@@ -564,13 +854,11 @@ with tab1:
 
     st.divider()
 
-    # Filtrar datos por país
-    df_pais = df_full[df_full['pais'] == pais_sel].sort_values('fecha')
-
     # --- APLICAR CORTE DE FECHA EN MODO BIENES + SERVICIOS ---
+    fin_periodo = end_datetime
     if modo_activo == "Bienes + Servicios" and 'fecha_corte_servicios' in st.session_state:
         # Limitar a la fecha máxima donde ambos datasets tienen datos
-        df_pais = df_pais[df_pais['fecha'] <= st.session_state.fecha_corte_servicios]
+        fin_periodo = min(end_datetime, st.session_state.fecha_corte_servicios)
 
     # Advertencia si el país no tiene datos de servicios en modo "Bienes + Servicios"
     if modo_activo == "Bienes + Servicios" and df_full_services is not None:
@@ -578,23 +866,21 @@ with tab1:
         if not pais_tiene_servicios:
             st.warning(f"⚠️ {pais_sel} no tiene datos de servicios BOP disponibles. Mostrando solo mercancías.")
 
-    # FILTRADO DINÁMICO por periodo
-    df_filtrado = df_pais[
-        (df_pais['fecha'] >= start_datetime) &
-        (df_pais['fecha'] <= end_datetime)
-    ]
+    # FILTRADO DINÁMICO por periodo: los totales por sector son diferencias de las sumas
+    # acumuladas (dos posiciones por sector), sin recorrer filas ni meses
+    totales_sector = sums.totals(start_datetime, fin_periodo)
 
     # --- 1. KPIs ---
-    df_total_comercio = df_filtrado[df_filtrado['sector'] == 'Total Comercio']
-
-    if df_total_comercio.empty:
-        df_agrupado = df_filtrado.groupby('fecha')[['exportaciones', 'importaciones', 'balance']].sum().reset_index()
+    if 'Total Comercio' in totales_sector.index:
+        df_agrupado = sums.monthly(start_datetime, fin_periodo, ['Total Comercio']).reset_index()
+        totales_kpi = totales_sector.loc['Total Comercio']
     else:
-        df_agrupado = df_total_comercio.groupby('fecha')[['exportaciones', 'importaciones', 'balance']].sum().reset_index()
+        df_agrupado = sums.monthly(start_datetime, fin_periodo).reset_index()
+        totales_kpi = totales_sector.sum()
 
-    tot_exp = df_agrupado['exportaciones'].sum()
-    tot_imp = df_agrupado['importaciones'].sum()
-    tot_bal = df_agrupado['balance'].sum()
+    tot_exp = totales_kpi['exportaciones']
+    tot_imp = totales_kpi['importaciones']
+    tot_bal = totales_kpi['balance']
     cobertura = (tot_exp / tot_imp * 100) if tot_imp > 0 else 0
 
     c1, c2, c3, c4 = st.columns(4)
@@ -657,11 +943,9 @@ with tab1:
     st.subheader("🔍 Desglose por Sectores (Acumulado)")
     st.caption(f"Suma total de exportaciones e importaciones desde {date_str_start} hasta {date_str_end}")
 
-    # Filtramos para quitar el total y quedarnos solo con sectores
-    df_sectores = df_filtrado[df_filtrado['sector'] != 'Total Comercio']
-
-    # AGRUPACIÓN DINÁMICA
-    df_sectores_agrupado = df_sectores.groupby('sector')[['exportaciones', 'importaciones']].sum().reset_index()
+    # Quitamos el total y nos quedamos solo con sectores (totales del periodo ya calculados)
+    df_sectores_agrupado = (totales_sector.drop(index='Total Comercio', errors='ignore')
+                            [['exportaciones', 'importaciones']].rename_axis('sector').reset_index())
 
     # Calculamos volumen total para ordenar
     df_sectores_agrupado['Volumen Total'] = df_sectores_agrupado['exportaciones'] + df_sectores_agrupado['importaciones']
@@ -724,28 +1008,36 @@ with tab2:
         help="Bienes: Mercancías físicas (40 socios, 10 sectores) | Servicios: Turismo, transporte, etc. (32 socios, solo total)"
     )
 
+    # Precargar en segundo plano el otro tipo de comercio del país, solo con su periodo
+    # por defecto (cada rango de fechas sería otra entrada de caché completa)
+    if periodo_anios == default_years(pais_sel):
+        if data_type_option == "Bienes":
+            prefetcher.submit(country_code, 'services', periodo_anios)
+        elif data_type_option == "Servicios":
+            prefetcher.submit(country_code, 'goods', periodo_anios)
+
     # Cargar datos según selección
     if data_type_option == "Bienes":
-        partners_data = load_partners_data(country_code, 'goods')
-        if partners_data is None:
+        if load_partners_data(country_code, 'goods', periodo_anios) is None:
             st.warning("⚠️ Datos de socios de bienes no disponibles.")
             st.info("Ejecuta: `python etl_partners.py`")
             st.stop()
+        partner_types = ('goods',)
         show_sectors = True
         data_label = "Bienes"
 
     elif data_type_option == "Servicios":
-        partners_data = load_partners_data(country_code, 'services')
-        if partners_data is None:
+        if load_partners_data(country_code, 'services', periodo_anios) is None:
             st.warning("⚠️ Datos de socios de servicios no disponibles.")
             st.info("Ejecuta: `python etl_partners_services.py`")
             st.stop()
+        partner_types = ('services',)
         show_sectors = False  # Servicios solo tiene TOTAL
         data_label = "Servicios"
 
     else:  # Bienes + Servicios
-        partners_goods = load_partners_data(country_code, 'goods')
-        partners_services = load_partners_data(country_code, 'services')
+        partners_goods = load_partners_data(country_code, 'goods', periodo_anios)
+        partners_services = load_partners_data(country_code, 'services', periodo_anios)
 
         if partners_goods is None and partners_services is None:
             st.warning("⚠️ No hay datos de socios disponibles.")
@@ -756,33 +1048,14 @@ with tab2:
             """)
             st.stop()
 
-        # Combinar datos
+        # Combinar datos (se combinan una vez por país y periodo, compartido entre sesiones)
         if partners_goods is not None and partners_services is not None:
-            # Combinar imports
-            df_imp_goods = partners_goods['imports'].copy()
-            df_imp_services = partners_services['imports'].copy()
-            df_imp_goods['tipo'] = 'Bienes'
-            df_imp_services['tipo'] = 'Servicios'
-
-            # Combinar exports
-            df_exp_goods = partners_goods['exports'].copy()
-            df_exp_services = partners_services['exports'].copy()
-            df_exp_goods['tipo'] = 'Bienes'
-            df_exp_services['tipo'] = 'Servicios'
-
-            partners_data = {
-                'imports': pd.concat([df_imp_goods, df_imp_services], ignore_index=True),
-                'exports': pd.concat([df_exp_goods, df_exp_services], ignore_index=True),
-                'combined': pd.concat([
-                    df_imp_goods, df_imp_services,
-                    df_exp_goods, df_exp_services
-                ], ignore_index=True)
-            }
+            partner_types = ('goods', 'services')
         elif partners_goods is not None:
-            partners_data = partners_goods
+            partner_types = ('goods',)
             st.info("⚠️ Solo datos de bienes disponibles (falta servicios)")
         else:
-            partners_data = partners_services
+            partner_types = ('services',)
             st.info("⚠️ Solo datos de servicios disponibles (falta bienes)")
 
         show_sectors = False  # En modo combinado, no mostrar sectores
@@ -825,28 +1098,13 @@ with tab2:
                 top_n_options.append(40)
             top_n = st.selectbox("Top N socios", top_n_options, index=1)
 
-    # Filtrar por flujo
-    if flow_option == "Importaciones":
-        df_display = partners_data['imports'].copy()
-    elif flow_option == "Exportaciones":
-        df_display = partners_data['exports'].copy()
-    else:
-        df_display = partners_data['combined'].copy()
-
-    # Filtrar por sector o calcular TOTAL
-    if sector_sel == 'TOTAL':
-        # Sumar todos los sectores (0-9)
-        df_display = df_display.groupby(['partner', 'fecha', 'TIME_PERIOD', 'flow_type'])['OBS_VALUE'].sum().reset_index()
-    else:
-        df_display = df_display[df_display['product'] == sector_sel]
-
-    # Filtrar por fechas (reutilizar start_date, end_date del sidebar)
-    df_display = df_display[
-        (df_display['fecha'] >= start_datetime) &
-        (df_display['fecha'] <= end_datetime)
-    ]
+    # Series de la consulta (país, tipo de datos, sector, fechas) en una pasada (partner_series):
+    # KPIs, gráficos y tablas salen del mismo resumen, memorizado
+    flows = FLOWS if flow_option == "Ambos" else [flow_option]
+    series = load_partner_series(country_code, partner_types, periodo_anios)
+    summary = series.summary(sector_sel, start_datetime, end_datetime)
 
-    if df_display.empty:
+    if summary.empty or not summary.present[flows].to_numpy().any():
         st.warning("⚠️ No hay datos disponibles para el período y sector seleccionado")
         st.stop()
 
@@ -858,25 +1116,8 @@ with tab2:
 
     # Calcular totales y top socio
     if flow_option == "Ambos":
-        # Usar datos completos del periodo con filtros de sector
-        df_imp_kpi = partners_data['imports'].copy()
-        df_exp_kpi = partners_data['exports'].copy()
-
-        # Filtrar por sector y fechas
-        if sector_sel == 'TOTAL':
-            df_imp_kpi = df_imp_kpi[(df_imp_kpi['fecha'] >= start_datetime) & (df_imp_kpi['fecha'] <= end_datetime)]
-            df_exp_kpi = df_exp_kpi[(df_exp_kpi['fecha'] >= start_datetime) & (df_exp_kpi['fecha'] <= end_datetime)]
-            imp_total = df_imp_kpi.groupby('partner')['OBS_VALUE'].sum()
-            exp_total = df_exp_kpi.groupby('partner')['OBS_VALUE'].sum()
-        else:
-            df_imp_kpi = df_imp_kpi[(df_imp_kpi['product'] == sector_sel) &
-                                     (df_imp_kpi['fecha'] >= start_datetime) &
-                                     (df_imp_kpi['fecha'] <= end_datetime)]
-            df_exp_kpi = df_exp_kpi[(df_exp_kpi['product'] == sector_sel) &
-                                     (df_exp_kpi['fecha'] >= start_datetime) &
-                                     (df_exp_kpi['fecha'] <= end_datetime)]
-            imp_total = df_imp_kpi.groupby('partner')['OBS_VALUE'].sum()
-            exp_total = df_exp_kpi.groupby('partner')['OBS_VALUE'].sum()
+        imp_total = summary.partner_totals(['Importaciones'])
+        exp_total = summary.partner_totals(['Exportaciones'])
 
         total_imp = imp_total.sum()
         total_exp = exp_total.sum()
@@ -919,7 +1160,7 @@ with tab2:
 
     else:
         # Modo simple (solo imports o exports)
-        totales_kpi = df_display.groupby('partner')['OBS_VALUE'].sum()
+        totales_kpi = summary.partner_totals(flows)
         total_valor = totales_kpi.sum()
         top_socio_code = totales_kpi.idxmax() if not totales_kpi.empty else 'N/A'
         top_socio_valor = totales_kpi.max() if not totales_kpi.empty else 0
@@ -949,28 +1190,10 @@ with tab2:
     st.subheader(f"📊 Top {top_n} Socios - {data_label}: {sector_label}")
 
     if flow_option == "Ambos":
-        # Barras lado a lado (imports vs exports)
-        df_imports_total = partners_data['imports'].copy()
-        df_exports_total = partners_data['exports'].copy()
-
-        # Filtrar por fechas
-        df_imports_total = df_imports_total[(df_imports_total['fecha'] >= start_datetime) &
-                                             (df_imports_total['fecha'] <= end_datetime)]
-        df_exports_total = df_exports_total[(df_exports_total['fecha'] >= start_datetime) &
-                                             (df_exports_total['fecha'] <= end_datetime)]
-
-        # Filtrar por sector
-        if sector_sel == 'TOTAL':
-            df_imports_total = df_imports_total.groupby('partner')['OBS_VALUE'].sum()
-            df_exports_total = df_exports_total.groupby('partner')['OBS_VALUE'].sum()
-        else:
-            df_imports_total = df_imports_total[df_imports_total['product'] == sector_sel].groupby('partner')['OBS_VALUE'].sum()
-            df_exports_total = df_exports_total[df_exports_total['product'] == sector_sel].groupby('partner')['OBS_VALUE'].sum()
-
-        # Combinar y ordenar por suma total
+        # Barras lado a lado (imports vs exports), ordenadas por suma total
         df_combined_total = pd.DataFrame({
-            'imports': df_imports_total,
-            'exports': df_exports_total
+            'imports': imp_total,
+            'exports': exp_total
         }).fillna(0)
         df_combined_total['total'] = df_combined_total['imports'] + df_combined_total['exports']
         df_combined_total['balance'] = df_combined_total['exports'] - df_combined_total['imports']
@@ -1012,7 +1235,7 @@ with tab2:
 
     else:
         # Barras simples
-        totales = df_display.groupby('partner')['OBS_VALUE'].sum().sort_values(ascending=False).head(top_n)
+        totales = summary.partner_totals(flows).sort_values(ascending=False).head(top_n)
 
         # Añadir nombres con banderas
         partner_labels = [format_partner_name(code) for code in totales.index]
@@ -1078,17 +1301,16 @@ with tab2:
     st.subheader("📈 Evolución Temporal (Top 5 Socios)")
 
     # Obtener top 5 socios
-    top5_partners = df_display.groupby('partner')['OBS_VALUE'].sum().nlargest(5).index
+    top5_partners = summary.partner_totals(flows).nlargest(5).index
 
     fig_line = go.Figure()
 
     for partner in top5_partners:
-        df_partner = df_display[df_display['partner'] == partner]
-        df_partner_monthly = df_partner.groupby('fecha')['OBS_VALUE'].sum().reset_index()
+        partner_monthly = summary.partner_months(partner, flows)
 
         fig_line.add_trace(go.Scatter(
-            x=df_partner_monthly['fecha'],
-            y=df_partner_monthly['OBS_VALUE'] / 1e9,
+            x=partner_monthly.index,
+            y=partner_monthly.values / 1e9,
             name=format_partner_name(partner),
             mode='lines+markers',
             line=dict(width=2)
@@ -1108,175 +1330,61 @@ with tab2:
     # --- TABLA DETALLADA ---
     st.subheader("📋 Datos Detallados por Mes")
 
-    # Si es modo "Bienes + Servicios", mostrar dos tablas separadas
-    if data_type_option == "Bienes + Servicios" and 'tipo' in df_display.columns:
+    # Si flow_option es "Ambos", balance neto (Exportaciones - Importaciones)
+    if flow_option == "Ambos":
+        df_pivot = summary.monthly({'Exportaciones': 1, 'Importaciones': -1})
+    else:
+        df_pivot = summary.monthly({flow_option: 1})
 
-        # TABLA 1: Solo Bienes
-        st.markdown("### 📦 Bienes (Mercancías)")
-        df_bienes = df_display[df_display['tipo'] == 'Bienes']
+    # Añadir columna total
+    df_pivot['TOTAL'] = df_pivot.sum(axis=1)
+    df_pivot = df_pivot.sort_values('TOTAL', ascending=False)
 
-        df_pivot_bienes = df_bienes.pivot_table(
-            values='OBS_VALUE',
-            index='partner',
-            columns='TIME_PERIOD',
-            aggfunc='sum',
-            fill_value=0
-        )
-
-        df_pivot_bienes['TOTAL'] = df_pivot_bienes.sum(axis=1)
-        df_pivot_bienes = df_pivot_bienes.sort_values('TOTAL', ascending=False)
+    # Formatear valores (millones EUR) y añadir nombres con banderas
+    df_pivot_display = df_pivot / 1e6
+    df_pivot_display.index = [format_partner_name(code) for code in df_pivot_display.index]
 
-        df_pivot_bienes_display = df_pivot_bienes / 1e6
-        df_pivot_bienes_display.index = [format_partner_name(code) for code in df_pivot_bienes_display.index]
+    if flow_option == "Ambos":
+        # Aplicar estilo con colores para balance
+        def color_balance(val):
+            if pd.isna(val):
+                return ''
+            color = 'color: #00CC96' if val >= 0 else 'color: #EF553B'
+            return color
 
         st.dataframe(
-            df_pivot_bienes_display.style.format("{:.1f}"),
+            df_pivot_display.style.format("{:.1f}").map(color_balance),
             width="stretch",
-            height=300
-        )
-
-        # Botón descarga bienes
-        csv_bienes = df_pivot_bienes.to_csv().encode('utf-8')
-        st.download_button(
-            label="📥 Descargar CSV - Bienes",
-            data=csv_bienes,
-            file_name=f"socios_bienes_{pais_sel}_{flow_option}_{start_date}_{end_date}.csv",
-            mime="text/csv",
-            key="download_bienes"
+            height=400
         )
 
-        st.markdown("---")
-
-        # TABLA 2: Total (Bienes + Servicios)
-        st.markdown("### 🌐 Total (Bienes + Servicios)")
-
-        df_pivot_total = df_display.pivot_table(
-            values='OBS_VALUE',
-            index='partner',
-            columns='TIME_PERIOD',
-            aggfunc='sum',
-            fill_value=0
-        )
-
-        df_pivot_total['TOTAL'] = df_pivot_total.sum(axis=1)
-        df_pivot_total = df_pivot_total.sort_values('TOTAL', ascending=False)
-
-        df_pivot_total_display = df_pivot_total / 1e6
-        df_pivot_total_display.index = [format_partner_name(code) for code in df_pivot_total_display.index]
+        st.caption("💡 Balance comercial en millones de euros (M€)")
+        st.caption("🟢 Verde = Superávit (exportamos más) | 🔴 Rojo = Déficit (importamos más)")
 
+    else:
+        # Formatear valores con estilo
         st.dataframe(
-            df_pivot_total_display.style.format("{:.1f}"),
+            df_pivot_display.style.format("{:.1f}"),
             width="stretch",
-            height=300
-        )
-
-        # Botón descarga total
-        csv_total = df_pivot_total.to_csv().encode('utf-8')
-        st.download_button(
-            label="📥 Descargar CSV - Total",
-            data=csv_total,
-            file_name=f"socios_total_{pais_sel}_{flow_option}_{start_date}_{end_date}.csv",
-            mime="text/csv",
-            key="download_total"
+            height=400
         )
 
         st.caption("💡 Valores en millones de euros (M€)")
-        st.caption(f"📊 {len(df_display['partner'].unique())} socios comerciales desde {date_str_start} hasta {date_str_end}")
 
-    else:
-        # Modo normal: una sola tabla (Bienes o Servicios)
-
-        # Si flow_option es "Ambos", calcular balance neto (Exportaciones - Importaciones)
-        if flow_option == "Ambos":
-            # Separar exportaciones e importaciones
-            df_exports = df_display[df_display['flow_type'] == 'exports']
-            df_imports = df_display[df_display['flow_type'] == 'imports']
-
-            # Crear pivots separados
-            df_pivot_exp = df_exports.pivot_table(
-                values='OBS_VALUE',
-                index='partner',
-                columns='TIME_PERIOD',
-                aggfunc='sum',
-                fill_value=0
-            )
-
-            df_pivot_imp = df_imports.pivot_table(
-                values='OBS_VALUE',
-                index='partner',
-                columns='TIME_PERIOD',
-                aggfunc='sum',
-                fill_value=0
-            )
-
-            # Calcular balance = Exportaciones - Importaciones
-            df_pivot = df_pivot_exp - df_pivot_imp
-
-            # Añadir columna total (balance total del periodo)
-            df_pivot['TOTAL'] = df_pivot.sum(axis=1)
-            df_pivot = df_pivot.sort_values('TOTAL', ascending=False)
-
-            # Formatear valores (millones EUR) y añadir nombres con banderas
-            df_pivot_display = df_pivot / 1e6
-            df_pivot_display.index = [format_partner_name(code) for code in df_pivot_display.index]
-
-            # Aplicar estilo con colores para balance
-            def color_balance(val):
-                if pd.isna(val):
-                    return ''
-                color = 'color: #00CC96' if val >= 0 else 'color: #EF553B'
-                return color
-
-            st.dataframe(
-                df_pivot_display.style.format("{:.1f}").applymap(color_balance),
-                width="stretch",
-                height=400
-            )
-
-            st.caption("💡 Balance comercial en millones de euros (M€)")
-            st.caption("🟢 Verde = Superávit (exportamos más) | 🔴 Rojo = Déficit (importamos más)")
-
-        else:
-            # Modo simple (solo imports o exports)
-            df_pivot = df_display.pivot_table(
-                values='OBS_VALUE',
-                index='partner',
-                columns='TIME_PERIOD',
-                aggfunc='sum',
-                fill_value=0
-            )
-
-            # Añadir columna total
-            df_pivot['TOTAL'] = df_pivot.sum(axis=1)
-            df_pivot = df_pivot.sort_values('TOTAL', ascending=False)
-
-            # Formatear valores (millones EUR) y añadir nombres con banderas
-            df_pivot_display = df_pivot / 1e6
-            df_pivot_display.index = [format_partner_name(code) for code in df_pivot_display.index]
-
-            # Formatear valores con estilo
-            st.dataframe(
-                df_pivot_display.style.format("{:.1f}"),
-                width="stretch",
-                height=400
-            )
-
-            st.caption("💡 Valores en millones de euros (M€)")
-
-        # Botón descarga
-        csv = df_pivot.to_csv().encode('utf-8')
-        flow_label = "balance" if flow_option == "Ambos" else flow_option.lower()
-        st.download_button(
-            label="📥 Descargar CSV",
-            data=csv,
-            file_name=f"socios_{pais_sel}_{flow_label}_{sector_sel}_{start_date}_{end_date}.csv",
-            mime="text/csv"
-        )
+    # Botón descarga
+    csv = df_pivot.to_csv().encode('utf-8')
+    flow_label = "balance" if flow_option == "Ambos" else flow_option.lower()
+    st.download_button(
+        label="📥 Descargar CSV",
+        data=csv,
+        file_name=f"socios_{pais_sel}_{flow_label}_{sector_sel}_{start_date}_{end_date}.csv",
+        mime="text/csv"
+    )
 
-        st.caption(f"📊 Mostrando datos de **{data_label}**: {len(df_display['partner'].unique())} socios comerciales en **{sector_label}** desde {date_str_start} hasta {date_str_end}")
+    st.caption(f"📊 Mostrando datos de **{data_label}**: {len(summary.partner_totals(flows))} socios comerciales en **{sector_label}** desde {date_str_start} hasta {date_str_end}")
 
 
 # Footer
 st.markdown("---")
-st.caption(f"Fuente: Eurostat DS-059331 (Bienes) + BOP_C6_M (Servicios) | Última actualización: {datetime.fromtimestamp(os.path.getmtime(CSV_CACHE_FILE_GOODS)).strftime('%Y-%m-%d %H:%M')}")
+st.caption(f"Fuente: Eurostat DS-059331 (Bienes) + BOP_C6_M (Servicios) | Última actualización: {datetime.fromtimestamp(table_mtime(CSV_CACHE_FILE_GOODS)).strftime('%Y-%m-%d %H:%M')}")
 st.caption("💶 Datos reales desde la API oficial de Eurostat")